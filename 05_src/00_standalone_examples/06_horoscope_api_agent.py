@@ -10,6 +10,9 @@ load_dotenv('.secrets')
 
 client = OpenAI()
 
+# Reuse one keep-alive connection pool for every call to the horoscope service.
+session = requests.Session()
+
 tools = [
     {
         "type": "function",
@@ -56,7 +59,7 @@ def get_horoscope_from_service(sign, day):
         "sign": sign.capitalize(),
         "day": day.upper()
     }
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params, timeout=10)
     return response
 
 def get_horoscope_from_response(sign, response):
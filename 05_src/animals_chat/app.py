@@ -1,8 +1,8 @@
-from animals_chat.main import get_animals_chat_agent
-from langchain_core.messages import HumanMessage, AIMessage
+from animals_chat.main import animals_chat_stream, get_animals_chat_agent
 import gradio as gr
 from dotenv import load_dotenv
 import os
+from typing import AsyncIterator
 
 from utils.logger import get_logger
 
@@ -12,25 +12,9 @@ llm = get_animals_chat_agent()
 
 load_dotenv('.secrets')
 
-def animals_chat(message: str, history: list[dict]) -> str:
-    langchain_messages = []
-    n = 0
-    _logs.debug(f"History: {history}")
-    for msg in history:
-        if msg['role'] == 'user':
-            langchain_messages.append(HumanMessage(content=msg['content']))
-        elif msg['role'] == 'assistant':
-            langchain_messages.append(AIMessage(content=msg['content']))
-            n += 1
-    langchain_messages.append(HumanMessage(content=message))
-
-    state = {
-        "messages": langchain_messages,
-        "llm_calls": n
-    }
-
-    response = llm.invoke(state)
-    return response['messages'][len(response['messages']) - 1].content
+async def animals_chat(message: str, history: list[dict], request: gr.Request = None) -> AsyncIterator[list[dict]]:
+    async for messages in animals_chat_stream(message, history, session_id=request.session_hash if request else None):
+        yield messages
 
 chat = gr.ChatInterface(
     fn=animals_chat,
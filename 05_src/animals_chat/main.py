@@ -1,17 +1,29 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
+import threading
+import time
 from typing import Literal
 from langgraph.graph import StateGraph, START, END
 from langchain.chat_models import init_chat_model
-from langchain.tools import tool
-from langchain_core.messages import AnyMessage, SystemMessage, ToolMessage
+from langchain_core.tools import StructuredTool
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
 from typing_extensions import TypedDict, Annotated
 import operator
 
 from dotenv import load_dotenv
+from functools import lru_cache
 from animals_chat.prompts import return_instructions_root
 import json
-import requests
+from utils.http_client import async_http_get, http_get
 from utils.logger import get_logger
+from utils.sessions import SessionStore, session_graph, thread_config
+from utils.streaming import astream_graph, history_to_messages
+from utils.timing import StepTimer
+from utils.tracing import record_usage, traced, traced_tool
 import os
+from typing import AsyncIterator, Optional
 
 
 _logs = get_logger(__name__)
@@ -21,78 +33,206 @@ load_dotenv(".secrets")
 
 
 
-@tool
-def get_cat_facts(n:int=1):
+CAT_FACTS_URL = "https://meowfacts.herokuapp.com/"
+DOG_FACTS_URL = "http://dogapi.dog/api/v2/facts"
+
+# Seconds a tool call may run before the model is told it timed out
+ANIMALS_TOOL_TIMEOUT = float(os.getenv("ANIMALS_TOOL_TIMEOUT", 15))
+# Seconds a tool call of a sync run may wait for a free worker before it is dropped
+ANIMALS_TOOL_QUEUE_TIMEOUT = float(os.getenv("ANIMALS_TOOL_QUEUE_TIMEOUT", ANIMALS_TOOL_TIMEOUT))
+# Tool calls that run at once: in the process for sync runs, per step for async runs
+ANIMALS_TOOL_WORKERS = int(os.getenv("ANIMALS_TOOL_WORKERS", 8))
+
+
+def _cat_facts(n:int=1):
     """
     Returns n cat facts from the Meowfacts API.
     """
-    url = "https://meowfacts.herokuapp.com/"
-    params = {
-        "count": n
-    }
-    response = requests.get(url, params=params)
-    resp_dict = json.loads(response.text)
+    response = http_get(CAT_FACTS_URL, params={"count": n})
+    return format_cat_facts(response.text)
+
+async def _acat_facts(n:int=1):
+    response = await async_http_get(CAT_FACTS_URL, params={"count": n})
+    return format_cat_facts(response.text)
+
+def format_cat_facts(text:str) -> str:
+    resp_dict = json.loads(text)
     facts_list = resp_dict.get("data", [])
     facts = "\n".join([f"{i+1}. {fact}\n" for i, fact in enumerate(facts_list)])
     return facts
 
-@tool
-def get_dog_facts(n:int=1):
+
+def _dog_facts(n:int=1):
     """
     Returns n dog facts from the Dog API.
     """
-    url = "http://dogapi.dog/api/v2/facts"
-    params = {
-        "limit": n
-    }
-    response = requests.get(url, params=params)
-    resp_dict = json.loads(response.text)
+    response = http_get(DOG_FACTS_URL, params={"limit": n})
+    return format_dog_facts(response.text)
+
+async def _adog_facts(n:int=1):
+    response = await async_http_get(DOG_FACTS_URL, params={"limit": n})
+    return format_dog_facts(response.text)
+
+def format_dog_facts(text:str) -> str:
+    resp_dict = json.loads(text)
     facts_list = resp_dict.get("data", [])
     facts = "\n".join([f"{i+1}. {fact['attributes']['body']}\n" for i, fact in enumerate(facts_list)])
     return facts
 
+
+get_cat_facts = traced_tool(StructuredTool.from_function(func=_cat_facts, coroutine=_acat_facts, name="get_cat_facts"))
+get_dog_facts = traced_tool(StructuredTool.from_function(func=_dog_facts, coroutine=_adog_facts, name="get_dog_facts"))
+
+SYSTEM_MESSAGE = SystemMessage(
+    content="You are a helpful assistant tasked with stating interesting and fun facts about cats and dogs."
+)
+
+tools = [get_cat_facts, get_dog_facts]
+tools_by_name = {tool.name: tool for tool in tools}
+
+timer = StepTimer("animals_chat")
+
+
+@lru_cache(maxsize=1)
 def get_model_with_tools():
+    """The chat model with the tools bound. Built on first use and shared by every step."""
     model = init_chat_model(
         "openai:gpt-4o-mini",
         temperature=0.7
     )
     # Augment the LLM with tools
-    tools = [get_cat_facts, get_dog_facts]
     model_with_tools = model.bind_tools(tools)
     return model_with_tools
 
 class MessagesState(TypedDict):
     messages: Annotated[list[AnyMessage], operator.add]
     llm_calls: int
+    # Per tool over the thread: calls, errors (timeouts included), total_ms, max_ms, last_ms
+    tool_timings: dict
 
 def llm_call(state: dict):
     """LLM decides whether to call a tool or not"""
-    model_with_tools = get_model_with_tools()
+    with timer.step("llm_call") as span:
+        response = get_model_with_tools().invoke([SYSTEM_MESSAGE] + state["messages"])
+        record_usage(span, response.usage_metadata)
     return {
-        "messages": [
-            model_with_tools.invoke(
-                [
-                    SystemMessage(
-                        content="You are a helpful assistant tasked with stating interesting and fun facts about cats and dogs."
-                    )
-                ]
-                + state["messages"]
-            )
-        ],
+        "messages": [response],
         "llm_calls": state.get('llm_calls', 0) + 1
     }
 
+async def allm_call(state: dict):
+    # Used by async runs (astream/ainvoke), so a waiting model call does not hold a worker thread
+    with timer.step("llm_call") as span:
+        response = await get_model_with_tools().ainvoke([SYSTEM_MESSAGE] + state["messages"])
+        record_usage(span, response.usage_metadata)
+    return {
+        "messages": [response],
+        "llm_calls": state.get('llm_calls', 0) + 1
+    }
+
+# Runs the tool calls of sync graph runs (invoke/stream)
+_tool_executor = ThreadPoolExecutor(max_workers=ANIMALS_TOOL_WORKERS, thread_name_prefix="animals-tool")
+
+
+def _tool_message(tool_call:dict, observation) -> ToolMessage:
+    return ToolMessage(content=observation, tool_call_id=tool_call["id"], name=tool_call["name"])
+
+def _error_message(tool_call:dict, error:str) -> ToolMessage:
+    # The model is told the call failed and can answer without it, instead of the turn failing
+    _logs.warning(f'Tool call {tool_call["name"]} failed: {error}')
+    return ToolMessage(content=f"Error: {error}", tool_call_id=tool_call["id"], name=tool_call["name"],
+                       status="error")
+
+def _timed_out(tool_call:dict) -> tuple[ToolMessage, float]:
+    return _error_message(tool_call, f"timed out after {ANIMALS_TOOL_TIMEOUT:g} s"), ANIMALS_TOOL_TIMEOUT * 1000
+
+def run_tool_call(tool_call:dict) -> tuple[ToolMessage, float]:
+    """Runs one tool call. Returns its ToolMessage and how long it took in ms."""
+    start = time.perf_counter()
+    try:
+        message = _tool_message(tool_call, tools_by_name[tool_call["name"]].invoke(tool_call["args"]))
+    except Exception as e:
+        message = _error_message(tool_call, repr(e))
+    return message, (time.perf_counter() - start) * 1000
+
+async def arun_tool_call(tool_call:dict, limit:asyncio.Semaphore) -> tuple[ToolMessage, float]:
+    async with limit:
+        start = time.perf_counter()
+        try:
+            observation = await asyncio.wait_for(tools_by_name[tool_call["name"]].ainvoke(tool_call["args"]),
+                                                 timeout=ANIMALS_TOOL_TIMEOUT)
+            message = _tool_message(tool_call, observation)
+        except asyncio.TimeoutError:
+            return _timed_out(tool_call)
+        except Exception as e:
+            message = _error_message(tool_call, repr(e))
+        return message, (time.perf_counter() - start) * 1000
+
+def add_tool_timings(timings:dict, results:list[tuple[ToolMessage, float]]) -> dict:
+    """Returns timings with the tool calls of one step added"""
+    timings = {name: dict(entry) for name, entry in (timings or {}).items()}
+    for message, ms in results:
+        entry = timings.setdefault(message.name, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+        entry["calls"] += 1
+        entry["errors"] += message.status == "error"
+        entry["total_ms"] = round(entry["total_ms"] + ms, 1)
+        entry["max_ms"] = round(max(entry["max_ms"], ms), 1)
+        entry["last_ms"] = round(ms, 1)
+    return timings
+
+class _QueuedToolCall:
+    """A tool call submitted to _tool_executor, which notes when a worker starts it"""
+
+    def __init__(self, tool_call:dict):
+        self.tool_call = tool_call
+        self.submitted = time.monotonic()
+        self.started = None
+        self._started = threading.Event()
+        self.future: Future = _tool_executor.submit(contextvars.copy_context().run, self._run)
+
+    def _run(self) -> tuple[ToolMessage, float]:
+        self.started = time.monotonic()
+        self._started.set()
+        return run_tool_call(self.tool_call)
+
+    def result(self) -> tuple[ToolMessage, float]:
+        """
+        Waits up to ANIMALS_TOOL_QUEUE_TIMEOUT for the call to start, then up to
+        ANIMALS_TOOL_TIMEOUT from its start for it to finish.
+        """
+        queued_for = ANIMALS_TOOL_QUEUE_TIMEOUT - (time.monotonic() - self.submitted)
+        if not self._started.wait(max(queued_for, 0)) and self.future.cancel():
+            return _error_message(self.tool_call, "not run, all tool workers are busy"), 0.0
+        self._started.wait()
+        try:
+            return self.future.result(timeout=max(self.started + ANIMALS_TOOL_TIMEOUT - time.monotonic(), 0))
+        except TimeoutError:
+            # A running thread cannot be stopped; the call holds its worker until the HTTP
+            # client's own timeout, and its result is dropped
+            return _timed_out(self.tool_call)
+
 def tool_node(state: dict):
-    """Performs the tool call"""
-    tools = [get_cat_facts, get_dog_facts]
-    tools_by_name = {tool.name: tool for tool in tools}
+    """Performs the tool calls concurrently, each for up to ANIMALS_TOOL_TIMEOUT seconds"""
+    tool_calls = state["messages"][-1].tool_calls
+    with timer.step("tool_node"):
+        queued = [_QueuedToolCall(tool_call) for tool_call in tool_calls]
+        # Collected in call order, so the ToolMessages follow the tool_calls of the model's message
+        results = [call.result() for call in queued]
+    return {
+        "messages": [message for message, _ in results],
+        "tool_timings": add_tool_timings(state.get("tool_timings"), results)
+    }
 
-    result = []
-    for tool_call in state["messages"][-1].tool_calls:
-        tool = tools_by_name[tool_call["name"]]
-        observation = tool.invoke(tool_call["args"])
-        result.append(ToolMessage(content=observation, tool_call_id=tool_call["id"]))
-    return {"messages": result}
+async def atool_node(state: dict):
+    # The tools' coroutines use the pooled async HTTP client; gather keeps the call order
+    tool_calls = state["messages"][-1].tool_calls
+    limit = asyncio.Semaphore(ANIMALS_TOOL_WORKERS)
+    with timer.step("tool_node"):
+        results = await asyncio.gather(*(arun_tool_call(tool_call, limit) for tool_call in tool_calls))
+    return {
+        "messages": [message for message, _ in results],
+        "tool_timings": add_tool_timings(state.get("tool_timings"), results)
+    }
 
 def should_continue(state: MessagesState) -> Literal["tool_node", END]:
     """Decide if we should continue the loop or stop based upon whether the LLM made a tool call"""
@@ -107,21 +247,60 @@ def should_continue(state: MessagesState) -> Literal["tool_node", END]:
     # Otherwise, we stop (reply to the user)
     return END
 
+@lru_cache(maxsize=1)
 def get_animals_chat_agent():
-    """Returns the animals chat agent"""    
-    # Build workflow
-    agent_builder = StateGraph(MessagesState)
-
-    # Add nodes
-    agent_builder.add_node("llm_call", llm_call)
-    agent_builder.add_node("tool_node", tool_node)
-
-    # Add edges to connect nodes
-    agent_builder.add_edge(START, "llm_call")
-    agent_builder.add_conditional_edges(
-        "llm_call",
-        should_continue,
-        ["tool_node", END]
-    )
-    agent_builder.add_edge("tool_node", "llm_call")
-    return agent_builder.compile()
\ No newline at end of file
+    """Returns the animals chat agent, compiled once and reused across turns and threads"""
+    with timer.startup():
+        get_model_with_tools()
+        # Build workflow
+        agent_builder = StateGraph(MessagesState)
+
+        # Add nodes
+        agent_builder.add_node("llm_call", RunnableLambda(llm_call, allm_call, name="llm_call"))
+        agent_builder.add_node("tool_node", RunnableLambda(tool_node, atool_node, name="tool_node"))
+
+        # Add edges to connect nodes
+        agent_builder.add_edge(START, "llm_call")
+        agent_builder.add_conditional_edges(
+            "llm_call",
+            should_continue,
+            ["tool_node", END]
+        )
+        agent_builder.add_edge("tool_node", "llm_call")
+        agent = agent_builder.compile()
+    return agent
+
+
+sessions = SessionStore("animals_chat", checkpoints=True)
+
+
+@traced("animals_chat.turn", "server")
+async def animals_chat_stream(message: str, history: list[dict] = [],
+                              session_id: Optional[str] = None) -> AsyncIterator[list[dict]]:
+    """
+    Runs one chat turn on the agent, yielding the reply as chat messages while it is generated.
+    Sessions with a session_id resume their checkpointed thread; other turns run from history alone, unsaved.
+    """
+    _logs.debug("History: %s", history)
+    session = await sessions.abegin_turn(session_id, history)
+    if session.resumed:
+        # The conversation so far is in the checkpointer; only the new message is sent
+        state = {"messages": [HumanMessage(content=message)]}
+    else:
+        langchain_messages, n = history_to_messages(history)
+        langchain_messages.append(HumanMessage(content=message))
+        state = {
+            "messages": langchain_messages,
+            "llm_calls": n
+        }
+
+    # Opening the checkpointer on first use is blocking I/O
+    agent = await asyncio.to_thread(session_graph, get_animals_chat_agent(), session)
+    completed = False
+    try:
+        async for messages in astream_graph(agent, state, thread_config(session)):
+            yield messages
+        completed = True
+    finally:
+        # Also when the client goes away mid-stream, so the session does not resume a partial thread
+        await sessions.aend_turn(session, history, completed=completed)
@@ -0,0 +1,41 @@
+import time
+
+import numpy as np
+
+
+def percentiles(latencies:list[float]) -> dict:
+    '''
+    Summarizes latencies (in seconds) as p50/p95/p99 and mean, in milliseconds.
+    '''
+    if not latencies:
+        return {"n": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    values = np.asarray(latencies) * 1000.0
+    return {
+        "n": len(values),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean())
+    }
+
+
+def timed(fn, *args, **kwargs):
+    '''
+    Calls fn and returns (result, elapsed seconds).
+    '''
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def print_table(rows:list[dict], columns:list[str]):
+    widths = {col: max(len(col), *(len(_fmt(row.get(col))) for row in rows)) for col in columns}
+    print("  ".join(col.ljust(widths[col]) for col in columns))
+    for row in rows:
+        print("  ".join(_fmt(row.get(col)).ljust(widths[col]) for col in columns))
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
@@ -0,0 +1,170 @@
+'''
+Microbenchmark for LLMCompilerPlanParser token ingestion.
+
+Replays token streams of plans with increasing numbers of tasks through the parser and
+reports the per-token cost. With incremental line scanning, precomputed tool lookup and
+single-pass dependency extraction the cost per token should stay flat as plans grow. The
+legacy parser (re-joining and re-splitting the buffer, uncompiled patterns, a list lookup
+per action and an O(idx) regex scan per task) is replayed alongside for comparison.
+
+Token streams are synthetic by default (plans split into 1-6 character tokens, roughly the
+size of model tokens). A recorded stream can be replayed with --stream-file, a JSON list
+of token strings.
+
+Usage (from 05_src):
+    python -m bench.plan_parser --sizes 10 100 1000
+'''
+import argparse
+import json
+import random
+import re
+import time
+
+from langchain_core.tools import StructuredTool
+
+from bench.common import print_table
+from output_parser import ACTION_PATTERN, ID_PATTERN, THOUGHT_PATTERN, LLMCompilerPlanParser, Task, _ast_parse
+
+
+def _search(query: str) -> str:
+    """search(query="the search query") - a search engine."""
+    return query
+
+
+def _math(problem: str, context: list = None) -> str:
+    """math(problem: str, context: Optional[list[str]]) -> float"""
+    return problem
+
+
+TOOLS = [
+    StructuredTool.from_function(_search, name="search"),
+    StructuredTool.from_function(_math, name="math"),
+]
+
+
+def make_plan(n_tasks: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = ["Thought: I need to look things up and then combine them."]
+    for idx in range(1, n_tasks + 1):
+        if idx > 2 and rng.random() < 0.4:
+            a, b = rng.sample(range(1, idx), 2)
+            lines.append(f'{idx}. math(problem="${a} + ${b}", context=["${a}", "${b}"])')
+        else:
+            lines.append(f'{idx}. search(query="fact number {idx} about topic {rng.randint(0, 999)}")')
+    lines.append(f"{n_tasks + 1}. join()<END_OF_PLAN>")
+    return "\n".join(lines)
+
+
+def tokenize(text: str, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    tokens, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(1, 6)
+        tokens.append(text[pos:pos + size])
+        pos += size
+    return tokens
+
+
+def legacy_ingest_token(parser, token, buffer, thought):
+    # The original ingestion, kept here only as a baseline.
+    buffer.append(token)
+    if "\n" in token:
+        buffer_ = "".join(buffer).split("\n")
+        suffix = buffer_[-1]
+        for line in buffer_[:-1]:
+            task, thought = legacy_parse_task(parser, line, thought)
+            if task:
+                yield task, thought
+        buffer.clear()
+        buffer.append(suffix)
+
+
+def legacy_parse_task(parser, line, thought=None):
+    task = None
+    if match := re.match(THOUGHT_PATTERN, line):
+        thought = match.group(1)
+    elif match := re.match(ACTION_PATTERN, line):
+        idx, tool_name, args, _ = match.groups()
+        task = legacy_instantiate_task(parser.tools, int(idx), tool_name, args, thought)
+        thought = None
+    return task, thought
+
+
+def legacy_parse_args(args, tool):
+    # Per-key membership, index and split scans over the remaining argument string.
+    if args == "" or isinstance(tool, str):
+        return ()
+    extracted_args, tool_key, prev_idx = {}, None, None
+    for key in tool.args.keys():
+        if f"{key}=" in args:
+            idx = args.index(f"{key}=")
+            if prev_idx is not None:
+                extracted_args[tool_key] = _ast_parse(args[prev_idx:idx].strip().rstrip(","))
+            args = args.split(f"{key}=", 1)[1]
+            tool_key, prev_idx = key, 0
+    if prev_idx is not None:
+        extracted_args[tool_key] = _ast_parse(args[prev_idx:].strip().rstrip(",").rstrip(")"))
+    return extracted_args
+
+
+def legacy_instantiate_task(tools, idx, tool_name, args, thought):
+    # List lookup per action and one regex scan of the arguments per earlier index.
+    tool = "join" if tool_name == "join" else tools[[tool.name for tool in tools].index(tool_name)]
+    tool_args = legacy_parse_args(args, tool)
+    if tool_name == "join":
+        dependencies = list(range(1, idx))
+    else:
+        dependencies = [i for i in range(1, idx) if i in [int(m) for m in re.findall(ID_PATTERN, str(tool_args))]]
+    return Task(idx=idx, tool=tool, args=tool_args, dependencies=dependencies, thought=thought)
+
+
+def replay(parser, tokens, ingest) -> tuple[int, float]:
+    buffer, thought, n_tasks = [], None, 0
+    start = time.perf_counter()
+    for token in tokens:
+        for task, thought in ingest(token, buffer, thought):
+            n_tasks += bool(task)
+    if buffer:
+        task, _ = parser._parse_task("".join(buffer), thought)
+        n_tasks += bool(task)
+    return n_tasks, time.perf_counter() - start
+
+
+def best_of(repeats, fn):
+    results = [fn() for _ in range(repeats)]
+    return min(results, key=lambda r: r[1])
+
+
+def main():
+    parser_ = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser_.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser_.add_argument("--repeats", type=int, default=5)
+    parser_.add_argument("--stream-file", help="JSON list of recorded tokens to replay instead of synthetic plans.")
+    args = parser_.parse_args()
+
+    parser = LLMCompilerPlanParser(tools=TOOLS)
+    if args.stream_file:
+        with open(args.stream_file, "r") as f:
+            streams = {"recorded": json.load(f)}
+    else:
+        streams = {n: tokenize(make_plan(n, seed=n), seed=n) for n in args.sizes}
+
+    rows = []
+    for size, tokens in streams.items():
+        n_new, t_new = best_of(args.repeats, lambda: replay(parser, tokens, parser.ingest_token))
+        legacy = lambda token, buffer, thought: legacy_ingest_token(parser, token, buffer, thought)
+        n_old, t_old = best_of(args.repeats, lambda: replay(parser, tokens, legacy))
+        assert n_new == n_old, f"parsed {n_new} tasks, legacy parsed {n_old}"
+        rows.append({
+            "plan_tasks": size,
+            "tokens": len(tokens),
+            "parsed": n_new,
+            "us_per_token": t_new / len(tokens) * 1e6,
+            "legacy_us_per_token": t_old / len(tokens) * 1e6,
+            "total_ms": t_new * 1000,
+        })
+    print_table(rows, ["plan_tasks", "tokens", "parsed", "us_per_token", "legacy_us_per_token", "total_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+'''
+Local stand-ins that replay recorded fixtures (bench/fixtures) instead of calling the network:
+
+- HTTP: a requests adapter and an httpx transport serving the recorded horoscope,
+  meowfacts and dogapi responses.
+- OpenAI Responses API: sync and async clients whose responses.create returns recorded
+  Response objects, streamed or not.
+- Chat model: a LangChain chat model replaying recorded AI messages and tool calls.
+- Chroma: a collection returning recorded query results, with review details in SQLite.
+
+Each stand-in can add a fixed latency, to emulate the remote service under concurrency.
+'''
+import asyncio
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Optional
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+import httpx
+import requests
+from requests.adapters import BaseAdapter
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixture(name:str):
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), "r") as f:
+        return json.load(f)
+
+
+class HttpFixtures:
+    '''
+    Recorded HTTP responses, matched on URL and then on the most matching query parameters
+    (so a horoscope recorded for "TODAY" also serves a resolved date).
+    '''
+
+    def __init__(self, records:Optional[list[dict]] = None):
+        self.by_url = {}
+        for record in records if records is not None else load_fixture("http"):
+            self.by_url.setdefault(record["url"], []).append(record)
+
+    def match(self, url:str, params:dict) -> Optional[dict]:
+        candidates = self.by_url.get(url)
+        if not candidates:
+            return None
+        params = {k: str(v) for k, v in params.items()}
+        return max(candidates, key=lambda r: sum(params.get(k) == str(v) for k, v in r["params"].items()))
+
+    def lookup(self, full_url:str) -> tuple[int, bytes]:
+        parts = urlsplit(full_url)
+        url = urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+        record = self.match(url, dict(parse_qsl(parts.query)))
+        if record is None:
+            return 404, json.dumps({"error": f"No fixture for {url}"}).encode()
+        return record["status"], json.dumps(record["body"]).encode()
+
+
+class FixtureAdapter(BaseAdapter):
+    '''
+    A requests transport adapter serving HttpFixtures.
+    '''
+
+    def __init__(self, fixtures:HttpFixtures, latency:float = 0.0):
+        super().__init__()
+        self.fixtures = fixtures
+        self.latency = latency
+
+    def send(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        status, body = self.fixtures.lookup(request.url)
+        response = requests.Response()
+        response.status_code = status
+        response._content = body
+        response.headers["Content-Type"] = "application/json"
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+    def close(self):
+        pass
+
+
+def fixture_async_client(fixtures:HttpFixtures, latency:float = 0.0) -> httpx.AsyncClient:
+    async def handler(request:httpx.Request) -> httpx.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        status, body = fixtures.lookup(str(request.url))
+        return httpx.Response(status, content=body, headers={"Content-Type": "application/json"})
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class RecordedResponses:
+    '''
+    Stand-in for OpenAI().responses. A request whose input carries function_call_output
+    items gets the recorded follow-up to that call; otherwise the recorded first response
+    to the last user message. Unknown messages get the last recorded conversation.
+    '''
+
+    def __init__(self, conversations:Optional[list[dict]] = None, latency:float = 0.0):
+        from openai.types.responses import Response
+
+        conversations = conversations if conversations is not None else load_fixture("responses")["conversations"]
+        self.latency = latency
+        self.by_message = {}
+        self.by_call_id = {}
+        self.default = None
+        for conversation in conversations:
+            responses = [Response.model_validate(r) for r in conversation["responses"]]
+            self.by_message[conversation["message"]] = responses[0]
+            self.default = responses[0]
+            for response, follow_up in zip(responses, responses[1:]):
+                for item in response.output:
+                    if item.type == "function_call":
+                        self.by_call_id[item.call_id] = follow_up
+        self.messages = list(self.by_message)
+
+    def _lookup(self, input) -> Any:
+        if isinstance(input, str):
+            return self.by_message.get(input, self.default)
+        for item in reversed(input):
+            if item.get("type") == "function_call_output":
+                return self.by_call_id.get(item["call_id"], self.default)
+            if item.get("role") == "user":
+                return self.by_message.get(item["content"], self.default)
+        return self.default
+
+    def create(self, input=None, stream:bool = False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        response = self._lookup(input)
+        return self._stream(response) if stream else response
+
+    def _stream(self, response):
+        for item in response.output:
+            if item.type == "function_call":
+                yield SimpleNamespace(type="response.output_item.added", item=item)
+            elif item.type == "message":
+                for content in item.content:
+                    for word in content.text.split(" "):
+                        yield SimpleNamespace(type="response.output_text.delta", delta=word + " ")
+        yield SimpleNamespace(type="response.completed", response=response)
+
+
+class RecordedAsyncResponses(RecordedResponses):
+    '''
+    Stand-in for AsyncOpenAI().responses.
+    '''
+
+    async def create(self, input=None, stream:bool = False, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = self._lookup(input)
+        return self._astream(response) if stream else response
+
+    async def _astream(self, response):
+        for event in self._stream(response):
+            yield event
+
+
+class RecordedChatModel(BaseChatModel):
+    '''
+    A chat model replaying recorded conversations: the first step for a user message, and
+    the next step once the tool calls of a step have been answered.
+    '''
+    conversations: list[dict]
+    latency: float = 0.0
+    _by_message: dict = PrivateAttr(default_factory=dict)
+    _by_call_id: dict = PrivateAttr(default_factory=dict)
+    _default: Optional[dict] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context):
+        for conversation in self.conversations:
+            steps = conversation["steps"]
+            self._by_message[conversation["message"]] = steps[0]
+            for step, follow_up in zip(steps, steps[1:]):
+                for call in step["tool_calls"]:
+                    self._by_call_id[call["id"]] = follow_up
+        self._default = self.conversations[-1]["steps"][0]
+
+    @property
+    def _llm_type(self) -> str:
+        return "recorded"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _lookup(self, messages) -> AIMessage:
+        step = self._default
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            step = self._by_call_id.get(last.tool_call_id, step)
+        elif isinstance(last, HumanMessage):
+            step = self._by_message.get(last.content, step)
+        return AIMessage(content=step["content"], tool_calls=step["tool_calls"],
+                         usage_metadata=step["usage_metadata"])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._lookup(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._lookup(messages))])
+
+
+class RecordedCollection:
+    '''
+    Stand-in for the Chroma collection: recorded query results keyed on the query text.
+    '''
+
+    def __init__(self, fixture:Optional[dict] = None, latency:float = 0.0):
+        fixture = fixture if fixture is not None else load_fixture("chroma")
+        self.name = fixture["collection"]
+        self.results = fixture["queries"]
+        self.queries = list(self.results)
+        self.latency = latency
+
+    def query(self, query_texts:list[str], n_results:int = 10, **kwargs) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        result = self.results.get(query_texts[0], next(iter(self.results.values())))
+        return {key: [values[0][:n_results]] for key, values in result.items()}
+
+
+def review_engine(fixture:Optional[dict] = None):
+    '''
+    An in-memory SQLite engine with the recorded reviews and genres tables.
+    '''
+    import pandas as pd
+    import sqlalchemy as sa
+    from sqlalchemy.pool import StaticPool
+
+    fixture = fixture if fixture is not None else load_fixture("chroma")
+    engine = sa.create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        pd.DataFrame(fixture["reviews"]).to_sql("reviews", conn, index=False)
+        pd.DataFrame(fixture["genres"]).to_sql("genres", conn, index=False)
+    return engine
+
+
+def prepare_environment(response_cache:bool = False):
+    '''
+    Points the apps at throwaway local state. Call before importing any app module.
+    The response cache is off unless response_cache, so repeated requests run the full path.
+    '''
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.environ.update({
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "offline"),
+        "RESPONSE_CACHE": "all" if response_cache else "",
+        "RESPONSE_CACHE_DB": os.path.join(workdir, "response_cache.db"),
+        "SESSION_DB": os.path.join(workdir, "sessions.db"),
+        "CHECKPOINT_DB": os.path.join(workdir, "checkpoints.db"),
+    })
+    return workdir
+
+
+def install(http_latency:float = 0.0, llm_latency:float = 0.0, db_latency:float = 0.0):
+    '''
+    Replaces the network-facing clients of the apps with the stand-ins.
+    '''
+    import utils.http_client as http_client
+
+    fixtures = HttpFixtures()
+    session = http_client._TimeoutSession(timeout=(http_client.HTTP_CONNECT_TIMEOUT, http_client.HTTP_TIMEOUT))
+    adapter = FixtureAdapter(fixtures, http_latency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    http_client._session = session
+    clients = {}
+
+    def get_async_client():
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = fixture_async_client(fixtures, http_latency)
+        return clients[loop]
+    http_client.get_async_client = get_async_client
+
+    import horoscope_chat.main as horoscope_main
+    horoscope_main.client = SimpleNamespace(responses=RecordedResponses(latency=llm_latency))
+    horoscope_main.async_client = SimpleNamespace(responses=RecordedAsyncResponses(latency=llm_latency))
+
+    import course_chat.main as course_main
+    import utils.music_reviews as music_reviews
+    from utils.compaction import get_summarizer
+    course_main.chat_agent = RecordedChatModel(conversations=load_fixture("chat")["conversations"], latency=llm_latency)
+    course_main.compactor.summarizer = get_summarizer(course_main.chat_agent)
+    course_main.get_model_with_tools.cache_clear()
+    course_main.get_graph.cache_clear()
+    music_reviews._collection = RecordedCollection(latency=db_latency)
+    music_reviews._engine = review_engine()
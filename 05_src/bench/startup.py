@@ -0,0 +1,106 @@
+'''
+Cold-start profile of the app entry points.
+
+Imports each entry module in a fresh interpreter with `python -X importtime` and reports
+the wall time of the import, then the packages with the largest cumulative import cost
+(the heavy dependencies to defer). Run it before and after moving an import behind first
+use to see what start-up gained. Modules that fail to import (e.g. a missing optional
+dependency) are reported with their error and skipped.
+
+Usage (from 05_src):
+    python -m bench.startup
+    python -m bench.startup --modules course_chat.main music_mcp.server --top 15
+'''
+import argparse
+from collections import defaultdict
+import os
+import re
+import subprocess
+import sys
+import time
+
+from bench.common import print_table
+
+MODULES = ["course_chat.main", "animals_chat.main", "horoscope_chat.main", "music_mcp.server",
+           "math_tools", "output_parser"]
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(stderr:str) -> list[dict]:
+    '''
+    Parses -X importtime output into {name, self_ms, cumulative_ms, depth} per imported module.
+    '''
+    imports = []
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append({"name": name, "self_ms": int(self_us) / 1000,
+                            "cumulative_ms": int(cumulative_us) / 1000, "depth": len(indent) // 2})
+    return imports
+
+
+def profile(module:str, python:str = sys.executable) -> dict:
+    '''
+    Imports module in a new interpreter. Returns the wall time, the error if any and the import times.
+    '''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env)
+    wall = time.perf_counter() - start
+    error = None
+    if result.returncode != 0:
+        lines = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        error = lines[-1] if lines else f"exit code {result.returncode}"
+    return {"module": module, "wall_ms": wall * 1000, "error": error, "imports": parse_importtime(result.stderr)}
+
+
+def by_package(imports:list[dict]) -> dict[str, dict]:
+    '''
+    Totals per top-level package: self time summed over its modules, and the cumulative time
+    of its outermost imports (the cost of importing the package from the app).
+    '''
+    packages = defaultdict(lambda: {"self_ms": 0.0, "cumulative_ms": 0.0, "modules": 0})
+    for item in imports:
+        package = packages[item["name"].split(".")[0]]
+        package["self_ms"] += item["self_ms"]
+        package["modules"] += 1
+    # A module's cumulative time includes its children, so only count a package's imports
+    # that were not made from inside the same package
+    stack = []
+    for item in reversed(imports):
+        # -X importtime prints children before their parent; walk parents first
+        while stack and stack[-1][0] >= item["depth"]:
+            stack.pop()
+        top = item["name"].split(".")[0]
+        if not any(parent == top for _, parent in stack):
+            packages[top]["cumulative_ms"] += item["cumulative_ms"]
+        stack.append((item["depth"], top))
+    return dict(packages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--top", type=int, default=10, help="Packages to list per module.")
+    args = parser.parse_args()
+
+    results = [profile(module) for module in args.modules]
+    print_table([{"module": r["module"], "wall_ms": r["wall_ms"], "modules_imported": len(r["imports"]),
+                  "error": r["error"] or ""} for r in results],
+                ["module", "wall_ms", "modules_imported", "error"])
+
+    for result in results:
+        if not result["imports"]:
+            continue
+        packages = by_package(result["imports"])
+        top = sorted(packages.items(), key=lambda item: item[1]["cumulative_ms"], reverse=True)[:args.top]
+        print(f"\n{result['module']}: slowest packages")
+        print_table([{"package": name, **stats} for name, stats in top],
+                    ["package", "cumulative_ms", "self_ms", "modules"])
+
+
+if __name__ == "__main__":
+    main()
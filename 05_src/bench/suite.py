@@ -0,0 +1,308 @@
+'''
+Offline benchmark suite for the chat backends.
+
+Drives horoscope_chat (plain and streaming), the course_chat graph, LLMCompilerPlanParser,
+recommend_albums and the async chat server (chat_server, course_chat and horoscope_chat
+requests through the ASGI app) against local stand-ins that replay recorded OpenAI, horoscope,
+meowfacts, dogapi and Chroma responses (see bench/replay.py and bench/fixtures), so it
+needs no network or API keys. Each target runs at every requested concurrency: sync
+targets on a thread pool, async ones as asyncio tasks. Reports throughput, latency
+percentiles and, with --alloc, memory allocated while the requests ran.
+
+--llm-latency-ms and --http-latency-ms add a fixed service time to the stand-ins, to see
+how well each target overlaps remote calls. --cold clears the app caches before every
+request. --response-cache turns on the response cache in front of horoscope_chat and
+chat_server (course_chat runs the graph directly), which the recorded requests, a handful
+of messages repeated, mostly hit.
+
+Results can be saved with --save and compared against a saved run with --baseline; the
+run fails (exit code 1) when a target's p50 latency or throughput regresses by more than
+--tolerance, so the suite can gate CI.
+
+Usage (from 05_src):
+    python -m bench.suite --concurrency 1 8 32 --requests 200
+    python -m bench.suite --save bench_baseline.json
+    python -m bench.suite --baseline bench_baseline.json --tolerance 0.25
+'''
+import os
+
+# Quiet, in-memory only observability while benchmarking; set before the apps are imported
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("TRACE_FILE", "")
+os.environ.setdefault("LANGSMITH_TRACING", "false")
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from bench.common import percentiles, print_table
+from bench import replay
+
+TARGETS = ["horoscope_chat", "horoscope_chat_stream", "course_chat", "plan_parser", "recommend_albums", "chat_server"]
+COLUMNS = ["target", "concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "mean_ms",
+           "alloc_peak_kib", "alloc_retained_kib"]
+
+
+@dataclass
+class Target:
+    name: str
+    # Runs request i; a coroutine function for async targets
+    run: Callable
+    is_async: bool
+    reset: Optional[Callable] = None
+
+
+def horoscope_target(stream:bool) -> Target:
+    import horoscope_chat.main as horoscope_main
+
+    messages = horoscope_main.client.responses.messages
+
+    def run(i):
+        message = messages[i % len(messages)]
+        if stream:
+            for _ in horoscope_main.horoscope_chat_stream(message, []):
+                pass
+        else:
+            horoscope_main.horoscope_chat(message, [])
+
+    def reset():
+        horoscope_main.horoscope_cache.cache.clear()
+        horoscope_main.response_cache.clear()
+
+    return Target("horoscope_chat_stream" if stream else "horoscope_chat", run, False, reset)
+
+
+def course_chat_target() -> Target:
+    from langchain_core.messages import HumanMessage
+    import course_chat.main as course_main
+    from course_chat.tools_horoscope import horoscope_cache
+    from course_chat.tools_music import clear_music_caches
+
+    messages = [c["message"] for c in replay.load_fixture("chat")["conversations"]]
+    graph = course_main.get_graph()
+
+    async def run(i):
+        await graph.ainvoke({"messages": [HumanMessage(content=messages[i % len(messages)])]})
+
+    def reset():
+        horoscope_cache.cache.clear()
+        clear_music_caches()
+        course_main.response_cache.clear()
+
+    return Target("course_chat", run, True, reset)
+
+
+def plan_parser_target() -> Target:
+    from bench.plan_parser import TOOLS, replay as replay_plan
+    from output_parser import LLMCompilerPlanParser
+
+    parser = LLMCompilerPlanParser(tools=TOOLS)
+    streams = replay.load_fixture("plans")["streams"]
+
+    def run(i):
+        replay_plan(parser, streams[i % len(streams)], parser.ingest_token)
+
+    return Target("plan_parser", run, False)
+
+
+def recommend_albums_target() -> Target:
+    from course_chat.tools_music import clear_music_caches, get_collection, recommend_albums
+
+    queries = get_collection().queries
+
+    def run(i):
+        recommend_albums.invoke({"query": queries[i % len(queries)], "n_results": 3})
+
+    return Target("recommend_albums", run, False, clear_music_caches)
+
+
+def chat_server_target() -> Target:
+    import httpx
+    from chat_server.server import create_app
+    from course_chat.tools_horoscope import horoscope_cache
+    import horoscope_chat.main as horoscope_main
+    from utils.admission import AdmissionController
+
+    # In-process requests through the ASGI app: the async backends plus admission control.
+    # Limits are high enough that the benchmark measures serving, not shedding.
+    app = create_app(["course_chat", "horoscope_chat"], gradio=False,
+                     admission=AdmissionController(max_concurrency=1024, max_queue=4096))
+    conversations = [("course_chat", c["message"]) for c in replay.load_fixture("chat")["conversations"]]
+    conversations += [("horoscope_chat", m) for m in horoscope_main.async_client.responses.messages]
+    clients = {}
+
+    async def run(i):
+        # One client per event loop, as each concurrency level runs in a new loop
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+        name, message = conversations[i % len(conversations)]
+        response = await clients[loop].post(f"/v1/{name}/chat", json={"message": message})
+        response.raise_for_status()
+
+    def reset():
+        import course_chat.main as course_main
+        horoscope_cache.cache.clear()
+        horoscope_main.horoscope_cache.cache.clear()
+        course_main.response_cache.clear()
+        horoscope_main.response_cache.clear()
+
+    return Target("chat_server", run, True, reset)
+
+
+def get_target(name:str) -> Target:
+    if name == "horoscope_chat":
+        return horoscope_target(stream=False)
+    if name == "horoscope_chat_stream":
+        return horoscope_target(stream=True)
+    if name == "course_chat":
+        return course_chat_target()
+    if name == "plan_parser":
+        return plan_parser_target()
+    if name == "recommend_albums":
+        return recommend_albums_target()
+    if name == "chat_server":
+        return chat_server_target()
+    raise ValueError(f'Unknown target "{name}". Use one of {TARGETS}.')
+
+
+def _call(target:Target, i:int, cold:bool):
+    if cold and target.reset is not None:
+        target.reset()
+    start = time.perf_counter()
+    try:
+        target.run(i)
+        return time.perf_counter() - start, None
+    except Exception as e:
+        return time.perf_counter() - start, e
+
+
+async def _acall(target:Target, i:int, cold:bool, semaphore:asyncio.Semaphore):
+    async with semaphore:
+        if cold and target.reset is not None:
+            target.reset()
+        start = time.perf_counter()
+        try:
+            await target.run(i)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+
+def run_requests(target:Target, n:int, concurrency:int, cold:bool = False) -> tuple[list, float]:
+    '''
+    Runs n requests with up to concurrency in flight. Returns the (latency, error) pairs and the wall time.
+    '''
+    start = time.perf_counter()
+    if target.is_async:
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(_acall(target, i, cold, semaphore) for i in range(n)))
+        results = asyncio.run(main())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda i: _call(target, i, cold), range(n)))
+    return results, time.perf_counter() - start
+
+
+def measure_allocations(target:Target, n:int, concurrency:int, cold:bool = False) -> dict:
+    '''
+    Peak memory allocated while n requests ran, and memory still held afterwards (in KiB).
+    Measured in a separate pass, as tracing allocations slows the requests down.
+    '''
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        run_requests(target, n, concurrency, cold)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"alloc_peak_kib": (peak - before) / 1024, "alloc_retained_kib": (after - before) / 1024}
+
+
+def benchmark(target:Target, concurrency:int, args) -> dict:
+    run_requests(target, args.warmup, concurrency, args.cold)
+    results, wall = run_requests(target, args.requests, concurrency, args.cold)
+    errors = [e for _, e in results if e is not None]
+    if errors:
+        print(f"{target.name}: {len(errors)} failed requests, first error: {errors[0]!r}", file=sys.stderr)
+    row = {
+        "target": target.name,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "rps": len(results) / wall,
+        **{k: v for k, v in percentiles([latency for latency, _ in results]).items() if k != "n"},
+    }
+    if args.alloc:
+        row.update(measure_allocations(target, min(args.requests, args.alloc_requests), concurrency, args.cold))
+    return row
+
+
+def compare(rows:list[dict], baseline:list[dict], tolerance:float) -> list[str]:
+    '''
+    Returns a description of every target whose p50 latency or throughput regressed past the tolerance.
+    '''
+    previous = {(row["target"], row["concurrency"]): row for row in baseline}
+    regressions = []
+    for row in rows:
+        base = previous.get((row["target"], row["concurrency"]))
+        if base is None:
+            continue
+        if row["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+            regressions.append(f'{row["target"]} x{row["concurrency"]}: p50 {base["p50_ms"]:.2f} -> {row["p50_ms"]:.2f} ms')
+        if row["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f'{row["target"]} x{row["concurrency"]}: {base["rps"]:.1f} -> {row["rps"]:.1f} requests/s')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=TARGETS, choices=TARGETS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--http-latency-ms", type=float, default=0.0)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--cold", action="store_true", help="Clear the app caches before every request.")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="Serve repeated requests from the response cache (off by default).")
+    parser.add_argument("--alloc", action="store_true", help="Also measure memory allocations (a separate, slower pass).")
+    parser.add_argument("--alloc-requests", type=int, default=50)
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Fail if results regress against this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    replay.prepare_environment(response_cache=args.response_cache)
+    replay.install(http_latency=args.http_latency_ms / 1000, llm_latency=args.llm_latency_ms / 1000,
+                   db_latency=args.db_latency_ms / 1000)
+
+    rows = []
+    for name in args.targets:
+        target = get_target(name)
+        for concurrency in args.concurrency:
+            rows.append(benchmark(target, concurrency, args))
+    print_table(rows, COLUMNS if args.alloc else COLUMNS[:-2])
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(rows, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(rows, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+'''
+Compares the Chroma HTTP server with the local vector index (exact and IVF modes).
+
+Query vectors are sampled from the index itself, so no embedding API calls are made.
+Recall@k is measured against the exact local search, which is the brute-force ground truth.
+
+Usage (from 05_src, with the Chroma container running and the index exported):
+    python -m bench.vector_index --index-path ./documents/pitchfork_index --k 10
+'''
+import argparse
+
+import numpy as np
+
+from bench.common import percentiles, print_table, timed
+from utils.vector_index import LocalVectorIndex
+
+
+def recall_at_k(results:list[list[str]], truth:list[list[str]]) -> float:
+    hits = [len(set(r) & set(t)) / len(t) for r, t in zip(results, truth) if t]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def run_backend(name:str, query_fn, queries:np.ndarray, k:int, warmup:int = 5):
+    for query in queries[:warmup]:
+        query_fn(query, k)
+    ids, latencies = [], []
+    for query in queries:
+        result, elapsed = timed(query_fn, query, k)
+        ids.append(result)
+        latencies.append(elapsed)
+    return ids, {"backend": name, **percentiles(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-path", default="./documents/pitchfork_index")
+    parser.add_argument("--chroma-url", default="http://localhost:8000")
+    parser.add_argument("--collection", default="pitchfork_reviews")
+    parser.add_argument("--no-chroma", action="store_true", help="Only benchmark the local index.")
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    exact = LocalVectorIndex(args.index_path, mode="exact")
+    rng = np.random.default_rng(args.seed)
+    rows = rng.choice(len(exact), size=min(args.n_queries, len(exact)), replace=False)
+    # Perturb the stored vectors slightly so queries are not exact duplicates of index rows.
+    queries = np.asarray(exact.embeddings[np.sort(rows)])
+    queries = queries + rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+
+    def local_query(index):
+        return lambda query, k: index.query(query_embeddings=[query], n_results=k, include=())["ids"][0]
+
+    truth, exact_stats = run_backend("local-exact", local_query(exact), queries, args.k)
+    report = [{**exact_stats, f"recall@{args.k}": 1.0}]
+
+    try:
+        for nprobe in args.nprobe:
+            ivf = LocalVectorIndex(args.index_path, mode="ivf", nprobe=nprobe)
+            ids, stats = run_backend(f"local-ivf(nprobe={nprobe})", local_query(ivf), queries, args.k)
+            report.append({**stats, f"recall@{args.k}": recall_at_k(ids, truth)})
+    except ValueError as e:
+        print(f"Skipping IVF: {e}")
+
+    if not args.no_chroma:
+        import chromadb
+        collection = chromadb.HttpClient(host=args.chroma_url).get_collection(name=args.collection)
+
+        def chroma_query(query, k):
+            return collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])["ids"][0]
+
+        ids, stats = run_backend("chroma-http", chroma_query, queries, args.k)
+        report.append({**stats, f"recall@{args.k}": recall_at_k(ids, truth)})
+
+    print_table(report, ["backend", f"recall@{args.k}", "p50_ms", "p99_ms", "mean_ms", "n"])
+
+
+if __name__ == "__main__":
+    main()
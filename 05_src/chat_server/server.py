@@ -0,0 +1,209 @@
+'''
+Async serving entry point for the chat backends.
+
+Serves course_chat, animals_chat and horoscope_chat as async HTTP endpoints. The backends
+run their model calls with ainvoke/AsyncOpenAI and their tool calls with the pooled async
+HTTP client, so one worker process holds hundreds of conversations on a single event loop
+instead of one blocked thread each. Every worker admits at most SERVE_MAX_CONCURRENCY
+requests at once and queues up to SERVE_QUEUE_SIZE more; beyond that, or after waiting
+SERVE_QUEUE_TIMEOUT seconds, requests get a 503 with Retry-After (see utils.admission).
+
+The Gradio apps stay available at /ui/<app>, bounded by Gradio's own queue with the same
+limits. Gradio keeps session state in the worker process, so with SERVE_WORKERS > 1 the
+UIs need a load balancer with sticky sessions in front.
+
+Endpoints:
+    POST /v1/<app>/chat   {"message", "history", "session_id", "stream"}
+                          Returns {"messages", "reply"}, or with "stream": true one
+                          {"messages"} JSON line per update.
+    GET  /healthz         The apps being served.
+    GET  /metrics         Admission counters, response cache hit rates and span latency
+                          summaries of this worker.
+
+Usage (from 05_src):
+    python -m chat_server.server
+    SERVE_WORKERS=4 SERVE_GRADIO=false python -m chat_server.server
+    uvicorn chat_server.server:create_app --factory --workers 4 --port 8080
+'''
+import asyncio
+from contextlib import asynccontextmanager
+import importlib
+import json
+from typing import AsyncIterator, Callable, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+import os
+
+from utils.admission import AdmissionController, Overloaded
+from utils.http_client import close_async_clients
+from utils.logger import get_logger
+from utils.response_cache import get_response_cache_stats
+from utils.tracing import tracer
+
+_logs = get_logger(__name__)
+
+load_dotenv()
+load_dotenv(".secrets")
+
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", 8080))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", 1))
+SERVE_APPS = [name.strip() for name in os.getenv("SERVE_APPS", "course_chat,animals_chat,horoscope_chat").split(",") if name.strip()]
+SERVE_GRADIO = os.getenv("SERVE_GRADIO", "true").lower() == "true"
+
+# app name: (backend module, async turn handler, Gradio app module)
+BACKENDS = {
+    "course_chat": ("course_chat.main", "course_chat_stream", "course_chat.app"),
+    "animals_chat": ("animals_chat.main", "animals_chat_stream", "animals_chat.app"),
+    "horoscope_chat": ("horoscope_chat.main", "ahoroscope_chat_stream", "horoscope_chat.app"),
+}
+
+
+class ChatRequest(BaseModel):
+    message: str
+    history: list[dict] = Field(default_factory=list)
+    session_id: Optional[str] = None
+    stream: bool = False
+
+
+def load_backends(names:list[str]) -> dict[str, Callable[..., AsyncIterator[list[dict]]]]:
+    '''
+    Imports the turn handler of each app. Apps that fail to import are logged and not served.
+    '''
+    handlers = {}
+    for name in names:
+        if name not in BACKENDS:
+            _logs.error(f'Unknown app "{name}"; use one of {list(BACKENDS)}')
+            continue
+        module, handler, _ = BACKENDS[name]
+        try:
+            handlers[name] = getattr(importlib.import_module(module), handler)
+        except Exception:
+            _logs.exception(f'Could not load {name}, it will not be served')
+    return handlers
+
+
+def _warm_up(names:list[str]):
+    if "course_chat" in names:
+        try:
+            from course_chat.tools_music import warm_up
+            warm_up()
+        except Exception as e:
+            # The tools connect on first use instead
+            _logs.warning(f'Music tools warm-up failed: {e!r}')
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    '''
+    StreamingResponse that releases an admission slot once it has been sent, however it ends:
+    completed, failed, or cut short by a client that disconnected, even before the body started.
+    '''
+
+    def __init__(self, content, admission:AdmissionController, **kwargs):
+        super().__init__(content, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.admission.release()
+
+
+def _reply(messages:list[dict]) -> str:
+    # The last assistant text, skipping tool progress messages
+    for message in reversed(messages):
+        if message["role"] == "assistant" and not message.get("metadata"):
+            return message["content"]
+    return ""
+
+
+def create_app(names:list[str] = SERVE_APPS, gradio:bool = SERVE_GRADIO,
+               admission:Optional[AdmissionController] = None) -> FastAPI:
+    handlers = load_backends(names)
+    admission = admission or AdmissionController(name="chat_server")
+
+    @asynccontextmanager
+    async def lifespan(app:FastAPI):
+        # Connections are opened before traffic arrives, without delaying start-up
+        warm_up = asyncio.create_task(asyncio.to_thread(_warm_up, list(handlers)))
+        yield
+        warm_up.cancel()
+        await close_async_clients()
+        if "horoscope_chat" in handlers:
+            from horoscope_chat.main import async_client
+            await async_client.close()
+
+    app = FastAPI(title="Chat backends", lifespan=lifespan)
+    app.state.admission = admission
+
+    async def _stream(turn:AsyncIterator[list[dict]]) -> AsyncIterator[str]:
+        try:
+            async for messages in turn:
+                yield json.dumps({"messages": messages}) + "\n"
+        except Exception as e:
+            # The status line has been sent; report the failure in the stream
+            _logs.exception('Streamed turn failed')
+            yield json.dumps({"error": repr(e)}) + "\n"
+
+    @app.post("/v1/{name}/chat")
+    async def chat(name:str, request:ChatRequest):
+        handler = handlers.get(name)
+        if handler is None:
+            return JSONResponse({"error": f'Unknown app "{name}"', "apps": list(handlers)}, status_code=404)
+        try:
+            await admission.acquire()
+        except Overloaded as e:
+            return JSONResponse({"error": "overloaded", "reason": e.reason}, status_code=503,
+                                headers={"Retry-After": str(int(e.retry_after))})
+
+        turn = handler(request.message, request.history, session_id=request.session_id)
+        if request.stream:
+            return AdmittedStreamingResponse(_stream(turn), admission, media_type="application/x-ndjson")
+        try:
+            messages = []
+            async for messages in turn:
+                pass
+        finally:
+            admission.release()
+        return {"messages": messages, "reply": _reply(messages)}
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok", "apps": list(handlers)}
+
+    @app.get("/metrics")
+    async def metrics():
+        return {"pid": os.getpid(), "admission": admission.stats(), "response_caches": get_response_cache_stats(),
+                "spans": tracer.summary()}
+
+    if gradio:
+        import gradio as gr
+
+        for name in handlers:
+            try:
+                ui = importlib.import_module(BACKENDS[name][2]).chat
+            except Exception:
+                _logs.exception(f'Could not load the Gradio app of {name}')
+                continue
+            ui.queue(default_concurrency_limit=admission.max_concurrency, max_size=admission.max_queue)
+            app = gr.mount_gradio_app(app, ui, path=f"/ui/{name}")
+    return app
+
+
+def main():
+    import uvicorn
+
+    if SERVE_WORKERS > 1 and SERVE_GRADIO:
+        _logs.warning('Gradio UIs with several workers need sticky sessions in front of the server')
+    _logs.info(f'Serving {SERVE_APPS} on {SERVE_HOST}:{SERVE_PORT} with {SERVE_WORKERS} workers')
+    # Each worker process builds its own app (backends, admission limits, Gradio queues)
+    uvicorn.run("chat_server.server:create_app", factory=True, host=SERVE_HOST, port=SERVE_PORT,
+                workers=SERVE_WORKERS)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
-from course_chat.main import get_graph
-from langchain_core.messages import HumanMessage, AIMessage
+from course_chat.main import course_chat_stream, get_graph
+from course_chat.tools_horoscope import horoscope_cache
+from course_chat.tools_music import warm_up as warm_up_music
 import gradio as gr
 from dotenv import load_dotenv
 import os
+import threading
+from typing import AsyncIterator
 
 from utils.logger import get_logger
 
@@ -12,25 +15,17 @@ llm = get_graph()
 
 load_dotenv('.secrets')
 
-def course_chat(message: str, history: list[dict]) -> str:
-    langchain_messages = []
-    n = 0
-    _logs.debug(f"History: {history}")
-    for msg in history:
-        if msg['role'] == 'user':
-            langchain_messages.append(HumanMessage(content=msg['content']))
-        elif msg['role'] == 'assistant':
-            langchain_messages.append(AIMessage(content=msg['content']))
-            n += 1
-    langchain_messages.append(HumanMessage(content=message))
-
-    state = {
-        "messages": langchain_messages,
-        "llm_calls": n
-    }
-
-    response = llm.invoke(state)
-    return response['messages'][len(response['messages']) - 1].content
+async def course_chat(message: str, history: list[dict], request: gr.Request = None) -> AsyncIterator[list[dict]]:
+    async for messages in course_chat_stream(message, history, session_id=request.session_hash if request else None):
+        yield messages
+
+def _warm_up_music():
+    try:
+        warm_up_music()
+        _logs.info('Music tools warmed up')
+    except Exception as e:
+        # The tools connect on first use instead
+        _logs.warning(f'Music tools warm-up failed: {e!r}')
 
 chat = gr.ChatInterface(
     fn=course_chat,
@@ -38,5 +33,10 @@ chat = gr.ChatInterface(
 )
 
 if __name__ == "__main__":
+    if os.getenv("HOROSCOPE_PREWARM", "false").lower() == "true":
+        horoscope_cache.start_prewarm()
+    # Connects the vector store and SQL pool in the background while the UI starts
+    if os.getenv("MUSIC_WARM_UP", "true").lower() == "true":
+        threading.Thread(target=_warm_up_music, name="music-warm-up", daemon=True).start()
     _logs.info('Starting Course Chat App...')
     chat.launch()
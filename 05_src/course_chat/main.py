@@ -1,18 +1,28 @@
 from langgraph.graph import StateGraph, MessagesState, START
 from langchain.chat_models import init_chat_model
 from langgraph.prebuilt.tool_node import ToolNode, tools_condition
-from langchain_core.messages import SystemMessage,  HumanMessage
+from langchain_core.messages import AIMessage, SystemMessage,  HumanMessage, RemoveMessage
+from langchain_core.runnables import RunnableLambda
 
 from dotenv import load_dotenv
-import json
-import requests
+from functools import lru_cache
+import asyncio
 import os
+import time
+from typing import AsyncIterator, Optional
 
 from course_chat.prompts import return_instructions
 from course_chat.tools_animals import get_cat_facts, get_dog_facts
 from course_chat.tools_horoscope import get_horoscope
 from course_chat.tools_music import recommend_albums
+from utils.compaction import HistoryCompactor, get_summarizer, split_turns
+from utils.horoscope_cache import seconds_until_tomorrow
 from utils.logger import get_logger
+from utils.response_cache import ResponseCache
+from utils.sessions import SessionStore, session_graph, thread_config
+from utils.streaming import astream_graph, history_to_messages
+from utils.timing import StepTimer
+from utils.tracing import record_usage, traced
 
 
 _logs = get_logger(__name__)
@@ -20,34 +30,168 @@ load_dotenv(".env")
 load_dotenv(".secrets")
 
 
+model_name = "openai:gpt-4o-mini"
 chat_agent = init_chat_model(
-    "openai:gpt-4o-mini",
+    model_name,
 )
 tools = [get_cat_facts, get_dog_facts, recommend_albums, get_horoscope]
 
 instructions = return_instructions()
 
+timer = StepTimer("course_chat")
 
+# Bounds the context sent on each model call; older turns are folded into a running summary.
+compactor = HistoryCompactor(summarizer=get_summarizer(chat_agent), name="course_chat")
 
-# @traceable(run_type="llm")
-def call_model(state: MessagesState):
+
+class ChatState(MessagesState):
+    summary: str
+
+
+@lru_cache(maxsize=1)
+def get_model_with_tools():
+    """The chat model with the tool schemas bound, built once and shared by every step."""
+    return chat_agent.bind_tools(tools)
+
+
+@lru_cache(maxsize=1)
+def get_system_message() -> SystemMessage:
+    return SystemMessage(content=instructions)
+
+
+def compact_history(state: ChatState):
+    """Drops stale tool outputs and summarizes old turns when the context is over budget"""
+    with timer.step("compact_history"):
+        compaction = compactor.compact(state["messages"], state.get("summary", ""))
+    if not compaction.changed:
+        return {}
+    return {
+        "messages": [RemoveMessage(id=m.id) for m in compaction.removed] + compaction.replaced,
+        "summary": compaction.summary
+    }
+
+
+def _model_input(state: ChatState) -> list:
+    messages = [get_system_message()]
+    if state.get("summary"):
+        messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{state['summary']}"))
+    return messages + state["messages"]
+
+
+def call_model(state: ChatState):
     """LLM decides whether to call a tool or not"""
-    response = chat_agent.bind_tools(tools).invoke( [SystemMessage(content=instructions)] + state["messages"])
+    with timer.step("call_model") as span:
+        response = get_model_with_tools().invoke(_model_input(state))
+        record_usage(span, response.usage_metadata)
     return {
         "messages": [response]
     }
 
+
+async def acall_model(state: ChatState):
+    # Used by async runs (astream/ainvoke), so a waiting model call does not hold a worker thread
+    with timer.step("call_model") as span:
+        response = await get_model_with_tools().ainvoke(_model_input(state))
+        record_usage(span, response.usage_metadata)
+    return {
+        "messages": [response]
+    }
+
+tool_node = ToolNode(tools)
+
+
+def run_tools(state: ChatState, config):
+    with timer.step("tools"):
+        return tool_node.invoke(state, config)
+
+
+async def arun_tools(state: ChatState, config):
+    # ToolNode awaits the calls of one step concurrently
+    with timer.step("tools"):
+        return await tool_node.ainvoke(state, config)
+
+
+@lru_cache(maxsize=1)
 def get_graph():
-    
-    builder = StateGraph(MessagesState)
-    builder.add_node(call_model)
-    builder.add_node(ToolNode(tools))
-    builder.add_edge(START, "call_model")
-    builder.add_conditional_edges(
-        "call_model",
-        tools_condition,
-    )
-    builder.add_edge("tools", "call_model")
-    graph = builder.compile()
+    """Builds and compiles the agent once; the compiled graph is safe to reuse across turns and threads."""
+    with timer.startup():
+        get_model_with_tools()
+        builder = StateGraph(ChatState)
+        builder.add_node(compact_history)
+        builder.add_node("call_model", RunnableLambda(call_model, acall_model, name="call_model"))
+        builder.add_node("tools", RunnableLambda(run_tools, arun_tools, name="tools"))
+        builder.add_edge(START, "compact_history")
+        builder.add_edge("compact_history", "call_model")
+        builder.add_conditional_edges(
+            "call_model",
+            tools_condition,
+        )
+        builder.add_edge("tools", "compact_history")
+        graph = builder.compile()
     return graph
 
+
+sessions = SessionStore("course_chat", checkpoints=True)
+
+# With RESPONSE_CACHE=course_chat, replies are cached on instructions, history and message
+# for a day, and for no longer than the data of the tools they used stays fresh.
+# Replies with cat or dog facts are not cached: the fact APIs return a random fact per call.
+response_cache = ResponseCache("course_chat", ttl=86400, tool_ttls={
+    # "today" resolves to a new date at midnight
+    "get_horoscope": lambda args: seconds_until_tomorrow(),
+    # The review collection is static
+    "recommend_albums": None,
+})
+
+
+def _turn_result(messages:list) -> tuple[str, list[dict]]:
+    """The reply and the tool calls of the last turn in messages."""
+    turn = split_turns(messages)[-1]
+    tool_calls = [{"name": call["name"], "args": call["args"]}
+                  for m in turn if isinstance(m, AIMessage) for call in m.tool_calls]
+    reply = turn[-1].content if isinstance(turn[-1], AIMessage) and isinstance(turn[-1].content, str) else ""
+    return reply, tool_calls
+
+
+@traced("course_chat.turn", "server")
+async def course_chat_stream(message: str, history: list[dict] = [],
+                             session_id: Optional[str] = None) -> AsyncIterator[list[dict]]:
+    """
+    Runs one chat turn on the graph, yielding the reply as chat messages while it is generated.
+    Sessions with a session_id resume their checkpointed thread; other turns run from history alone, unsaved.
+    """
+    _logs.debug("History: %s", history)
+    start = time.perf_counter()
+    cache_key = response_cache.key(message, history, instructions, model_name)
+    cached = await response_cache.alookup(cache_key)
+    if cached is not None:
+        # The session is not advanced; the next turn restarts its thread from the history
+        yield [{"role": "assistant", "content": cached.reply}]
+        return
+    session = await sessions.abegin_turn(session_id, history)
+    if session.resumed:
+        # The conversation so far is in the checkpointer; only the new message is sent
+        state = {"messages": [HumanMessage(content=message)]}
+    else:
+        langchain_messages, n = history_to_messages(history)
+        langchain_messages.append(HumanMessage(content=message))
+        state = {
+            "messages": langchain_messages,
+            "llm_calls": n
+        }
+
+    # Tokens are streamed as they are generated; ToolNode still awaits independent tool calls concurrently.
+    # Opening the checkpointer on first use is blocking I/O
+    graph = await asyncio.to_thread(session_graph, get_graph(), session)
+    final = {}
+    completed = False
+    try:
+        async for messages in astream_graph(graph, state, thread_config(session), final=final):
+            yield messages
+        completed = True
+    finally:
+        # Also when the client goes away mid-stream, so the session does not resume a partial thread
+        await sessions.aend_turn(session, history, completed=completed)
+    if response_cache.enabled:
+        reply, tool_calls = _turn_result(final["messages"])
+        await response_cache.astore(cache_key, reply, (time.perf_counter() - start) * 1000, tool_calls)
@@ -1,34 +1,50 @@
-from langchain.tools import tool
+from langchain_core.tools import StructuredTool
 import json
-import requests
 
+from utils.http_client import async_http_get, http_get
+from utils.tracing import traced_tool
 
-@tool
-def get_cat_facts(n:int=1):
+CAT_FACTS_URL = "https://meowfacts.herokuapp.com/"
+DOG_FACTS_URL = "http://dogapi.dog/api/v2/facts"
+
+
+def _cat_facts(n:int=1):
     """
     Returns n cat facts from the Meowfacts API.
     """
-    url = "https://meowfacts.herokuapp.com/"
-    params = {
-        "count": n
-    }
-    response = requests.get(url, params=params)
-    resp_dict = json.loads(response.text)
+    response = http_get(CAT_FACTS_URL, params={"count": n})
+    return format_cat_facts(response.text)
+
+async def _acat_facts(n:int=1):
+    response = await async_http_get(CAT_FACTS_URL, params={"count": n})
+    return format_cat_facts(response.text)
+
+def format_cat_facts(text:str) -> str:
+    resp_dict = json.loads(text)
     facts_list = resp_dict.get("data", [])
     facts = "\n".join([f"{i+1}. {fact}\n" for i, fact in enumerate(facts_list)])
     return facts
 
-@tool
-def get_dog_facts(n:int=1):
+
+def _dog_facts(n:int=1):
     """
     Returns n dog facts from the Dog API.
     """
-    url = "http://dogapi.dog/api/v2/facts"
-    params = {
-        "limit": n
-    }
-    response = requests.get(url, params=params)
-    resp_dict = json.loads(response.text)
+    response = http_get(DOG_FACTS_URL, params={"limit": n})
+    return format_dog_facts(response.text)
+
+async def _adog_facts(n:int=1):
+    response = await async_http_get(DOG_FACTS_URL, params={"limit": n})
+    return format_dog_facts(response.text)
+
+def format_dog_facts(text:str) -> str:
+    resp_dict = json.loads(text)
     facts_list = resp_dict.get("data", [])
     facts = "\n".join([f"{i+1}. {fact['attributes']['body']}\n" for i, fact in enumerate(facts_list)])
     return facts
+
+
+# Both tools have a sync and an async implementation, so ToolNode can await
+# several fact requests concurrently when the graph runs with ainvoke.
+get_cat_facts = traced_tool(StructuredTool.from_function(func=_cat_facts, coroutine=_acat_facts, name="get_cat_facts"))
+get_dog_facts = traced_tool(StructuredTool.from_function(func=_dog_facts, coroutine=_adog_facts, name="get_dog_facts"))
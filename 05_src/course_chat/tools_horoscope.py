@@ -1,12 +1,16 @@
-from langchain.tools import tool
-import requests
+from langchain_core.tools import StructuredTool
 import json
+from utils.horoscope_cache import HoroscopeCache
+from utils.http_client import async_http_get, http_get
 from utils.logger import get_logger
+from utils.tracing import traced_tool
 
 _logs = get_logger(__name__)
 
-@tool
-def get_horoscope(sign:str, date:str = "TODAY") -> str:
+HOROSCOPE_URL = "https://horoscope-app-api.vercel.app/api/v1/get-horoscope/daily"
+
+
+def _horoscope(sign:str, date:str = "TODAY") -> str:
     """
     An API call to a horoscope service is made.
     The API call is to https://horoscope-app-api.vercel.app/api/v1/get-horoscope/daily
@@ -14,29 +18,52 @@ def get_horoscope(sign:str, date:str = "TODAY") -> str:
     Accepted values for sign are: Aries, Taurus, Gemini, Cancer, Leo, Virgo, Libra, Scorpio, Sagittarius, Capricorn, Aquarius, Pisces
     Accepted values for date are: Date in format (YYYY-MM-DD) OR "TODAY" OR "TOMORROW" OR "YESTERDAY".
     """
-    _logs.debug(f'Getting horoscope for sign {sign}, and date {date}')
-    response = get_horoscope_from_service(sign, date)
-    horoscope = get_horoscope_from_response(sign, response)
-    _logs.debug(f'Horoscope result: {horoscope}')
+    _logs.debug('Getting horoscope for sign %s, and date %s', sign, date)
+    horoscope = horoscope_cache.get(sign, date)
+    _logs.debug('Horoscope result: %s', horoscope)
     return horoscope
 
+async def _ahoroscope(sign:str, date:str = "TODAY") -> str:
+    _logs.debug('Getting horoscope for sign %s, and date %s', sign, date)
+    horoscope = await horoscope_cache.aget(sign, date)
+    _logs.debug('Horoscope result: %s', horoscope)
+    return horoscope
 
+get_horoscope = traced_tool(StructuredTool.from_function(func=_horoscope, coroutine=_ahoroscope, name="get_horoscope"))
 
-def get_horoscope_from_service(sign:str, day:str):
-    url = "https://horoscope-app-api.vercel.app/api/v1/get-horoscope/daily"
-    params = {
+
+
+def get_horoscope_params(sign:str, day:str) -> dict:
+    return {
         "sign": sign.capitalize(),
         "day": day.upper()
     }
-    response = requests.get(url, params=params)
-    return response
 
+def get_horoscope_from_service(sign:str, day:str):
+    return http_get(HOROSCOPE_URL, params=get_horoscope_params(sign, day))
+
+async def aget_horoscope_from_service(sign:str, day:str):
+    return await async_http_get(HOROSCOPE_URL, params=get_horoscope_params(sign, day))
 
 
-def get_horoscope_from_response(sign:str, response:requests.Response) -> str:
+
+def get_horoscope_from_response(sign:str, response) -> str:
     resp_dict = json.loads(response.text)
     data = resp_dict.get("data")
     horoscope_data = data.get("horoscope_data", "No horoscope found.")
     date = data.get("date", "No date found.")
     horoscope = f"Horoscope for {sign.capitalize()} on {date}: {horoscope_data}"
-    return horoscope
\ No newline at end of file
+    return horoscope
+
+
+
+def fetch_horoscope(sign:str, day:str) -> str:
+    response = get_horoscope_from_service(sign, day)
+    return get_horoscope_from_response(sign, response)
+
+async def afetch_horoscope(sign:str, day:str) -> str:
+    response = await aget_horoscope_from_service(sign, day)
+    return get_horoscope_from_response(sign, response)
+
+# Keyed on (sign, resolved date); see utils.horoscope_cache.
+horoscope_cache = HoroscopeCache(fetch=fetch_horoscope, afetch=afetch_horoscope)
@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+from utils.logger import get_logger
+
+_logs = get_logger(__name__)
+
+PENDING = "pending"
+EMBEDDED = "embedded"
+
+
+class IngestionCheckpoint:
+    '''
+    Records which reviews have been chunked and which chunk custom_ids have been embedded.
+
+    State lives in a SQLite file so lookups do not require holding the corpus in memory,
+    and so an interrupted run can resume where the last committed batch file ended.
+    '''
+
+    def __init__(self, path:str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS reviews (
+                    reviewid TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    custom_id TEXT PRIMARY KEY,
+                    reviewid TEXT NOT NULL,
+                    batch_file TEXT,
+                    status TEXT NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_reviewid ON chunks (reviewid)")
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_review_hash(self, reviewid:str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash FROM reviews WHERE reviewid = ?", (str(reviewid),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def is_review_embedded(self, reviewid:str, content_hash:str) -> bool:
+        '''
+        True when the review was chunked with this content hash and every one of its chunks is embedded.
+        '''
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, "
+                "(SELECT COUNT(*) FROM chunks WHERE chunks.reviewid = reviews.reviewid AND status != ?) "
+                "FROM reviews WHERE reviewid = ?", (EMBEDDED, str(reviewid))
+            ).fetchone()
+        return bool(row) and row[0] == content_hash and row[1] == 0
+
+    def commit_batch_file(self, batch_file:str, reviews:dict[str, str], custom_ids:list[tuple[str, str]]):
+        '''
+        Records a completed batch file: the content hash of every review it covers and its chunk custom_ids.
+        Chunks from previous versions of these reviews are dropped.
+        '''
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM chunks WHERE reviewid = ?",
+                [(reviewid,) for reviewid in reviews]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO reviews (reviewid, content_hash) VALUES (?, ?)",
+                list(reviews.items())
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (custom_id, reviewid, batch_file, status) VALUES (?, ?, ?, ?)",
+                [(custom_id, reviewid, batch_file, PENDING) for custom_id, reviewid in custom_ids]
+            )
+
+    def mark_embedded(self, custom_ids:Iterable[str], batch_size:int = 10000) -> int:
+        '''
+        Marks chunks as embedded. Returns the number of chunks updated.
+        '''
+        updated = 0
+        batch = []
+        for custom_id in custom_ids:
+            batch.append((EMBEDDED, custom_id))
+            if len(batch) >= batch_size:
+                updated += self._update_status(batch)
+                batch = []
+        if batch:
+            updated += self._update_status(batch)
+        return updated
+
+    def _update_status(self, rows:list[tuple[str, str]]) -> int:
+        with self._lock, self._conn:
+            cursor = self._conn.executemany("UPDATE chunks SET status = ? WHERE custom_id = ?", rows)
+            return cursor.rowcount
+
+    def is_embedded(self, custom_id:str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM chunks WHERE custom_id = ?", (custom_id,)
+            ).fetchone()
+        return bool(row) and row[0] == EMBEDDED
+
+    def counts(self) -> dict:
+        with self._lock:
+            reviews = self._conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+            by_status = dict(self._conn.execute("SELECT status, COUNT(*) FROM chunks GROUP BY status").fetchall())
+        return {"reviews": reviews, "pending": by_status.get(PENDING, 0), "embedded": by_status.get(EMBEDDED, 0)}
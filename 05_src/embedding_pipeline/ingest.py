@@ -0,0 +1,254 @@
+'''
+Streams the Pitchfork review corpus into OpenAI batch files for embedding.
+
+Reviews are read one line at a time, chunked lazily and written to batch files as they
+are produced, so memory use does not depend on the size of the corpus. A SQLite checkpoint
+records the content hash of every review that made it into a completed batch file and the
+status of its chunks, so a re-run only chunks new or changed reviews and reviews whose chunks
+were never marked embedded.
+
+Usage (from 05_src):
+    python -m embedding_pipeline.ingest prepare --input ./documents/pitchfork_content.jsonl
+    python -m embedding_pipeline.ingest mark-embedded ./documents/batch_output_*.jsonl
+'''
+import argparse
+from glob import glob
+import hashlib
+import json
+import os
+import re
+from typing import Iterator, Optional
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from embedding_pipeline.checkpoint import IngestionCheckpoint
+from utils.logger import get_logger
+
+_logs = get_logger(__name__)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+BATCH_FILE_PREFIX = "pitchfork_reviews_batch_"
+
+
+def iter_reviews(path:str, content_key:str = "content") -> Iterator[dict]:
+    '''
+    Yields one review at a time from a JSONL file.
+    seq_num is the 1-based line number, matching the seq_num that JSONLoader assigns.
+    '''
+    with open(path, "r", encoding="utf-8") as f:
+        for seq_num, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield {
+                "reviewid": str(record.get("reviewid")),
+                "seq_num": seq_num,
+                "content": record.get(content_key) or ""
+            }
+
+
+def content_hash(content:str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_custom_id(reviewid:str, seq_num:int, start_index:int) -> str:
+    return f"{reviewid}_{seq_num}_{start_index}"
+
+
+def get_text_splitter(chunk_size:int = 2000, chunk_overlap:int = 200) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        add_start_index=True
+    )
+
+
+def iter_chunks(review:dict, text_splitter:RecursiveCharacterTextSplitter) -> Iterator[dict]:
+    metadata = {"reviewid": review["reviewid"], "seq_num": review["seq_num"]}
+    for doc in text_splitter.create_documents([review["content"]], metadatas=[metadata]):
+        yield {
+            "custom_id": get_custom_id(review["reviewid"], review["seq_num"], doc.metadata["start_index"]),
+            "reviewid": review["reviewid"],
+            "content": doc.page_content
+        }
+
+
+def batch_request(custom_id:str, content:str, model:str = EMBEDDING_MODEL) -> dict:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/embeddings",
+        "body": {
+            "model": model,
+            "input": content
+        }
+    }
+
+
+class BatchFileWriter:
+    '''
+    Writes batch requests to numbered JSONL files, starting a new file after max_lines requests.
+
+    Each file is written under a temporary name and renamed when complete; only then are its
+    reviews recorded in the checkpoint. A review's chunks are never split across two files.
+    '''
+
+    def __init__(self, output_dir:str, checkpoint:IngestionCheckpoint,
+                 max_lines_per_file:int = 10000, prefix:str = BATCH_FILE_PREFIX):
+        self.output_dir = output_dir
+        self.checkpoint = checkpoint
+        self.max_lines_per_file = max_lines_per_file
+        self.prefix = prefix
+        self.files_written = []
+        self._file_num = self._last_file_num()
+        self._file = None
+        self._tmp_path = None
+        self._lines = 0
+        self._reviews = {}
+        self._custom_ids = []
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _last_file_num(self) -> int:
+        nums = [0]
+        for path in glob(os.path.join(self.output_dir, f"{self.prefix}*.jsonl")):
+            if match := re.search(rf"{re.escape(self.prefix)}(\d+)\.jsonl$", path):
+                nums.append(int(match.group(1)))
+        return max(nums)
+
+    def _current_path(self) -> str:
+        return os.path.join(self.output_dir, f"{self.prefix}{self._file_num}.jsonl")
+
+    def _open(self):
+        self._file_num += 1
+        self._tmp_path = self._current_path() + ".tmp"
+        self._file = open(self._tmp_path, "w", encoding="utf-8")
+        self._lines = 0
+
+    def write_review(self, reviewid:str, digest:str, chunks:list[dict], model:str = EMBEDDING_MODEL):
+        if self._file is None:
+            self._open()
+        for chunk in chunks:
+            self._file.write(json.dumps(batch_request(chunk["custom_id"], chunk["content"], model)) + "\n")
+            self._custom_ids.append((chunk["custom_id"], reviewid))
+        self._lines += len(chunks)
+        self._reviews[reviewid] = digest
+        if self._lines >= self.max_lines_per_file:
+            self.flush()
+
+    def flush(self):
+        '''
+        Completes the current file and records its contents in the checkpoint.
+        '''
+        if self._file is None:
+            return
+        self._file.close()
+        path = self._current_path()
+        os.replace(self._tmp_path, path)
+        self.checkpoint.commit_batch_file(os.path.basename(path), self._reviews, self._custom_ids)
+        _logs.info(f'Wrote {path} with {self._lines} requests from {len(self._reviews)} reviews')
+        self.files_written.append(path)
+        self._file = None
+        self._reviews = {}
+        self._custom_ids = []
+
+    def abort(self):
+        '''
+        Discards the file in progress so an interrupted run leaves no partial batch file behind.
+        '''
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._tmp_path)
+            self._file = None
+
+
+def prepare_batch_files(input_path:str,
+                        output_dir:str,
+                        checkpoint_path:str,
+                        max_lines_per_file:int = 10000,
+                        chunk_size:int = 2000,
+                        chunk_overlap:int = 200,
+                        model:str = EMBEDDING_MODEL,
+                        limit:Optional[int] = None) -> dict:
+    '''
+    Chunks new, changed or not yet embedded reviews from input_path into batch files in output_dir.
+    Returns counts of reviews seen, skipped and written, chunks written, and the files created.
+    '''
+    text_splitter = get_text_splitter(chunk_size, chunk_overlap)
+    stats = {"reviews_seen": 0, "reviews_skipped": 0, "reviews_written": 0, "chunks_written": 0}
+    with IngestionCheckpoint(checkpoint_path) as checkpoint:
+        writer = BatchFileWriter(output_dir, checkpoint, max_lines_per_file)
+        try:
+            for review in iter_reviews(input_path):
+                if limit is not None and stats["reviews_seen"] >= limit:
+                    break
+                stats["reviews_seen"] += 1
+                digest = content_hash(review["content"])
+                # A review is only done once all of its chunks are embedded; pending chunks are re-emitted
+                if checkpoint.is_review_embedded(review["reviewid"], digest):
+                    stats["reviews_skipped"] += 1
+                    continue
+                chunks = list(iter_chunks(review, text_splitter))
+                writer.write_review(review["reviewid"], digest, chunks, model)
+                stats["reviews_written"] += 1
+                stats["chunks_written"] += len(chunks)
+            writer.flush()
+        except BaseException:
+            writer.abort()
+            raise
+        stats["files"] = writer.files_written
+    _logs.info(f'Batch preparation complete: {stats}')
+    return stats
+
+
+def iter_output_custom_ids(paths:list[str]) -> Iterator[str]:
+    '''
+    Yields the custom_id of every successful request in batch output files.
+    '''
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("error") is None and (record.get("response") or {}).get("status_code", 200) == 200:
+                    yield record["custom_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="./documents/embedding_checkpoint.db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    prepare = subparsers.add_parser("prepare", help="Write batch files for new, changed or not yet embedded reviews.")
+    prepare.add_argument("--input", default="./documents/pitchfork_content.jsonl")
+    prepare.add_argument("--output-dir", default="./documents/")
+    prepare.add_argument("--max-lines-per-file", type=int, default=10000)
+    prepare.add_argument("--chunk-size", type=int, default=2000)
+    prepare.add_argument("--chunk-overlap", type=int, default=200)
+    prepare.add_argument("--model", default=EMBEDDING_MODEL)
+    prepare.add_argument("--limit", type=int, default=None, help="Only read the first N reviews.")
+
+    mark = subparsers.add_parser("mark-embedded", help="Record the custom_ids in batch output files as embedded.")
+    mark.add_argument("outputs", nargs="+")
+
+    subparsers.add_parser("status", help="Show checkpoint counts.")
+
+    args = parser.parse_args()
+    if args.command == "prepare":
+        prepare_batch_files(args.input, args.output_dir, args.checkpoint,
+                            max_lines_per_file=args.max_lines_per_file,
+                            chunk_size=args.chunk_size,
+                            chunk_overlap=args.chunk_overlap,
+                            model=args.model,
+                            limit=args.limit)
+    elif args.command == "mark-embedded":
+        with IngestionCheckpoint(args.checkpoint) as checkpoint:
+            updated = checkpoint.mark_embedded(iter_output_custom_ids(args.outputs))
+        _logs.info(f'Marked {updated} chunks as embedded')
+    with IngestionCheckpoint(args.checkpoint) as checkpoint:
+        print(json.dumps(checkpoint.counts()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+'''
+Loads embedding batch outputs into the vector store.
+
+Output and input files of each batch are streamed side by side and joined on custom_id,
+holding only out-of-order lines in memory. Joined records are upserted into Chroma in large
+batches from a pool of worker threads, or streamed into a local vector index.
+
+Batches can come from the OpenAI Batch API or, for offline runs, from a directory where
+every input file <name>.jsonl has a matching <name>_output.jsonl.
+
+Usage (from 05_src):
+    python -m embedding_pipeline.load --source local --batch-dir ./documents/ --target chroma
+    python -m embedding_pipeline.load --source openai --description "Pitchfork reviews content embeddings ..."
+'''
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from glob import glob
+import json
+import os
+import time
+from typing import Iterable, Iterator, Optional
+
+from tqdm import tqdm
+
+from embedding_pipeline.checkpoint import IngestionCheckpoint
+from utils.logger import get_logger
+
+_logs = get_logger(__name__)
+
+OUTPUT_SUFFIX = "_output.jsonl"
+
+
+class LocalBatchSource:
+    '''
+    A file-based stand-in for the Batch API. File ids are paths.
+    '''
+
+    def __init__(self, batch_dir:str, pattern:str = "pitchfork_reviews_batch_*.jsonl"):
+        self.batch_dir = batch_dir
+        self.pattern = pattern
+
+    def list_batches(self) -> list[dict]:
+        batches = []
+        for input_path in sorted(glob(os.path.join(self.batch_dir, self.pattern))):
+            if input_path.endswith(OUTPUT_SUFFIX):
+                continue
+            output_path = input_path[:-len(".jsonl")] + OUTPUT_SUFFIX
+            if os.path.exists(output_path):
+                batches.append({
+                    "batch_id": os.path.basename(input_path),
+                    "status": "completed",
+                    "input_file_id": input_path,
+                    "output_file_id": output_path
+                })
+            else:
+                _logs.warning(f'No output file for {input_path}, skipping')
+        return batches
+
+    def iter_lines(self, file_id:str) -> Iterator[str]:
+        with open(file_id, "r", encoding="utf-8") as f:
+            yield from f
+
+
+class OpenAIBatchSource:
+    '''
+    Completed batches from the OpenAI Batch API whose description matches. File contents are streamed.
+    '''
+
+    def __init__(self, description:str, client=None):
+        from openai import OpenAI
+        self.description = description
+        self.client = client or OpenAI()
+
+    def list_batches(self) -> list[dict]:
+        batches = []
+        for batch in self.client.batches.list():
+            if (batch.metadata or {}).get("description") != self.description:
+                continue
+            if batch.status != "completed":
+                _logs.warning(f'Batch {batch.id} is {batch.status}, skipping')
+                continue
+            batches.append({
+                "batch_id": batch.id,
+                "status": batch.status,
+                "input_file_id": batch.input_file_id,
+                "output_file_id": batch.output_file_id
+            })
+        return batches
+
+    def iter_lines(self, file_id:str) -> Iterator[str]:
+        with self.client.files.with_streaming_response.content(file_id) as response:
+            yield from response.iter_lines()
+
+
+def _parse_lines(lines:Iterable[str]) -> Iterator[dict]:
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def join_batch(output_lines:Iterable[str], input_lines:Iterable[str], stats:Optional[dict] = None) -> Iterator[dict]:
+    '''
+    Joins batch output and input records on custom_id and yields {"id", "embedding", "text"} records.
+
+    Both files are read in lockstep. A record is buffered only until its partner arrives,
+    so memory is bounded by how far the two files are out of order, not by their size.
+    '''
+    stats = stats if stats is not None else {}
+    pending_outputs = {}
+    pending_inputs = {}
+    failed_ids = set()
+    outputs = _parse_lines(output_lines)
+    inputs = _parse_lines(input_lines)
+    outputs_done = inputs_done = False
+    max_pending = 0
+
+    def to_record(output:dict, text:str) -> dict:
+        return {
+            "id": output["custom_id"],
+            "embedding": output["response"]["body"]["data"][0]["embedding"],
+            "text": text
+        }
+
+    while not (outputs_done and inputs_done):
+        if not outputs_done:
+            output = next(outputs, None)
+            if output is None:
+                outputs_done = True
+            elif output.get("error") is not None or output["response"]["status_code"] != 200:
+                stats["failed"] = stats.get("failed", 0) + 1
+                if pending_inputs.pop(output["custom_id"], None) is None:
+                    failed_ids.add(output["custom_id"])
+            elif output["custom_id"] in pending_inputs:
+                yield to_record(output, pending_inputs.pop(output["custom_id"]))
+            else:
+                pending_outputs[output["custom_id"]] = output
+        if not inputs_done:
+            item = next(inputs, None)
+            if item is None:
+                inputs_done = True
+            elif item["custom_id"] in failed_ids:
+                failed_ids.discard(item["custom_id"])
+            elif item["custom_id"] in pending_outputs:
+                yield to_record(pending_outputs.pop(item["custom_id"]), item["body"]["input"])
+            else:
+                pending_inputs[item["custom_id"]] = item["body"]["input"]
+        max_pending = max(max_pending, len(pending_outputs) + len(pending_inputs))
+
+    for output in pending_outputs.values():
+        _logs.warning(f'No input text for {output["custom_id"]}')
+        yield to_record(output, "")
+    stats["max_pending"] = max(stats.get("max_pending", 0), max_pending)
+
+
+def iter_batch_records(source, batches:list[dict], stats:Optional[dict] = None) -> Iterator[dict]:
+    for batch in batches:
+        _logs.info(f'Reading batch {batch["batch_id"]}')
+        yield from join_batch(source.iter_lines(batch["output_file_id"]),
+                              source.iter_lines(batch["input_file_id"]),
+                              stats)
+
+
+def _chunked(records:Iterable[dict], batch_size:int) -> Iterator[list[dict]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_records(collection, records:Iterable[dict],
+                   batch_size:int = 1000,
+                   max_workers:int = 4,
+                   checkpoint:Optional[IngestionCheckpoint] = None) -> dict:
+    '''
+    Upserts records into a Chroma collection from a pool of worker threads.
+    At most 2 * max_workers batches are in flight, which bounds memory.
+    Returns the number of records loaded, elapsed seconds and records per second.
+    '''
+    def upsert(batch):
+        collection.upsert(
+            ids=[item["id"] for item in batch],
+            embeddings=[item["embedding"] for item in batch],
+            documents=[item["text"] for item in batch]
+        )
+        if checkpoint is not None:
+            checkpoint.mark_embedded(item["id"] for item in batch)
+        return len(batch)
+
+    start = time.perf_counter()
+    loaded = 0
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+         tqdm(desc="Upserting", unit="rec") as progress:
+        for batch in _chunked(records, batch_size):
+            if len(in_flight) >= 2 * max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    n = future.result()
+                    loaded += n
+                    progress.update(n)
+            in_flight.add(executor.submit(upsert, batch))
+        for future in in_flight:
+            n = future.result()
+            loaded += n
+            progress.update(n)
+    elapsed = time.perf_counter() - start
+    metrics = {
+        "records": loaded,
+        "seconds": elapsed,
+        "records_per_second": loaded / elapsed if elapsed else 0.0
+    }
+    _logs.info(f'Upsert complete: {metrics}')
+    return metrics
+
+
+def get_chroma_collection(chroma_url:str, collection_name:str, recreate:bool = False):
+    import chromadb
+    from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+
+    chroma_client = chromadb.HttpClient(host=chroma_url)
+    if recreate and collection_name in [col.name for col in chroma_client.list_collections()]:
+        chroma_client.delete_collection(name=collection_name)
+    return chroma_client.get_or_create_collection(
+        name=collection_name,
+        embedding_function=OpenAIEmbeddingFunction(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            model_name="text-embedding-3-small")
+    )
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv(".secrets")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=["local", "openai"], default="local")
+    parser.add_argument("--batch-dir", default="./documents/", help="Directory of input/output files for --source local.")
+    parser.add_argument("--description", help="Batch description to match for --source openai.")
+    parser.add_argument("--target", choices=["chroma", "local"], default="chroma")
+    parser.add_argument("--chroma-url", default="http://localhost:8000")
+    parser.add_argument("--collection", default="pitchfork_reviews")
+    parser.add_argument("--recreate", action="store_true", help="Drop and recreate the Chroma collection first.")
+    parser.add_argument("--index-path", default="./documents/pitchfork_index", help="Output path for --target local.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkpoint", default=None, help="Ingestion checkpoint to mark loaded chunks as embedded.")
+    args = parser.parse_args()
+
+    if args.source == "openai":
+        if not args.description:
+            parser.error("--description is required with --source openai")
+        source = OpenAIBatchSource(args.description)
+    else:
+        source = LocalBatchSource(args.batch_dir)
+    batches = source.list_batches()
+    _logs.info(f'Found {len(batches)} completed batches')
+
+    join_stats = {}
+    records = iter_batch_records(source, batches, join_stats)
+    checkpoint = IngestionCheckpoint(args.checkpoint) if args.checkpoint else None
+    try:
+        if args.target == "local":
+            from utils.vector_index import build_index
+            written = []
+
+            def track(records):
+                for record in records:
+                    written.append(record["id"])
+                    yield record
+
+            start = time.perf_counter()
+            count = build_index(args.index_path, tqdm(track(records), desc="Indexing", unit="rec"), name=args.collection)
+            # The index files are complete only once build_index returns
+            if checkpoint is not None:
+                checkpoint.mark_embedded(written)
+            elapsed = time.perf_counter() - start
+            metrics = {"records": count, "seconds": elapsed, "records_per_second": count / elapsed if elapsed else 0.0}
+        else:
+            collection = get_chroma_collection(args.chroma_url, args.collection, args.recreate)
+            metrics = upsert_records(collection, records, args.batch_size, args.workers, checkpoint)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    print(json.dumps({**metrics, **join_stats}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import gradio as gr
-from horoscope_chat.main import horoscope_chat
+from horoscope_chat.main import ahoroscope_chat_stream, horoscope_cache
 from dotenv import load_dotenv
-from typing import Optional
+from typing import AsyncIterator
 import os
 
 from utils.logger import get_logger
@@ -10,11 +10,17 @@ _logs = get_logger(__name__)
 
 load_dotenv('.secrets')
 
+async def horoscope_chat(message: str, history: list[dict], request: gr.Request = None) -> AsyncIterator[list[dict]]:
+    async for messages in ahoroscope_chat_stream(message, history, session_id=request.session_hash if request else None):
+        yield messages
+
 chat = gr.ChatInterface(
     fn=horoscope_chat,
     type="messages"
 )
 
 if __name__ == "__main__":
+    if os.getenv("HOROSCOPE_PREWARM", "false").lower() == "true":
+        horoscope_cache.start_prewarm()
     _logs.info('Starting Horoscope Chat App...')
     chat.launch()
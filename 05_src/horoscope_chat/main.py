@@ -1,10 +1,25 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
 from horoscope_chat.prompts import return_instructions_root
 import json
-import requests
+from langchain_core.messages import BaseMessage, HumanMessage
+from utils.compaction import SUMMARY_PROMPT, HistoryCompactor, split_turns, summary_request
+from utils.horoscope_cache import HoroscopeCache, seconds_until_tomorrow
+from utils.http_client import async_http_get, http_get
 from utils.logger import get_logger
+from utils.response_cache import ResponseCache
+from utils.sessions import Session, SessionStore
+from utils.streaming import ChatStream, history_to_messages
+from utils.tracing import Span, current_span, record_usage, span, traced
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import contextvars
+from functools import partial
 import os
+import threading
+import time
+from typing import AsyncIterator, Generator, Iterator, Optional
 
 
 _logs = get_logger(__name__)
@@ -14,9 +29,16 @@ load_dotenv(".secrets")
 
 
 client = OpenAI()
+# Used by the async handlers (ahoroscope_chat, ahoroscope_chat_stream)
+async_client = AsyncOpenAI()
 
 open_ai_model = os.getenv("OPENAI_MODEL", "gpt-4")
 
+# Model responses whose function calls are answered in one turn; the last must be a text reply
+HOROSCOPE_MAX_TOOL_ROUNDS = int(os.getenv("HOROSCOPE_MAX_TOOL_ROUNDS", 4))
+# Threads running the function calls of one response concurrently in the sync handlers
+HOROSCOPE_TOOL_WORKERS = int(os.getenv("HOROSCOPE_TOOL_WORKERS", 8))
+
 tools = [
     {
         "type": "function",
@@ -45,6 +67,7 @@ tools = [
 
 
 
+@traced("tool.get_horoscope", "tool")
 def get_horoscope(sign:str, date:str = "TODAY") -> str:
     """
     An API call to a horoscope service is made.
@@ -54,9 +77,12 @@ def get_horoscope(sign:str, date:str = "TODAY") -> str:
     Accepted values for date are: Date in format (YYYY-MM-DD) OR "TODAY" OR "TOMORROW" OR "YESTERDAY".
     """
     
-    response = get_horoscope_from_service(sign, date)
-    horoscope = get_horoscope_from_response(sign, response)
-    return horoscope
+    return horoscope_cache.get(sign, date)
+
+
+@traced("tool.get_horoscope", "tool")
+async def aget_horoscope(sign:str, date:str = "TODAY") -> str:
+    return await horoscope_cache.aget(sign, date)
 
 
 
@@ -66,12 +92,21 @@ def get_horoscope_from_service(sign:str, day:str):
         "sign": sign.capitalize(),
         "day": day.upper()
     }
-    response = requests.get(url, params=params)
+    response = http_get(url, params=params)
     return response
 
 
+async def aget_horoscope_from_service(sign:str, day:str):
+    url = "https://horoscope-app-api.vercel.app/api/v1/get-horoscope/daily"
+    params = {
+        "sign": sign.capitalize(),
+        "day": day.upper()
+    }
+    return await async_http_get(url, params=params)
+
 
-def get_horoscope_from_response(sign:str, response:requests.Response) -> str:
+
+def get_horoscope_from_response(sign:str, response) -> str:
     resp_dict = json.loads(response.text)
     data = resp_dict.get("data")
     horoscope_data = data.get("horoscope_data", "No horoscope found.")
@@ -80,6 +115,39 @@ def get_horoscope_from_response(sign:str, response:requests.Response) -> str:
     return horoscope
 
 
+def fetch_horoscope(sign:str, day:str) -> str:
+    response = get_horoscope_from_service(sign, day)
+    return get_horoscope_from_response(sign, response)
+
+
+async def afetch_horoscope(sign:str, day:str) -> str:
+    response = await aget_horoscope_from_service(sign, day)
+    return get_horoscope_from_response(sign, response)
+
+# Keyed on (sign, resolved date), so TODAY/TOMORROW/YESTERDAY roll over at midnight.
+horoscope_cache = HoroscopeCache(fetch=fetch_horoscope, afetch=afetch_horoscope)
+
+# Each turn chains onto the previous response with previous_response_id instead of re-sending the history.
+sessions = SessionStore("horoscope_chat")
+
+
+def summarize_history(summary:str, messages:list[BaseMessage]) -> str:
+    response = create_response(
+        model=open_ai_model,
+        instructions=SUMMARY_PROMPT,
+        input=summary_request(summary, messages)
+    )
+    return response.output_text.strip()
+
+# Once a chained conversation grows over budget it is restarted from the compacted history.
+compactor = HistoryCompactor(summarizer=summarize_history, name="horoscope_chat")
+
+# With RESPONSE_CACHE=horoscope_chat, replies are cached on instructions, history and message
+# for a day. A reply with a horoscope is fresh until midnight, when "today" resolves to a new date.
+response_cache = ResponseCache("horoscope_chat", ttl=86400,
+                               tool_ttls={"get_horoscope": lambda args: seconds_until_tomorrow()})
+
+
 def sanitize_history(history: list[dict]) -> list[dict]:
     clean_history = []
     for msg in history:
@@ -90,60 +158,365 @@ def sanitize_history(history: list[dict]) -> list[dict]:
     return clean_history
 
 
-def horoscope_chat(message: str, history: list[dict] = []) -> str:
-    _logs.info(f'User message: {message}')
-    
-    instructions = return_instructions_root()
-    
+def _conversation_input(message: str, history: list[dict], session: Session) -> dict:
+    """
+    The input of the first call of a turn. A resumed session sends only the new message
+    and chains onto the stored response, while its context is within the token budget.
+    Otherwise a new chain is started from the compacted history: the running summary
+    and the most recent turns, without the tool outputs of earlier turns.
+    """
     user_msg = {
         "role": "user",
         "content": message
     }
-    
-    conversation_input = sanitize_history(history) + [user_msg]
-    
-    response = client.responses.create(
-        model=open_ai_model,  
-        instructions=instructions,
-        input=conversation_input,
-        tools=tools,
-        
-    )
-    
-    conversation_input += response.output
-
-    # Handle function calls if any
-    for item in response.output:
-        if item.type == "function_call":
-            if item.name == "get_horoscope":
-                args = json.loads(item.arguments)
-                _logs.info(f'Function call args: {args}')
-                
-                # Call the horoscope function
-                horoscope_result = get_horoscope(**args)
-                
-                # Add function call result to conversation
-                
-                func_call_output = {
-                    "type": "function_call_output",
-                    "call_id": item.call_id,
-                    "output": json.dumps({
-                        "horoscope": horoscope_result
-                    })
-                }
-                
-                _logs.debug(f"Function call output: {func_call_output}")
-
-                conversation_input = conversation_input + [func_call_output]
-                
-                # Make second API call with function result
-                response = client.responses.create(
-                    model=open_ai_model,
-                    instructions=instructions,
-                    tools=tools,
-                    input=conversation_input
-                )
+    if session.resumed and session.previous_response_id:
+        if (session.input_tokens or 0) <= compactor.budget:
+            return {"input": [user_msg], "previous_response_id": session.previous_response_id}
+        _logs.info(f'Context of {session.input_tokens} tokens is over the budget of {compactor.budget}, compacting')
+
+    # Tool progress messages from earlier turns are display-only and skipped
+    messages, _ = history_to_messages(history)
+    # Turns already folded into the summary are not sent again
+    turns = split_turns(messages)[session.summarized_turns:]
+    messages = [m for turn in turns for m in turn] + [HumanMessage(content=message)]
+    compaction = compactor.compact(messages, session.summary)
+    session.summary = compaction.summary
+    session.summarized_turns += compaction.summarized_turns
+
+    conversation = []
+    if session.summary:
+        conversation.append({"role": "developer", "content": f"Summary of the earlier conversation:\n{session.summary}"})
+    for m in compaction.messages[:-1]:
+        conversation.append({"role": "user" if isinstance(m, HumanMessage) else "assistant", "content": m.content})
+    return {"input": conversation + [user_msg]}
+
+
+def _input_tokens(response) -> Optional[int]:
+    return response.usage.input_tokens if response.usage else None
+
+
+_tool_executor = ThreadPoolExecutor(max_workers=HOROSCOPE_TOOL_WORKERS, thread_name_prefix="horoscope-tool")
+
+
+def _function_calls(response) -> list:
+    return [item for item in response.output if item.type == "function_call"]
+
+
+def _parse_call(item) -> dict:
+    try:
+        args = json.loads(item.arguments)
+    except json.JSONDecodeError:
+        args = None
+    return {"name": item.name, "args": args}
+
+
+def run_function_call(item) -> dict:
+    """
+    Runs one function call of a response. Returns {"horoscope": ...}, or {"error": ...}
+    so the model can explain a failed lookup instead of the turn failing.
+    """
+    call = _parse_call(item)
+    _logs.info(f'Function call {call["name"]} args: {call["args"]}')
+    try:
+        if call["name"] != "get_horoscope" or call["args"] is None:
+            raise ValueError(f'Invalid function call {call["name"]}({item.arguments})')
+        return {"horoscope": get_horoscope(**call["args"])}
+    except Exception as e:
+        _logs.warning(f'Function call {call["name"]} failed: {e!r}')
+        return {"error": repr(e)}
+
+
+async def arun_function_call(item) -> dict:
+    call = _parse_call(item)
+    _logs.info(f'Function call {call["name"]} args: {call["args"]}')
+    try:
+        if call["name"] != "get_horoscope" or call["args"] is None:
+            raise ValueError(f'Invalid function call {call["name"]}({item.arguments})')
+        return {"horoscope": await aget_horoscope(**call["args"])}
+    except Exception as e:
+        _logs.warning(f'Function call {call["name"]} failed: {e!r}')
+        return {"error": repr(e)}
+
+
+def run_function_calls(calls:list) -> list[dict]:
+    """Runs the function calls of one response concurrently. Results are in call order."""
+    if len(calls) == 1:
+        return [run_function_call(calls[0])]
+    # Each call runs in a copy of the current context, so its tool span nests under the turn
+    futures = [_tool_executor.submit(contextvars.copy_context().run, run_function_call, item) for item in calls]
+    return [future.result() for future in futures]
+
+
+async def arun_function_calls(calls:list) -> list[dict]:
+    return await asyncio.gather(*(arun_function_call(item) for item in calls))
+
+
+def _function_call_outputs(calls:list, results:list[dict]) -> list[dict]:
+    outputs = [{
+        "type": "function_call_output",
+        "call_id": item.call_id,
+        "output": json.dumps(result)
+    } for item, result in zip(calls, results)]
+    _logs.debug("Function call outputs: %s", outputs)
+    return outputs
+
+
+def _round_options(i:int) -> dict:
+    # The last round must be answered in text, so a turn always ends with a reply
+    if i == HOROSCOPE_MAX_TOOL_ROUNDS - 1:
+        return {"tool_choice": "none"}
+    return {}
+
+
+def _turn(message:str, history:list[dict], session_id:Optional[str],
+          stream:Optional[ChatStream] = None) -> Generator[tuple, object, str]:
+    """
+    One chat turn, shared by the four handlers, as the steps the handler has to run.
+    Each step is sent back its result:
+        ("call", fn): blocking work, run in a worker thread by the async handlers
+        ("create", kwargs): a model response, streamed into stream by the streaming handlers
+        ("run", calls): the function calls of a response
+        ("update", None): stream.messages changed
+    Returns the reply.
+    """
+    _logs.info(f'User message: {message}')
+    start = time.perf_counter()
+
+    instructions = return_instructions_root()
+    cache_key = response_cache.key(message, history, instructions, open_ai_model)
+    if response_cache.enabled:
+        cached = yield "call", partial(response_cache.lookup, cache_key)
+        if cached is not None:
+            # The session is not advanced; the next turn restarts it from the history
+            if stream is not None:
+                stream.add_text(cached.reply)
+            return cached.reply
+    session = yield "call", partial(sessions.begin_turn, session_id, history)
+    completed = False
+    try:
+        tool_calls = []
+        # Compaction may call the summarizer, a blocking request
+        conversation = yield "call", partial(_conversation_input, message, history, session)
+
+        response = yield "create", dict(
+            model=open_ai_model,
+            instructions=instructions,
+            tools=tools,
+            **conversation
+        )
+
+        # All function calls of a response run concurrently and are answered in one follow-up,
+        # chained onto the response, until the model replies without calls
+        for i in range(HOROSCOPE_MAX_TOOL_ROUNDS):
+            calls = _function_calls(response)
+            if not calls:
                 break
-    
-    
+            results = yield "run", calls
+            tool_calls += [_parse_call(item) for item in calls]
+            if stream is not None:
+                for item, result in zip(calls, results):
+                    stream.finish_tool(item.call_id, result.get("horoscope") or result.get("error"))
+                yield "update", None
+            response = yield "create", dict(
+                model=open_ai_model,
+                instructions=instructions,
+                tools=tools,
+                previous_response_id=response.id,
+                input=_function_call_outputs(calls, results),
+                **_round_options(i)
+            )
+
+        yield "call", partial(sessions.end_turn, session, history, previous_response_id=response.id,
+                              input_tokens=_input_tokens(response))
+        completed = True
+    finally:
+        if not completed and session.session_id is not None:
+            # The turn failed or the client went away mid-turn. No step can be yielded from a
+            # closed turn, so the session is forgotten in a thread rather than on the event loop.
+            threading.Thread(target=sessions.end_turn, args=(session, history), kwargs={"completed": False},
+                             name="horoscope-end-turn", daemon=True).start()
+
+    if response_cache.enabled:
+        yield "call", partial(response_cache.store, cache_key, response.output_text,
+                              (time.perf_counter() - start) * 1000, tool_calls)
     return response.output_text
+
+
+@traced("horoscope_chat.turn", "server")
+def horoscope_chat(message: str, history: list[dict] = [], session_id: Optional[str] = None) -> str:
+    with closing(_turn(message, history, session_id)) as turn:
+        result = None
+        while True:
+            try:
+                kind, payload = turn.send(result)
+            except StopIteration as stop:
+                return stop.value
+            if kind == "create":
+                result = create_response(**payload)
+            elif kind == "run":
+                result = run_function_calls(payload)
+            else:
+                result = payload()
+
+
+def create_response(**kwargs):
+    """client.responses.create, traced with its token usage."""
+    with span("openai.responses.create", "client", model=kwargs.get("model")) as current:
+        response = client.responses.create(**kwargs)
+        record_usage(current, response.usage)
+    return response
+
+
+class ResponseStreamError(RuntimeError):
+    """A streamed response failed, or its stream ended without a response."""
+
+
+def _final_response(event, current:Optional[Span]):
+    """
+    The response a stream ends with, from its terminal event, or None for other events.
+    An incomplete response (cut off at max_output_tokens or by the content filter) is returned
+    with what was generated; a failed response or an error event raises ResponseStreamError.
+    """
+    if event.type in ("response.completed", "response.incomplete"):
+        if event.type == "response.incomplete":
+            details = event.response.incomplete_details
+            reason = details.reason if details else "unknown reason"
+            _logs.warning(f'Response {event.response.id} is incomplete: {reason}')
+        record_usage(current, event.response.usage)
+        return event.response
+    if event.type == "response.failed":
+        error = event.response.error
+        raise ResponseStreamError(f'Response {event.response.id} failed: '
+                                  f'{f"{error.code}: {error.message}" if error else "unknown error"}')
+    if event.type == "error":
+        raise ResponseStreamError(f'Response stream error {event.code}: {event.message}')
+    return None
+
+
+def _stream_response(stream:ChatStream, parent:Optional[Span], **kwargs):
+    """
+    Streams one Responses API call into stream, yielding the chat messages after every
+    text delta or new tool call. Returns the completed response. The call is traced as a
+    child of parent; the steps of a generator can run in different contexts.
+    Raises ResponseStreamError if the response fails or the stream ends without one.
+    """
+    response = None
+    with span("openai.responses.create", "client", parent=parent, activate=False,
+              model=kwargs.get("model"), stream=True) as current:
+        for event in client.responses.create(stream=True, **kwargs):
+            if event.type == "response.output_text.delta":
+                if current is not None and "first_token_ms" not in current.attributes:
+                    current.set(first_token_ms=(time.time_ns() - current.start_ns) / 1e6)
+                stream.add_text(event.delta)
+                yield stream.messages
+            elif event.type == "response.output_item.added" and event.item.type == "function_call":
+                stream.start_tool(event.item.call_id, event.item.name)
+                yield stream.messages
+            else:
+                response = _final_response(event, current) or response
+        if response is None:
+            raise ResponseStreamError("Response stream ended without a response")
+    return response
+
+
+@traced("horoscope_chat.turn", "server")
+def horoscope_chat_stream(message: str, history: list[dict] = [],
+                          session_id: Optional[str] = None) -> Iterator[list[dict]]:
+    """
+    Streaming version of horoscope_chat for gr.ChatInterface: yields the reply as chat
+    messages while it is generated, with each horoscope tool call shown as a progress message.
+    """
+    stream = ChatStream()
+    with closing(_turn(message, history, session_id, stream)) as turn:
+        result = None
+        while True:
+            try:
+                kind, payload = turn.send(result)
+            except StopIteration:
+                break
+            if kind == "create":
+                result = yield from _stream_response(stream, current_span(), **payload)
+            elif kind == "run":
+                result = run_function_calls(payload)
+            elif kind == "update":
+                yield stream.messages
+                result = None
+            else:
+                result = payload()
+    yield stream.messages
+
+
+async def acreate_response(**kwargs):
+    """async_client.responses.create, traced with its token usage."""
+    with span("openai.responses.create", "client", model=kwargs.get("model")) as current:
+        response = await async_client.responses.create(**kwargs)
+        record_usage(current, response.usage)
+    return response
+
+
+async def _astream_response(stream:ChatStream, parent:Optional[Span], **kwargs) -> AsyncIterator[Optional[object]]:
+    """
+    Async version of _stream_response. Yields None after every text delta or new tool call
+    (read stream.messages), then the completed response.
+    """
+    response = None
+    with span("openai.responses.create", "client", parent=parent, activate=False,
+              model=kwargs.get("model"), stream=True) as current:
+        async for event in await async_client.responses.create(stream=True, **kwargs):
+            if event.type == "response.output_text.delta":
+                if current is not None and "first_token_ms" not in current.attributes:
+                    current.set(first_token_ms=(time.time_ns() - current.start_ns) / 1e6)
+                stream.add_text(event.delta)
+                yield None
+            elif event.type == "response.output_item.added" and event.item.type == "function_call":
+                stream.start_tool(event.item.call_id, event.item.name)
+                yield None
+            else:
+                response = _final_response(event, current) or response
+        if response is None:
+            raise ResponseStreamError("Response stream ended without a response")
+    yield response
+
+
+@traced("horoscope_chat.turn", "server")
+async def ahoroscope_chat(message: str, history: list[dict] = [], session_id: Optional[str] = None) -> str:
+    """Async version of horoscope_chat, for serving many conversations from one event loop."""
+    with closing(_turn(message, history, session_id)) as turn:
+        result = None
+        while True:
+            try:
+                kind, payload = turn.send(result)
+            except StopIteration as stop:
+                return stop.value
+            if kind == "create":
+                result = await acreate_response(**payload)
+            elif kind == "run":
+                result = await arun_function_calls(payload)
+            else:
+                result = await asyncio.to_thread(payload)
+
+
+@traced("horoscope_chat.turn", "server")
+async def ahoroscope_chat_stream(message: str, history: list[dict] = [],
+                                 session_id: Optional[str] = None) -> AsyncIterator[list[dict]]:
+    """Async version of horoscope_chat_stream."""
+    stream = ChatStream()
+    with closing(_turn(message, history, session_id, stream)) as turn:
+        result = None
+        while True:
+            try:
+                kind, payload = turn.send(result)
+            except StopIteration:
+                break
+            if kind == "create":
+                async for result in _astream_response(stream, current_span(), **payload):
+                    if result is None:
+                        yield stream.messages
+            elif kind == "run":
+                result = await arun_function_calls(payload)
+            elif kind == "update":
+                yield stream.messages
+                result = None
+            else:
+                result = await asyncio.to_thread(payload)
+    yield stream.messages
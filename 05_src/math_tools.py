@@ -1,16 +1,29 @@
+import ast
+from functools import lru_cache
 import math
+import os
 import re
-from typing import List, Optional
+import threading
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Union
 
 import numexpr
-from langchain.chains.openai_functions import create_structured_output_runnable
+import numpy as np
 from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import StructuredTool
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 
+from utils.cache import get_cache
+from utils.tracing import traced_tool
+
+if TYPE_CHECKING:
+    # Only used in annotations; any chat model with with_structured_output works
+    from langchain_openai import ChatOpenAI
+
+MATH_CACHE_SIZE = int(os.getenv("MATH_CACHE_SIZE", 1024))
+MATH_CACHE_TTL = float(os.getenv("MATH_CACHE_TTL", 86400))
+
 _MATH_DESCRIPTION = (
     "math(problem: str, context: Optional[list[str]]) -> float:\n"
     " - Solves the provided math problem.\n"
@@ -86,27 +99,359 @@ class ExecuteCode(BaseModel):
     )
 
 
-def _evaluate_expression(expression: str) -> str:
+_CONSTANTS = {"pi": math.pi, "e": math.e}
+
+# Numeric literals, and names that may be one of _CONSTANTS
+_NUMBER_PATTERN = r"(?<![\w.])(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?(?![\w.])"
+_NUMBER_RE = re.compile(_NUMBER_PATTERN)
+_LITERAL_RE = re.compile(_NUMBER_PATTERN + r"|\b[A-Za-z_]\w*\b")
+
+# Numbers in problem and context text, allowing thousands separators
+_TEXT_NUMBER_RE = re.compile(r"(?<![\w.])(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?(?![\w])")
+
+_DTYPES = {"i": np.int64, "f": np.float64}
+
+Number = Union[int, float, bool, complex]
+
+
+def _to_python(output: np.ndarray) -> Any:
+    output = np.asarray(output)
+    return output.item() if output.size == 1 else output.tolist()
+
+
+def evaluate_expression(expression: str) -> Number:
+    """Evaluates one numexpr expression and returns a Python number."""
     try:
-        local_dict = {"pi": math.pi, "e": math.e}
-        output = str(
-            numexpr.evaluate(
-                expression.strip(),
-                global_dict={},  # restrict access to globals
-                local_dict=local_dict,  # add common mathematical functions
-            )
+        output = numexpr.evaluate(
+            expression.strip(),
+            global_dict={},  # restrict access to globals
+            local_dict=dict(_CONSTANTS),  # add common mathematical functions
         )
     except Exception as e:
         raise ValueError(
             f'Failed to evaluate "{expression}". Raised error: {repr(e)}.'
             " Please try again with a valid numerical expression"
         )
+    return _to_python(output)
+
+
+def _evaluate_expression(expression: str) -> str:
+    return str(evaluate_expression(expression))
+
+
+_FUNCTIONS = frozenset({
+    "abs", "arccos", "arcsin", "arctan", "arctan2", "ceil", "cos", "cosh", "exp", "expm1",
+    "floor", "fmod", "hypot", "log", "log10", "log1p", "log2", "round", "sin", "sinh",
+    "sqrt", "tan", "tanh", "trunc",
+})
+
+_OPERATORS = (
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub,
+)
+
+
+def _is_arithmetic(node: ast.AST) -> bool:
+    if isinstance(node, ast.Expression):
+        return _is_arithmetic(node.body)
+    if isinstance(node, ast.Constant):
+        return type(node.value) in (int, float)
+    if isinstance(node, ast.Name):
+        return node.id in _CONSTANTS
+    if isinstance(node, ast.BinOp):
+        return isinstance(node.op, _OPERATORS) and _is_arithmetic(node.left) and _is_arithmetic(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, _OPERATORS) and _is_arithmetic(node.operand)
+    if isinstance(node, ast.Call):
+        return (isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS
+                and not node.keywords and all(_is_arithmetic(arg) for arg in node.args))
+    return False
+
+
+def as_expression(problem: str) -> Optional[str]:
+    """
+    Returns the problem if it is already a plain arithmetic expression numexpr can evaluate,
+    such as "37593 * 67" or "sqrt(2518731) / 4" once $N references have been substituted.
+    Word problems, and anything with names other than pi, e and math functions, give None.
+    """
+    expression = problem.strip()
+    if not expression or "^" in expression:
+        # ^ is xor in numexpr; leave it to the model, which rewrites it as **
+        return None
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except (SyntaxError, ValueError):
+        return None
+    return expression if _is_arithmetic(tree) else None
+
+
+def _to_template(expression: str) -> tuple[str, str, list]:
+    """
+    Replaces the literals and constants of an expression with variables _x0, _x1, ...
+    Expressions with the same template and literal kinds can be evaluated together.
+    """
+    values = []
+
+    def replace(match):
+        token = match.group(0)
+        if token in _CONSTANTS:
+            value = _CONSTANTS[token]
+        elif token[0].isdigit() or token[0] == ".":
+            value = float(token) if any(c in token for c in ".eE") else int(token)
+        else:
+            return token
+        values.append(value)
+        return f"_x{len(values) - 1}"
+
+    template = _LITERAL_RE.sub(replace, expression.strip())
+    # Integers outside int64 cannot be stacked; "o" keeps them out of the vectorized path
+    kinds = "".join(
+        "f" if isinstance(v, float) else "i" if -2**63 <= v < 2**63 else "o"
+        for v in values
+    )
+    return template, kinds, values
+
+
+@lru_cache(maxsize=256)
+def _compile(template: str, kinds: str) -> tuple[numexpr.NumExpr, tuple[int, ...]]:
+    """Compiles a template; returns the program and the positions of the variables it uses."""
+    used = tuple(i for i in range(len(kinds)) if re.search(rf"\b_x{i}\b", template))
+    program = numexpr.NumExpr(
+        template,
+        signature=[(f"_x{i}", _DTYPES[kinds[i]]) for i in used],
+    )
+    return program, used
+
+
+def _run(template: str, kinds: str, columns: list[np.ndarray]) -> np.ndarray:
+    program, used = _compile(template, kinds)
+    return np.asarray(program(*[columns[i] for i in used]))
+
+
+@lru_cache(maxsize=256)
+def _get_guard(template: str) -> Optional[str]:
+    """
+    An expression that is true for rows where scalar evaluation may raise or change type:
+    a zero divisor, or a negative exponent (an integer power then gives a float).
+    """
+    conditions = []
+    for node in ast.walk(ast.parse(template, mode="eval")):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Div, ast.FloorDiv, ast.Mod)):
+            conditions.append(f"(({ast.unparse(node.right)}) == 0)")
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+            conditions.append(f"(({ast.unparse(node.right)}) < 0)")
+    return " | ".join(conditions) or None
+
 
-    # Remove any leading and trailing brackets from the output
-    return re.sub(r"^\[|\]$", "", output)
+def _is_float(node: ast.AST, kinds: str) -> bool:
+    """Whether a template node evaluates to a float, given the kinds of its variables."""
+    if isinstance(node, ast.Name):
+        return not node.id.startswith("_x") or kinds[int(node.id[2:])] != "i"
+    if isinstance(node, ast.Constant):
+        return not isinstance(node.value, int)
+    if isinstance(node, ast.BinOp):
+        return isinstance(node.op, ast.Div) or _is_float(node.left, kinds) or _is_float(node.right, kinds)
+    if isinstance(node, ast.UnaryOp):
+        return _is_float(node.operand, kinds)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "abs":
+        return any(_is_float(arg, kinds) for arg in node.args)
+    return True
 
 
-def get_math_tool(llm: ChatOpenAI):
+@lru_cache(maxsize=256)
+def _has_float_mod(template: str, kinds: str) -> bool:
+    """
+    Whether the template takes a float modulo, which numexpr's vectorized kernel computes
+    less precisely than the scalar path ("1997576100 % 7.31" differs in the 8th digit).
+    """
+    try:
+        tree = ast.parse(template, mode="eval")
+    except (SyntaxError, ValueError):
+        # Left to the scalar path, which reports the error
+        return True
+    return any(
+        isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod)
+        and (_is_float(node.left, kinds) or _is_float(node.right, kinds))
+        for node in ast.walk(tree)
+    )
+
+
+def _evaluate_group(template: str, kinds: str, rows: list[list]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates a template over stacked literals. Returns the outputs and a mask of
+    outputs that agree with scalar evaluation.
+
+    Literal-only expressions are folded by numexpr with Python semantics, which can
+    raise (division by zero, integer overflow) where array evaluation silently wraps
+    or returns inf. Rows hit by the template's guard, rows whose integer arithmetic
+    disagrees with a float evaluation of the same template, and non-finite outputs are
+    flagged, so they can be evaluated one by one.
+    """
+    columns = [np.array(column, dtype=_DTYPES[kind]) for column, kind in zip(zip(*rows), kinds)]
+    float_columns = [c.astype(np.float64) for c in columns]
+    as_float_kinds = "f" * len(kinds)
+    output = _run(template, kinds, columns)
+    valid = np.ones(len(rows), dtype=bool)
+    if guard := _get_guard(template):
+        valid &= ~_run(guard, as_float_kinds, float_columns)
+    if output.dtype.kind in "fc":
+        valid &= np.isfinite(output)
+    if "i" in kinds:
+        as_float = _run(template, as_float_kinds, float_columns)
+        if output.dtype.kind == "b":
+            valid &= output == as_float
+        else:
+            valid &= np.isclose(output, as_float, rtol=1e-9, atol=0)
+    return output, valid
+
+
+def evaluate_expressions(
+    expressions: Sequence[Union[str, ExecuteCode]],
+    return_exceptions: bool = True,
+) -> list[Union[Number, Exception]]:
+    """
+    Evaluates many expressions, grouping those that differ only in their literals so each
+    group runs through a cached, compiled numexpr program in one vectorized pass.
+    Templates with a float modulo are evaluated one by one, as the vectorized kernel is less precise.
+
+    Results are Python numbers in input order. Failed expressions give a ValueError,
+    which is raised instead if return_exceptions is False.
+    """
+    codes = [e.code if isinstance(e, ExecuteCode) else e for e in expressions]
+    results: list[Any] = [None] * len(codes)
+    groups: dict[tuple[str, str], list[int]] = {}
+    literals = {}
+    for i, code in enumerate(codes):
+        template, kinds, values = _to_template(code)
+        literals[i] = values
+        groups.setdefault((template, kinds), []).append(i)
+
+    scalar = []
+    for (template, kinds), indices in groups.items():
+        if len(indices) == 1 or not kinds or "o" in kinds or _has_float_mod(template, kinds):
+            scalar.extend(indices)
+            continue
+        try:
+            output, valid = _evaluate_group(template, kinds, [literals[i] for i in indices])
+        except Exception:
+            # Invalid templates are reported with the original expression's error below
+            scalar.extend(indices)
+            continue
+        for i, value, ok in zip(indices, output, valid):
+            if ok:
+                results[i] = value.item()
+            else:
+                scalar.append(i)
+
+    for i in sorted(scalar):
+        try:
+            results[i] = evaluate_expression(codes[i])
+        except ValueError as e:
+            if not return_exceptions:
+                raise
+            results[i] = e
+    return results
+
+
+class TranslationCache:
+    """
+    Memoizes word-problem translations by the shape of the problem.
+
+    Numbers in the problem and context are templated out of the key, and the literals of
+    the generated code that equal one of them become slots, so "what is 110% of 2518731"
+    and "what is 110% of 40" share the code template "<1> * 1.1". Numbers that the code
+    does not use (the 110 above, folded into 1.1) are stored with the entry and must match
+    on lookup; a mismatch counts as a conflict and the model is asked again. Code whose
+    literals can be attributed to more than one number is not cached.
+
+    A literal can equal a problem number by coincidence ("a dozen eggs, 12% are broken"
+    translates to "12 * (1 - 0.12)", where the 12 is the dozen). So a template with slots is
+    served only after a second translation, with different numbers in every slot, produced
+    the same template; until then it is kept as a candidate. Code that also uses a slot's
+    number scaled by 100 (0.12 next to 12) is not cached.
+    """
+
+    def __init__(self, maxsize: int = MATH_CACHE_SIZE, ttl: float = MATH_CACHE_TTL,
+                 name: str = "math_translations"):
+        self.cache = get_cache(name, maxsize=maxsize, ttl=ttl)
+        # Templates seen once, with the numbers they were made from
+        self.candidates = get_cache(f"{name}_candidates", maxsize=maxsize, ttl=ttl)
+        self.conflicts = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(problem: str, context: Optional[List[str]]) -> tuple[tuple, list[str]]:
+        numbers = []
+
+        def replace(match):
+            numbers.append(match.group(0).replace(",", ""))
+            return "<#>"
+
+        texts = [problem.strip(), *(c.strip() for c in context or [])]
+        key = tuple(" ".join(_TEXT_NUMBER_RE.sub(replace, text).split()) for text in texts)
+        return key, numbers
+
+    def get(self, problem: str, context: Optional[List[str]] = None) -> Optional[str]:
+        key, numbers = self._normalize(problem, context)
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        parts, fixed = entry
+        if any(numbers[i] != value for i, value in fixed):
+            with self._lock:
+                self.conflicts += 1
+            return None
+        return "".join(part if isinstance(part, str) else numbers[part] for part in parts)
+
+    def set(self, problem: str, context: Optional[List[str]], code: str) -> bool:
+        """
+        Records a translation. Returns True if its template can now be served by get.
+        """
+        key, numbers = self._normalize(problem, context)
+        values = [float(n) for n in numbers]
+        literals = [float(literal) for literal in _NUMBER_RE.findall(code)]
+        parts, used, pos = [], set(), 0
+        for match in _NUMBER_RE.finditer(code):
+            slots = [i for i, v in enumerate(values) if v == float(match.group(0))]
+            if not slots:
+                continue
+            if len(slots) > 1 or slots[0] in used:
+                # Ambiguous attribution; a new set of numbers could be bound to the wrong slot
+                return False
+            parts.extend((code[pos:match.start()], slots[0]))
+            used.add(slots[0])
+            pos = match.end()
+        parts.append(code[pos:])
+        if any(math.isclose(literal, values[i] * scale) for i in used if values[i]
+               for scale in (0.01, 100) for literal in literals):
+            # The number is used both as is and scaled, so at least one use is not the problem's number
+            return False
+        entry = (tuple(parts), tuple((i, n) for i, n in enumerate(numbers) if i not in used))
+        if used:
+            candidate = self.candidates.get(key)
+            if candidate is None or candidate[0] != entry or any(candidate[1][i] == numbers[i] for i in used):
+                self.candidates.set(key, (entry, tuple(numbers)))
+                return False
+            self.candidates.invalidate(key)
+        self.cache.set(key, entry)
+        return True
+
+    def invalidate(self, problem: str, context: Optional[List[str]] = None):
+        key = self._normalize(problem, context)[0]
+        self.cache.invalidate(key)
+        self.candidates.invalidate(key)
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["conflicts"] = self.conflicts
+        stats["effective_hit_rate"] = (stats["hits"] - self.conflicts) / lookups if lookups else 0.0
+        return stats
+
+
+translation_cache = TranslationCache()
+
+
+def _get_extractor(llm: "ChatOpenAI"):
     prompt = ChatPromptTemplate.from_messages(
         [
             ("system", _SYSTEM_PROMPT),
@@ -114,30 +459,90 @@ def get_math_tool(llm: ChatOpenAI):
             MessagesPlaceholder(variable_name="context", optional=True),
         ]
     )
-    extractor = prompt | llm.with_structured_output(ExecuteCode)
+    return prompt | llm.with_structured_output(ExecuteCode)
+
+
+def _get_chain_input(problem: str, context: Optional[List[str]] = None) -> dict:
+    chain_input = {"problem": problem}
+    if context:
+        context_str = "\n".join(context)
+        if context_str.strip():
+            context_str = _ADDITIONAL_CONTEXT_PROMPT.format(
+                context=context_str.strip()
+            )
+            chain_input["context"] = [SystemMessage(content=context_str)]
+    return chain_input
+
+
+def get_math_tool(llm: "ChatOpenAI", cache: Optional[TranslationCache] = translation_cache):
+    """
+    Returns the math tool. Translations of word problems are memoized in cache;
+    pass cache=None to always ask the model.
+    """
+    extractor = _get_extractor(llm)
 
     def calculate_expression(
         problem: str,
         context: Optional[List[str]] = None,
         config: Optional[RunnableConfig] = None,
     ):
-        chain_input = {"problem": problem}
-        if context:
-            context_str = "\n".join(context)
-            if context_str.strip():
-                context_str = _ADDITIONAL_CONTEXT_PROMPT.format(
-                    context=context_str.strip()
-                )
-                chain_input["context"] = [SystemMessage(content=context_str)]
-        code_model = extractor.invoke(chain_input, config)
+        # Plain arithmetic is evaluated directly; the model is only used for word problems
+        if (expression := as_expression(problem)) is not None:
+            try:
+                return _evaluate_expression(expression)
+            except ValueError:
+                pass
+        if cache is not None and (code := cache.get(problem, context)) is not None:
+            try:
+                return _evaluate_expression(code)
+            except ValueError:
+                cache.invalidate(problem, context)
+        code_model = extractor.invoke(_get_chain_input(problem, context), config)
         try:
-            return _evaluate_expression(code_model.code)
+            output = _evaluate_expression(code_model.code)
         except Exception as e:
             return repr(e)
+        if cache is not None:
+            cache.set(problem, context, code_model.code)
+        return output
 
-    return StructuredTool.from_function(
+    return traced_tool(StructuredTool.from_function(
         name="math",
         func=calculate_expression,
         description=_MATH_DESCRIPTION,
-    )
+    ))
+
+
+def get_math_batch(llm: "ChatOpenAI", cache: Optional[TranslationCache] = translation_cache):
+    """
+    Returns a function that solves many math problems at once: plain arithmetic is used
+    as is, word problems are looked up in cache or translated with one batched LLM call,
+    and all expressions are evaluated together with evaluate_expressions.
+    """
+    extractor = _get_extractor(llm)
+
+    def calculate_expressions(
+        problems: Sequence[str],
+        contexts: Optional[Sequence[Optional[List[str]]]] = None,
+        config: Optional[RunnableConfig] = None,
+    ) -> list[Union[Number, Exception]]:
+        contexts = contexts or [None] * len(problems)
+        codes = [as_expression(p) for p in problems]
+        if cache is not None:
+            codes = [code if code is not None else cache.get(p, c)
+                     for code, p, c in zip(codes, problems, contexts)]
+        word_problems = [i for i, code in enumerate(codes) if code is None]
+        if word_problems:
+            inputs = [_get_chain_input(problems[i], contexts[i]) for i in word_problems]
+            code_models = extractor.batch(inputs, config, return_exceptions=True)
+            for i, code_model in zip(word_problems, code_models):
+                codes[i] = code_model
+        results = list(codes)
+        evaluable = [i for i, code in enumerate(codes) if isinstance(code, (str, ExecuteCode))]
+        for i, value in zip(evaluable, evaluate_expressions([codes[i] for i in evaluable])):
+            results[i] = value
+            if cache is not None and isinstance(codes[i], ExecuteCode) and not isinstance(value, Exception):
+                cache.set(problems[i], contexts[i], codes[i].code)
+        return results
 
+    return calculate_expressions
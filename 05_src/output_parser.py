@@ -1,6 +1,7 @@
 ## Output Parser
 
 import ast
+import itertools
 import re
 from typing import (
     Any,
@@ -18,6 +19,7 @@ from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers.transform import BaseTransformOutputParser
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import BaseTool
+from pydantic import PrivateAttr
 from typing_extensions import TypedDict
 
 THOUGHT_PATTERN = r"Thought: ([^\n]*)"
@@ -26,6 +28,10 @@ ACTION_PATTERN = r"\n*(\d+)\. (\w+)\((.*)\)(\s*#\w+\n)?"
 ID_PATTERN = r"\$\{?(\d+)\}?"
 END_OF_PLAN = "<END_OF_PLAN>"
 
+_THOUGHT_RE = re.compile(THOUGHT_PATTERN)
+_ACTION_RE = re.compile(ACTION_PATTERN)
+_ID_RE = re.compile(ID_PATTERN)
+
 
 ### Helper functions
 
@@ -37,35 +43,46 @@ def _ast_parse(arg: str) -> Any:
         return arg
 
 
-def _parse_llm_compiler_action_args(args: str, tool: Union[str, BaseTool]) -> list[Any]:
-    """Parse arguments from a string."""
-    if args == "":
-        return ()
+def _get_arg_schema(tool: Union[str, BaseTool]) -> Optional[Tuple[Tuple[str, str], ...]]:
+    """The (key, "key=") markers of a tool's arguments, in declaration order."""
     if isinstance(tool, str):
+        return None
+    return tuple((key, f"{key}=") for key in tool.args.keys())
+
+
+def _parse_args_with_schema(
+    args: str, schema: Optional[Tuple[Tuple[str, str], ...]]
+) -> Dict[str, Any]:
+    """Parse arguments from a string in a single forward scan over it."""
+    if args == "" or schema is None:
         return ()
     extracted_args = {}
     tool_key = None
-    prev_idx = None
-    for key in tool.args.keys():
-        # Split if present
-        if f"{key}=" in args:
-            idx = args.index(f"{key}=")
-            if prev_idx is not None:
-                extracted_args[tool_key] = _ast_parse(
-                    args[prev_idx:idx].strip().rstrip(",")
-                )
-            args = args.split(f"{key}=", 1)[1]
-            tool_key = key
-            prev_idx = 0
-    if prev_idx is not None:
+    start = None
+    pos = 0
+    for key, marker in schema:
+        # Keys are searched for in declaration order, each after the previous one
+        idx = args.find(marker, pos)
+        if idx == -1:
+            continue
+        if tool_key is not None:
+            extracted_args[tool_key] = _ast_parse(args[start:idx].strip().rstrip(","))
+        tool_key = key
+        start = pos = idx + len(marker)
+    if tool_key is not None:
         extracted_args[tool_key] = _ast_parse(
-            args[prev_idx:].strip().rstrip(",").rstrip(")")
+            args[start:].strip().rstrip(",").rstrip(")")
         )
     return extracted_args
 
 
+def _parse_llm_compiler_action_args(args: str, tool: Union[str, BaseTool]) -> list[Any]:
+    """Parse arguments from a string."""
+    return _parse_args_with_schema(args, _get_arg_schema(tool))
+
+
 def default_dependency_rule(idx, args: str):
-    matches = re.findall(ID_PATTERN, args)
+    matches = _ID_RE.findall(args)
     numbers = [int(match) for match in matches]
     return idx in numbers
 
@@ -76,7 +93,9 @@ def _get_dependencies_from_graph(
     """Get dependencies from a graph."""
     if tool_name == "join":
         return list(range(1, idx))
-    return [i for i in range(1, idx) if default_dependency_rule(i, str(args))]
+    # Extract the $N references once rather than re-scanning for every earlier index
+    references = {int(match) for match in _ID_RE.findall(str(args))}
+    return sorted(i for i in references if 0 < i < idx)
 
 
 class Task(TypedDict):
@@ -88,20 +107,27 @@ class Task(TypedDict):
 
 
 def instantiate_task(
-    tools: Sequence[BaseTool],
+    tools: Union[Sequence[BaseTool], Dict[str, BaseTool]],
     idx: int,
     tool_name: str,
     args: Union[str, Any],
     thought: Optional[str] = None,
+    arg_schemas: Optional[Dict[str, Optional[Tuple[Tuple[str, str], ...]]]] = None,
 ) -> Task:
     if tool_name == "join":
         tool = "join"
     else:
+        if not isinstance(tools, dict):
+            tools = {tool.name: tool for tool in tools}
         try:
-            tool = tools[[tool.name for tool in tools].index(tool_name)]
-        except ValueError as e:
+            tool = tools[tool_name]
+        except KeyError as e:
             raise OutputParserException(f"Tool {tool_name} not found.") from e
-    tool_args = _parse_llm_compiler_action_args(args, tool)
+    if arg_schemas is not None and tool_name in arg_schemas:
+        schema = arg_schemas[tool_name]
+    else:
+        schema = _get_arg_schema(tool)
+    tool_args = _parse_args_with_schema(args, schema)
     dependencies = _get_dependencies_from_graph(idx, tool_name, tool_args)
 
     return Task(
@@ -118,6 +144,17 @@ class LLMCompilerPlanParser(BaseTransformOutputParser[dict], extra="allow"):
 
     tools: List[BaseTool]
 
+    _tool_map: Dict[str, BaseTool] = PrivateAttr(default_factory=dict)
+    _arg_schemas: Dict[str, Optional[Tuple[Tuple[str, str], ...]]] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        # Tool lookup and argument schemas are resolved once, not per parsed action.
+        # As with the list lookup, the first tool with a given name wins.
+        for tool in self.tools:
+            self._tool_map.setdefault(tool.name, tool)
+            self._arg_schemas.setdefault(tool.name, _get_arg_schema(tool))
+
     def _transform(self, input: Iterator[Union[str, BaseMessage]]) -> Iterator[Task]:
         texts = []
         # TODO: Cleanup tuple state tracking here.
@@ -126,7 +163,8 @@ class LLMCompilerPlanParser(BaseTransformOutputParser[dict], extra="allow"):
             # Assume input is str. TODO: support vision/other formats
             text = chunk if isinstance(chunk, str) else str(chunk.content)
             for task, thought in self.ingest_token(text, texts, thought):
-                yield task
+                if task:
+                    yield task
         # Final possible task
         if texts:
             task, _ = self._parse_task("".join(texts), thought)
@@ -147,32 +185,41 @@ class LLMCompilerPlanParser(BaseTransformOutputParser[dict], extra="allow"):
     def ingest_token(
         self, token: str, buffer: List[str], thought: Optional[str]
     ) -> Iterator[Tuple[Optional[Task], str]]:
-        buffer.append(token)
-        if "\n" in token:
-            buffer_ = "".join(buffer).split("\n")
-            suffix = buffer_[-1]
-            for line in buffer_[:-1]:
-                task, thought = self._parse_task(line, thought)
-                if task:
-                    yield task, thought
-            buffer.clear()
-            buffer.append(suffix)
+        # `buffer` only ever holds the fragments of the current, unfinished line.
+        # A token without a newline is appended; a token with newlines completes
+        # the buffered line with its first segment, so each character is joined
+        # once and the per-token cost does not depend on how long the plan is.
+        # Every completed line is yielded, with or without a task, so the caller
+        # keeps a thought that arrives in an earlier token than its action.
+        if "\n" not in token:
+            buffer.append(token)
+            return
+        lines = token.split("\n")
+        buffer.append(lines[0])
+        first_line = "".join(buffer)
+        buffer.clear()
+        if lines[-1]:
+            buffer.append(lines[-1])
+        for line in itertools.chain((first_line,), itertools.islice(lines, 1, len(lines) - 1)):
+            task, thought = self._parse_task(line, thought)
+            yield task, thought
 
     def _parse_task(self, line: str, thought: Optional[str] = None):
         task = None
-        if match := re.match(THOUGHT_PATTERN, line):
+        if match := _THOUGHT_RE.match(line):
             # Optionally, action can be preceded by a thought
             thought = match.group(1)
-        elif match := re.match(ACTION_PATTERN, line):
+        elif match := _ACTION_RE.match(line):
             # if action is parsed, return the task, and clear the buffer
             idx, tool_name, args, _ = match.groups()
             idx = int(idx)
             task = instantiate_task(
-                tools=self.tools,
+                tools=self._tool_map,
                 idx=idx,
                 tool_name=tool_name,
                 args=args,
                 thought=thought,
+                arg_schemas=self._arg_schemas,
             )
             thought = None
         # Else it is just dropped
@@ -1,31 +1,73 @@
 import gradio as gr
 from langchain_core.messages import HumanMessage, AIMessage
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Iterator, Optional
 import os
+import time
 
 from langchain.chat_models import init_chat_model
+from langgraph.graph import StateGraph, MessagesState, START
+
+from utils.response_cache import ResponseCache
+from utils.sessions import SessionStore, session_graph, thread_config
 
 load_dotenv('.secrets')
 
 if not os.environ.get("OPENAI_API_KEY"):
     raise ValueError("Missing OPENAI_API_KEY environment variable")
 
-llm = init_chat_model("gpt-4o-mini", model_provider="openai")
+model_name = "gpt-4o-mini"
+llm = init_chat_model(model_name, model_provider="openai")
+
+
+def call_model(state: MessagesState):
+    return {"messages": [llm.invoke(state["messages"])]}
+
 
+# The conversation is kept server side in the checkpointer, one thread per browser session.
+builder = StateGraph(MessagesState)
+builder.add_node(call_model)
+builder.add_edge(START, "call_model")
+graph = builder.compile()
+sessions = SessionStore("simple_chat", checkpoints=True)
+# With RESPONSE_CACHE=simple_chat, replies are keyed on the history and message and kept for
+# an hour; an open-ended chat should vary, so this is for demos and load tests only
+response_cache = ResponseCache("simple_chat", ttl=3600)
 
-def simple_chat(message: str, history: list[dict]) -> str:
-    langchain_messages = []
-    for msg in history:
-        if msg['role'] == 'user':
-            langchain_messages.append(HumanMessage(content=msg['content']))
-        elif msg['role'] == 'assistant':
-            langchain_messages.append(AIMessage(content=msg['content']))
-    langchain_messages.append(HumanMessage(content=message))
 
-    response = llm.invoke(langchain_messages)
+def simple_chat(message: str, history: list[dict], request: gr.Request = None) -> Iterator[str]:
+    start = time.perf_counter()
+    cache_key = response_cache.key(message, history, model=model_name)
+    cached = response_cache.lookup(cache_key)
+    if cached is not None:
+        # The session is not advanced; the next turn restarts its thread from the history
+        yield cached.reply
+        return
+    session = sessions.begin_turn(request.session_hash if request else None, history)
+    if session.resumed:
+        langchain_messages = [HumanMessage(content=message)]
+    else:
+        langchain_messages = []
+        for msg in history:
+            if msg['role'] == 'user':
+                langchain_messages.append(HumanMessage(content=msg['content']))
+            elif msg['role'] == 'assistant':
+                langchain_messages.append(AIMessage(content=msg['content']))
+        langchain_messages.append(HumanMessage(content=message))
 
-    return response.content
+    # Yield the reply so far after every token; Gradio renders it as it grows.
+    response = ""
+    completed = False
+    try:
+        for chunk, _ in session_graph(graph, session).stream({"messages": langchain_messages}, thread_config(session),
+                                                             stream_mode="messages"):
+            response += chunk.content
+            yield response
+        completed = True
+    finally:
+        # Also when the client goes away mid-stream, so the session does not resume a partial thread
+        sessions.end_turn(session, history, completed=completed)
+    response_cache.store(cache_key, response, (time.perf_counter() - start) * 1000)
 
     
 gr.ChatInterface(
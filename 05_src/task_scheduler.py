@@ -0,0 +1,401 @@
+
+## Task Scheduler
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+from typing import (
+    Any,
+    AsyncIterable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Union,
+)
+
+from langchain_core.messages import BaseMessage, FunctionMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from typing_extensions import TypedDict
+
+from output_parser import ID_PATTERN, Task
+
+
+### Helper functions
+
+
+def _get_observations(messages: List[BaseMessage]) -> Dict[int, Any]:
+    # Get all previous tool responses
+    results = {}
+    for message in messages[::-1]:
+        if isinstance(message, FunctionMessage):
+            results[int(message.additional_kwargs["idx"])] = message.content
+    return results
+
+
+def _resolve_arg(arg: Union[str, Any], observations: Dict[int, Any]):
+    def replace_match(match):
+        # If the string is ${123}, match.group(0) is ${123}, and match.group(1) is 123.
+        idx = int(match.group(1))
+        return str(observations.get(idx, match.group(0)))
+
+    # For dependencies on other tasks
+    if isinstance(arg, str):
+        return re.sub(ID_PATTERN, replace_match, arg)
+    elif isinstance(arg, list):
+        return [_resolve_arg(a, observations) for a in arg]
+    else:
+        return str(arg)
+
+
+def _resolve_args(task: Task, observations: Dict[int, Any]):
+    args = task["args"]
+    if isinstance(args, str):
+        return _resolve_arg(args, observations)
+    elif isinstance(args, dict):
+        return {key: _resolve_arg(val, observations) for key, val in args.items()}
+    # This will likely fail
+    return args
+
+
+def _tool_name(task: Task) -> str:
+    return task["tool"] if isinstance(task["tool"], str) else task["tool"].name
+
+
+def _missing_dependency_error(task: Task, missing: List[int]) -> str:
+    return (
+        f"ERROR(Failed to call {_tool_name(task)} with args {task['args']}."
+        f" Dependencies {missing} were never scheduled.)"
+    )
+
+
+def _execute_task(task: Task, observations: Dict[int, Any], config: Optional[RunnableConfig]):
+    tool_to_use = task["tool"]
+    if isinstance(tool_to_use, str):
+        return tool_to_use
+    args = task["args"]
+    try:
+        resolved_args = _resolve_args(task, observations)
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}.)"
+            f" Args could not be resolved. Error: {repr(e)}"
+        )
+    try:
+        return tool_to_use.invoke(resolved_args, config)
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}."
+            + f" Args resolved to {resolved_args}. Error: {repr(e)})"
+        )
+
+
+async def _aexecute_task(task: Task, observations: Dict[int, Any], config: Optional[RunnableConfig]):
+    tool_to_use = task["tool"]
+    if isinstance(tool_to_use, str):
+        return tool_to_use
+    args = task["args"]
+    try:
+        resolved_args = _resolve_args(task, observations)
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}.)"
+            f" Args could not be resolved. Error: {repr(e)}"
+        )
+    try:
+        return await tool_to_use.ainvoke(resolved_args, config)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        return (
+            f"ERROR(Failed to call {tool_to_use.name} with args {args}."
+            + f" Args resolved to {resolved_args}. Error: {repr(e)})"
+        )
+
+
+class TaskScheduler:
+    """Executes a stream of planned tasks as a DAG.
+
+    Each task is dispatched as soon as all of its dependencies have observations,
+    so independent tasks from one plan run in parallel while the plan is still streaming.
+    `$N` references in the arguments are replaced with the observation of task N.
+
+    `tool_concurrency` caps how many calls to a given tool run at once, e.g. {"math": 4}.
+    `cancel()` stops a run (for instance when the joiner decides to replan): tasks that have
+    not started are dropped and `schedule`/`aschedule` return the observations gathered so far.
+    An instance runs one schedule at a time; `tasks` holds the tasks seen by the last run.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        tool_concurrency: Optional[Dict[str, int]] = None,
+    ):
+        self.max_workers = max_workers
+        self.tool_concurrency = tool_concurrency or {}
+        self.tasks: Dict[int, Task] = {}
+        self._cancelled = threading.Event()
+        self._condition: Optional[threading.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_tasks: List[asyncio.Task] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Cancel the current run. Safe to call from any thread."""
+        self._cancelled.set()
+        condition = self._condition
+        if condition is not None:
+            with condition:
+                condition.notify_all()
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._cancel_async_tasks)
+
+    def _cancel_async_tasks(self):
+        for task in self._async_tasks:
+            task.cancel()
+
+    def schedule(
+        self,
+        tasks: Iterable[Task],
+        observations: Optional[Dict[int, Any]] = None,
+        config: Optional[RunnableConfig] = None,
+    ) -> Dict[int, Any]:
+        """Run tasks on a thread pool. Returns observations keyed by task index."""
+        self._cancelled.clear()
+        self.tasks = {}
+        observations = {} if observations is None else observations
+        semaphores = {
+            name: threading.BoundedSemaphore(limit)
+            for name, limit in self.tool_concurrency.items()
+        }
+        condition = self._condition = threading.Condition()
+        waiting: Dict[int, Task] = {}
+        running = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        def is_ready(task: Task) -> bool:
+            return all(dep in observations for dep in task["dependencies"])
+
+        def run(task: Task):
+            if self.cancelled:
+                return
+            semaphore = semaphores.get(_tool_name(task))
+            if semaphore is not None:
+                semaphore.acquire()
+            try:
+                if self.cancelled:
+                    return
+                with condition:
+                    snapshot = dict(observations)
+                observation = _execute_task(task, snapshot, config)
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+            with condition:
+                observations[task["idx"]] = observation
+
+        def on_done(_future):
+            nonlocal running
+            with condition:
+                running -= 1
+                ready = [] if self.cancelled else [t for t in waiting.values() if is_ready(t)]
+                for task in ready:
+                    del waiting[task["idx"]]
+                running += len(ready)
+                condition.notify_all()
+            for task in ready:
+                submit(task)
+
+        def submit(task: Task):
+            executor.submit(run, task).add_done_callback(on_done)
+
+        try:
+            planned = self.tasks
+            for task in tasks:
+                if self.cancelled:
+                    break
+                planned[task["idx"]] = task
+                with condition:
+                    if not is_ready(task):
+                        waiting[task["idx"]] = task
+                        continue
+                    running += 1
+                submit(task)
+
+            with condition:
+                while True:
+                    condition.wait_for(lambda: running == 0 or self.cancelled)
+                    if self.cancelled or not waiting:
+                        break
+                    # Nothing is running but tasks are still waiting: some dependency was
+                    # never planned. Record an error for the tasks blocked on it and go on.
+                    stuck = [
+                        t for t in waiting.values()
+                        if any(dep not in planned and dep not in observations for dep in t["dependencies"])
+                    ]
+                    if not stuck:
+                        stuck = list(waiting.values())
+                    for task in stuck:
+                        missing = [dep for dep in task["dependencies"] if dep not in observations]
+                        observations[task["idx"]] = _missing_dependency_error(task, missing)
+                        del waiting[task["idx"]]
+                    ready = [t for t in waiting.values() if is_ready(t)]
+                    for task in ready:
+                        del waiting[task["idx"]]
+                    running += len(ready)
+                    for task in ready:
+                        submit(task)
+        finally:
+            executor.shutdown(wait=not self.cancelled, cancel_futures=self.cancelled)
+            self._condition = None
+        return observations
+
+    async def aschedule(
+        self,
+        tasks: Union[Iterable[Task], AsyncIterable[Task]],
+        observations: Optional[Dict[int, Any]] = None,
+        config: Optional[RunnableConfig] = None,
+    ) -> Dict[int, Any]:
+        """Run tasks as asyncio tasks. Returns observations keyed by task index.
+
+        `tasks` may be an async iterable (e.g. `planner.astream(...)`) or a regular
+        iterable; a regular iterable is consumed in a worker thread so a blocking
+        token stream does not stall the event loop.
+        """
+        self._cancelled.clear()
+        self.tasks = {}
+        self._loop = asyncio.get_running_loop()
+        self._async_tasks = []
+        observations = {} if observations is None else observations
+        limit = asyncio.Semaphore(self.max_workers) if self.max_workers else None
+        semaphores = {
+            name: asyncio.Semaphore(limit)
+            for name, limit in self.tool_concurrency.items()
+        }
+        done_events: Dict[int, asyncio.Event] = {}
+        planned = self.tasks
+        stream_done = asyncio.Event()
+
+        def event_for(idx: int) -> asyncio.Event:
+            if idx not in done_events:
+                done_events[idx] = asyncio.Event()
+                if idx in observations:
+                    done_events[idx].set()
+            return done_events[idx]
+
+        async def run(task: Task):
+            try:
+                for dep in task["dependencies"]:
+                    if dep in observations:
+                        continue
+                    dep_done = asyncio.ensure_future(event_for(dep).wait())
+                    stream_finished = asyncio.ensure_future(stream_done.wait())
+                    await asyncio.wait({dep_done, stream_finished}, return_when=asyncio.FIRST_COMPLETED)
+                    if not dep_done.done() and dep not in planned:
+                        dep_done.cancel()
+                        missing = [d for d in task["dependencies"] if d not in observations and d not in planned]
+                        observations[task["idx"]] = _missing_dependency_error(task, missing)
+                        return
+                    stream_finished.cancel()
+                    await dep_done
+                semaphore = semaphores.get(_tool_name(task))
+                async with _maybe(limit), _maybe(semaphore):
+                    observations[task["idx"]] = await _aexecute_task(task, observations, config)
+            finally:
+                event_for(task["idx"]).set()
+
+        async def iterate():
+            if hasattr(tasks, "__aiter__"):
+                async for task in tasks:
+                    yield task
+            else:
+                iterator = iter(tasks)
+                while True:
+                    task = await asyncio.to_thread(next, iterator, None)
+                    if task is None:
+                        return
+                    yield task
+
+        try:
+            async for task in iterate():
+                if self.cancelled:
+                    break
+                planned[task["idx"]] = task
+                self._async_tasks.append(asyncio.create_task(run(task)))
+            stream_done.set()
+            if self._async_tasks and not self.cancelled:
+                await asyncio.gather(*self._async_tasks, return_exceptions=True)
+        finally:
+            self._cancel_async_tasks()
+            self._loop = None
+        return observations
+
+
+class _maybe:
+    """Async context manager over an optional semaphore."""
+
+    def __init__(self, semaphore: Optional[asyncio.Semaphore]):
+        self.semaphore = semaphore
+
+    async def __aenter__(self):
+        if self.semaphore is not None:
+            await self.semaphore.acquire()
+
+    async def __aexit__(self, *exc):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+
+def observations_to_messages(
+    tasks: Dict[int, Task], observations: Dict[int, Any], originals: Iterable[int] = ()
+) -> List[FunctionMessage]:
+    """Convert new observations to FunctionMessages to add to the graph state."""
+    originals = set(originals)
+    return [
+        FunctionMessage(
+            name=_tool_name(tasks[k]),
+            content=str(observations[k]),
+            additional_kwargs={"idx": k, "args": tasks[k]["args"]},
+            tool_call_id=k,
+        )
+        for k in sorted(observations.keys() - originals)
+        if k in tasks
+    ]
+
+
+class SchedulerInput(TypedDict):
+    messages: List[BaseMessage]
+    tasks: Iterable[Task]
+
+
+def get_schedule_tasks(
+    max_workers: Optional[int] = None,
+    tool_concurrency: Optional[Dict[str, int]] = None,
+) -> RunnableLambda:
+    """Return a runnable that executes the planner's tasks and returns FunctionMessages.
+
+    It has both a sync (thread pool) and an async (asyncio) path, so a LangGraph node
+    can use it with `invoke` or `ainvoke`. Each call gets its own TaskScheduler.
+    """
+
+    def schedule_tasks(scheduler_input: SchedulerInput, config: RunnableConfig) -> List[FunctionMessage]:
+        # If we are re-planning, we may have calls that depend on previous
+        # plans. Start with those.
+        observations = _get_observations(scheduler_input["messages"])
+        originals = set(observations)
+        scheduler = TaskScheduler(max_workers, tool_concurrency)
+        scheduler.schedule(scheduler_input["tasks"], observations, config)
+        return observations_to_messages(scheduler.tasks, observations, originals)
+
+    async def aschedule_tasks(scheduler_input: SchedulerInput, config: RunnableConfig) -> List[FunctionMessage]:
+        observations = _get_observations(scheduler_input["messages"])
+        originals = set(observations)
+        scheduler = TaskScheduler(max_workers, tool_concurrency)
+        await scheduler.aschedule(scheduler_input["tasks"], observations, config)
+        return observations_to_messages(scheduler.tasks, observations, originals)
+
+    return RunnableLambda(schedule_tasks, afunc=aschedule_tasks, name="schedule_tasks")
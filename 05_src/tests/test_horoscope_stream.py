@@ -0,0 +1,82 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# The module creates its OpenAI clients at import; no request is made
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import horoscope_chat.main as horoscope_main
+from horoscope_chat.main import ResponseStreamError, _astream_response, _stream_response
+from utils.streaming import ChatStream
+
+
+def _response(status:str, **fields):
+    return SimpleNamespace(**{"id": "resp_1", "status": status, "usage": None, "output": [],
+                              "output_text": "Partial", "error": None, "incomplete_details": None, **fields})
+
+
+def _delta(text:str):
+    return SimpleNamespace(type="response.output_text.delta", delta=text)
+
+
+def _set_stream(monkeypatch, events:list):
+    monkeypatch.setattr(horoscope_main, "client",
+                        SimpleNamespace(responses=SimpleNamespace(create=lambda **kwargs: iter(events))))
+
+    async def create(**kwargs):
+        async def stream():
+            for event in events:
+                yield event
+        return stream()
+    monkeypatch.setattr(horoscope_main, "async_client",
+                        SimpleNamespace(responses=SimpleNamespace(create=create)))
+
+
+def _run(stream:ChatStream):
+    steps = _stream_response(stream, None, model="test")
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+def _arun(stream:ChatStream):
+    async def run():
+        async for response in _astream_response(stream, None, model="test"):
+            pass
+        return response
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("run", [_run, _arun])
+def test_stream_without_completed_event_raises(monkeypatch, run):
+    _set_stream(monkeypatch, [_delta("Partial")])
+    stream = ChatStream()
+    with pytest.raises(ResponseStreamError, match="without a response"):
+        run(stream)
+    # What was streamed before the failure is still shown
+    assert stream.messages == [{"role": "assistant", "content": "Partial"}]
+
+
+@pytest.mark.parametrize("run", [_run, _arun])
+def test_failed_response_and_error_events_raise(monkeypatch, run):
+    error = SimpleNamespace(code="server_error", message="The model failed")
+    _set_stream(monkeypatch, [_delta("Partial"),
+                              SimpleNamespace(type="response.failed", response=_response("failed", error=error))])
+    with pytest.raises(ResponseStreamError, match="server_error: The model failed"):
+        run(ChatStream())
+
+    _set_stream(monkeypatch, [SimpleNamespace(type="error", code="rate_limit_exceeded", message="Slow down")])
+    with pytest.raises(ResponseStreamError, match="rate_limit_exceeded: Slow down"):
+        run(ChatStream())
+
+
+@pytest.mark.parametrize("run", [_run, _arun])
+def test_incomplete_response_is_returned(monkeypatch, run):
+    response = _response("incomplete")
+    response.incomplete_details = SimpleNamespace(reason="max_output_tokens")
+    _set_stream(monkeypatch, [_delta("Partial"), SimpleNamespace(type="response.incomplete", response=response)])
+    assert run(ChatStream()) is response
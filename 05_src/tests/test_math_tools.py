@@ -0,0 +1,39 @@
+from math_tools import TranslationCache, evaluate_expression, evaluate_expressions
+
+
+def test_translation_cache_ignores_coincidental_literals():
+    cache = TranslationCache(name="test_coincidental_literals")
+    # The 12 in the code is the dozen, not the 12 of "12%"
+    assert not cache.set("A dozen eggs, 12% are broken. How many are intact?", None, "12 * (1 - 0.12)")
+    assert cache.get("A dozen eggs, 25% are broken. How many are intact?") is None
+
+
+def test_translation_cache_serves_confirmed_templates():
+    cache = TranslationCache(name="test_confirmed_templates")
+    assert not cache.set("What is 110% of 2518731?", None, "2518731 * 1.1")
+    assert cache.get("What is 110% of 40?") is None
+    # The same numbers again do not confirm the template
+    assert not cache.set("What is 110% of 2518731?", None, "2518731 * 1.1")
+    assert cache.set("What is 110% of 40?", None, "40 * 1.1")
+    assert cache.get("What is 110% of 7?") == "7 * 1.1"
+    # 110 is folded into 1.1, so a different percentage is not served
+    assert cache.get("What is 120% of 7?") is None
+
+
+def test_translation_cache_rejects_templates_that_change():
+    cache = TranslationCache(name="test_changed_templates")
+    cache.set("A dozen eggs, 12% are broken. How many are intact?", None, "12 * (1 - 0.12)")
+    # No number of the problem is in the code, so it is kept for this exact problem only
+    assert cache.set("A dozen eggs, 25% are broken. How many are intact?", None, "12 * (1 - 0.25)")
+    assert cache.get("A dozen eggs, 25% are broken. How many are intact?") == "12 * (1 - 0.25)"
+    assert cache.get("A dozen eggs, 50% are broken. How many are intact?") is None
+
+
+def test_batch_evaluation_matches_scalar_float_modulo():
+    expressions = ["1997576100 % 7.31", "1997576101 % 7.32", "(278.40 + 11789583) % 61.59", "(12.5 + 7) % 3.5"]
+    assert evaluate_expressions(expressions) == [evaluate_expression(e) for e in expressions]
+
+
+def test_batch_evaluation_vectorizes_integer_modulo():
+    expressions = ["7 % 3", "9 % 4", "-7 % 3"]
+    assert evaluate_expressions(expressions) == [1, 1, 2]
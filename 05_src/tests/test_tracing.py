@@ -0,0 +1,60 @@
+import asyncio
+import contextvars
+
+from utils import tracing
+from utils.tracing import span, traced
+
+
+def _record_spans(monkeypatch) -> list:
+    spans = []
+    monkeypatch.setattr(tracing.tracer, "record", spans.append)
+    return spans
+
+
+def test_traced_generator_keeps_one_trace_across_contexts(monkeypatch):
+    spans = _record_spans(monkeypatch)
+
+    @traced("turn", "server")
+    def turn():
+        for i in range(3):
+            with span(f"step{i}"):
+                pass
+            yield i
+
+    steps = turn()
+    # Gradio runs every next() of a sync generator in a fresh copy of the context
+    while True:
+        try:
+            contextvars.copy_context().run(next, steps)
+        except StopIteration:
+            break
+
+    assert len({s.trace_id for s in spans}) == 1
+    root = next(s for s in spans if s.name == "turn")
+    assert all(s.parent_id == root.span_id for s in spans if s is not root)
+
+
+def test_traced_async_generator_keeps_one_trace_across_tasks(monkeypatch):
+    spans = _record_spans(monkeypatch)
+
+    @traced("turn", "server")
+    async def turn():
+        for i in range(3):
+            with span(f"step{i}"):
+                await asyncio.sleep(0)
+            yield i
+
+    async def consume():
+        steps = turn()
+        # Each step in its own task, so in its own copy of the context
+        while True:
+            try:
+                await asyncio.create_task(steps.__anext__())
+            except StopAsyncIteration:
+                break
+
+    asyncio.run(consume())
+
+    assert len({s.trace_id for s in spans}) == 1
+    root = next(s for s in spans if s.name == "turn")
+    assert all(s.parent_id == root.span_id for s in spans if s is not root)
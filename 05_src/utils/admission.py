@@ -0,0 +1,120 @@
+import asyncio
+from contextlib import asynccontextmanager
+import threading
+
+from dotenv import load_dotenv
+import os
+
+from utils.logger import get_logger
+from utils.tracing import annotate
+
+_logs = get_logger(__name__)
+
+load_dotenv()
+
+# Requests served at once by one worker process
+SERVE_MAX_CONCURRENCY = int(os.getenv("SERVE_MAX_CONCURRENCY", 256))
+# Requests allowed to wait for a slot; more are shed immediately
+SERVE_QUEUE_SIZE = int(os.getenv("SERVE_QUEUE_SIZE", 512))
+# Seconds a request may wait for a slot before it is shed
+SERVE_QUEUE_TIMEOUT = float(os.getenv("SERVE_QUEUE_TIMEOUT", 10))
+
+
+class Overloaded(Exception):
+    '''
+    Raised when a request is shed: the queue is full or the request waited too long for a slot.
+    '''
+
+    def __init__(self, reason:str, retry_after:float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    '''
+    Bounds the requests an event loop works on: at most max_concurrency run at once and
+    at most max_queue wait for a slot, each for up to queue_timeout seconds. Requests
+    beyond that are rejected with Overloaded right away, so an overloaded worker answers
+    quickly with "retry later" instead of letting latency grow without bound.
+    '''
+
+    def __init__(self, max_concurrency:int = SERVE_MAX_CONCURRENCY, max_queue:int = SERVE_QUEUE_SIZE,
+                 queue_timeout:float = SERVE_QUEUE_TIMEOUT, name:str = "admission"):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._stats = {"admitted": 0, "shed_queue_full": 0, "shed_timeout": 0, "max_waiting": 0}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created on first use, in the serving event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _shed(self, reason:str, stat:str):
+        # Called with self._lock held
+        self._stats[stat] += 1
+        _logs.warning(f'{self.name}: shedding request, {reason} '
+                      f'({self._active} active, {self._waiting} waiting)')
+        raise Overloaded(reason, retry_after=max(self.queue_timeout, 1.0))
+
+    async def acquire(self):
+        '''
+        Waits for a slot. Raises Overloaded if the request is shed. Pair with release().
+        '''
+        semaphore = self._get_semaphore()
+        # Checking for room in the queue and taking a place in it is one step
+        with self._lock:
+            if semaphore.locked() and self._waiting >= self.max_queue:
+                self._shed("queue full", "shed_queue_full")
+            self._waiting += 1
+            self._stats["max_waiting"] = max(self._stats["max_waiting"], self._waiting)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._waiting -= 1
+                self._shed(f"waited over {self.queue_timeout:.0f} s", "shed_timeout")
+        except BaseException:
+            with self._lock:
+                self._waiting -= 1
+            raise
+        with self._lock:
+            self._waiting -= 1
+            self._active += 1
+            self._stats["admitted"] += 1
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+        self._get_semaphore().release()
+
+    @asynccontextmanager
+    async def admit(self):
+        '''
+        Holds a slot for the enclosed block. The time spent waiting is added to the current span.
+        '''
+        start = asyncio.get_running_loop().time()
+        await self.acquire()
+        annotate(queue_ms=(asyncio.get_running_loop().time() - start) * 1000)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "waiting": self._waiting,
+                **self._stats,
+            }
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+import threading
+import time
+
+from utils.logger import get_logger
+from utils.tracing import count
+
+_logs = get_logger(__name__)
+
+_MISSING = object()
+
+
+class TTLCache:
+    '''
+    A thread-safe, size-bounded LRU cache whose entries expire after ttl seconds.
+    '''
+
+    def __init__(self, maxsize:int = 1024, ttl:float = 3600, name:str = "cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    count("cache_hits")
+                    return value
+                del self._data[key]
+            self.misses += 1
+            count("cache_misses")
+            return default
+
+    def peek(self, key, default=None):
+        '''
+        Returns the cached value like get, without counting a hit or miss or refreshing its LRU position.
+        '''
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and item[1] > time.monotonic():
+                return item[0]
+            return default
+
+    def set(self, key, value, ttl:float = None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_many(self, keys:list) -> dict:
+        '''
+        Returns a dict with the cached values of the keys that are present and fresh.
+        '''
+        found = {}
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+        return found
+
+    def set_many(self, items:dict, ttl:float = None):
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def invalidate(self, key) -> bool:
+        with self._lock:
+            return self._data.pop(key, _MISSING) is not _MISSING
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        _logs.info(f'Cleared cache {self.name}')
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(name:str, maxsize:int = 1024, ttl:float = 3600) -> TTLCache:
+    '''
+    Returns the process-wide cache registered under name, creating it on first use.
+    Modules that ask for the same name share the same cache.
+    '''
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TTLCache(maxsize=maxsize, ttl=ttl, name=name)
+        return _caches[name]
+
+
+def get_cache_stats() -> list[dict]:
+    with _caches_lock:
+        return [cache.stats() for cache in _caches.values()]
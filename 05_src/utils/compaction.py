@@ -0,0 +1,215 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+import json
+import threading
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+import os
+
+from utils.logger import get_logger
+
+_logs = get_logger(__name__)
+
+load_dotenv()
+
+COMPACTION_TOKEN_BUDGET = int(os.getenv("COMPACTION_TOKEN_BUDGET", 8000))
+COMPACTION_KEEP_TURNS = int(os.getenv("COMPACTION_KEEP_TURNS", 4))
+COMPACTION_TOOL_OUTPUT_TURNS = int(os.getenv("COMPACTION_TOOL_OUTPUT_TURNS", 1))
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+STALE_TOOL_OUTPUT = "[Tool output from an earlier turn omitted to save context.]"
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an assistant.
+Extend the existing summary with the new messages. Keep names, dates, astrological signs,
+numbers, preferences and any open questions; drop greetings and small talk.
+Reply with the updated summary only, in at most 200 words."""
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        # tiktoken downloads its vocabulary on first use; estimate if that is not possible
+        _logs.warning(f'Token encoding {TOKEN_ENCODING} unavailable ({e!r}), estimating 4 characters per token')
+        return None
+
+
+@lru_cache(maxsize=8192)
+def count_text_tokens(text:str) -> int:
+    '''
+    Tokens in a piece of text. Memoized, so only new messages are tokenized on each turn.
+    '''
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _content_text(message:BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return json.dumps(message.content)
+
+
+def count_message_tokens(message:BaseMessage) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_text_tokens(_content_text(message))
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += count_text_tokens(call["name"]) + count_text_tokens(json.dumps(call["args"]))
+    return tokens
+
+
+def count_tokens(messages:list[BaseMessage], summary:str = "") -> int:
+    tokens = sum(count_message_tokens(m) for m in messages)
+    if summary:
+        tokens += MESSAGE_OVERHEAD_TOKENS + count_text_tokens(summary)
+    return tokens
+
+
+def split_turns(messages:list[BaseMessage]) -> list[list[BaseMessage]]:
+    '''
+    Splits messages into turns, each starting at a user message, so a cut never separates
+    a tool call from its output.
+    '''
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def format_transcript(messages:list[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"User: {_content_text(message)}")
+        elif isinstance(message, ToolMessage):
+            lines.append(f"Tool result: {_content_text(message)}")
+        elif isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                lines.append(f"Assistant called {call['name']}({json.dumps(call['args'])})")
+            if _content_text(message):
+                lines.append(f"Assistant: {_content_text(message)}")
+    return "\n".join(lines)
+
+
+def summary_request(summary:str, messages:list[BaseMessage]) -> str:
+    return f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{format_transcript(messages)}"
+
+
+def get_summarizer(model) -> Callable[[str, list[BaseMessage]], str]:
+    '''
+    Returns a summarizer that extends a running summary using a LangChain chat model.
+    '''
+    # Kept out of LangGraph token streams, so summaries are not shown as part of a reply
+    model = model.with_config(tags=["nostream"])
+
+    def summarize(summary:str, messages:list[BaseMessage]) -> str:
+        response = model.invoke([("system", SUMMARY_PROMPT), ("user", summary_request(summary, messages))])
+        return _content_text(response).strip()
+    return summarize
+
+
+@dataclass
+class Compaction:
+    # Messages to keep, in order. Tool messages with stale output are replaced with copies (same id).
+    messages: list[BaseMessage]
+    # Messages folded into the summary or dropped
+    removed: list[BaseMessage]
+    # Truncated copies of stale tool messages
+    replaced: list[BaseMessage]
+    summary: str
+    summarized_turns: int
+    tokens_before: int
+    tokens_after: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.removed or self.replaced)
+
+
+@dataclass
+class HistoryCompactor:
+    '''
+    Keeps conversation context within a token budget before each model call.
+
+    Tool outputs older than the last tool_output_turns turns are replaced with a short
+    placeholder. If the context is still over budget, the oldest turns are folded into a
+    running summary (or dropped, without a summarizer) until at most keep_turns turns are
+    left and the context fits. The current turn is always kept.
+    '''
+    budget:int = COMPACTION_TOKEN_BUDGET
+    keep_turns:int = COMPACTION_KEEP_TURNS
+    tool_output_turns:int = COMPACTION_TOOL_OUTPUT_TURNS
+    summarizer:Optional[Callable[[str, list[BaseMessage]], str]] = None
+    name:str = "compaction"
+    _stats:dict = field(init=False, repr=False, default_factory=lambda: {
+        "calls": 0, "compactions": 0, "tokens_saved": 0, "summarized_turns": 0, "truncated_tool_outputs": 0})
+    _lock:threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
+
+    def compact(self, messages:list[BaseMessage], summary:str = "") -> Compaction:
+        tokens_before = count_tokens(messages, summary)
+        turns = split_turns(messages)
+
+        replaced = []
+        for turn in turns[:max(len(turns) - self.tool_output_turns, 0)]:
+            for i, message in enumerate(turn):
+                if isinstance(message, ToolMessage) and message.content != STALE_TOOL_OUTPUT:
+                    turn[i] = message.model_copy(update={"content": STALE_TOOL_OUTPUT})
+                    replaced.append(turn[i])
+
+        tokens = count_tokens([m for turn in turns for m in turn], summary)
+        aged_out = []
+        if tokens > self.budget:
+            # Compact down to keep_turns at once, so the summarizer is not called on every turn
+            while len(turns) > 1 and (len(turns) > self.keep_turns or tokens > self.budget):
+                turn = turns.pop(0)
+                aged_out.append(turn)
+                tokens -= sum(count_message_tokens(m) for m in turn)
+        if aged_out and self.summarizer is not None:
+            summary = self.summarizer(summary, [m for turn in aged_out for m in turn])
+
+        kept = [m for turn in turns for m in turn]
+        removed = [m for turn in aged_out for m in turn]
+        removed_ids = {id(m) for m in removed}
+        compaction = Compaction(
+            messages=kept,
+            removed=removed,
+            replaced=[m for m in replaced if id(m) not in removed_ids],
+            summary=summary,
+            summarized_turns=len(aged_out),
+            tokens_before=tokens_before,
+            tokens_after=count_tokens(kept, summary),
+        )
+        self._record(compaction)
+        return compaction
+
+    def _record(self, compaction:Compaction):
+        with self._lock:
+            self._stats["calls"] += 1
+            if compaction.changed:
+                self._stats["compactions"] += 1
+                self._stats["tokens_saved"] += compaction.tokens_saved
+                self._stats["summarized_turns"] += compaction.summarized_turns
+                self._stats["truncated_tool_outputs"] += len(compaction.replaced)
+        if compaction.changed:
+            _logs.info(f'{self.name}: {compaction.tokens_before} -> {compaction.tokens_after} tokens '
+                       f'(saved {compaction.tokens_saved}, summarized {compaction.summarized_turns} turns, '
+                       f'truncated {len(compaction.replaced)} tool outputs)')
+        if compaction.tokens_after > self.budget:
+            _logs.warning(f'{self.name}: the current turn alone is {compaction.tokens_after} tokens, '
+                          f'over the budget of {self.budget}')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"name": self.name, "budget": self.budget, **self._stats}
@@ -0,0 +1,199 @@
+import asyncio
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta
+import threading
+from typing import Awaitable, Callable, Optional
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+import os
+
+from utils.cache import get_cache
+from utils.logger import get_logger
+
+_logs = get_logger(__name__)
+
+load_dotenv()
+
+SIGNS = ["Aries", "Taurus", "Gemini", "Cancer", "Leo", "Virgo",
+         "Libra", "Scorpio", "Sagittarius", "Capricorn", "Aquarius", "Pisces"]
+
+RELATIVE_DAYS = {"YESTERDAY": -1, "TODAY": 0, "TOMORROW": 1}
+
+HOROSCOPE_TIMEZONE = os.getenv("HOROSCOPE_TIMEZONE")
+
+
+def today() -> date:
+    if HOROSCOPE_TIMEZONE:
+        return datetime.now(ZoneInfo(HOROSCOPE_TIMEZONE)).date()
+    return date.today()
+
+
+def resolve_date(day:str) -> str:
+    '''
+    Resolves "TODAY", "TOMORROW" and "YESTERDAY" to a YYYY-MM-DD date. Dates are passed through.
+    '''
+    day = (day or "TODAY").strip().upper()
+    if day in RELATIVE_DAYS:
+        return (today() + timedelta(days=RELATIVE_DAYS[day])).isoformat()
+    try:
+        return date.fromisoformat(day).isoformat()
+    except ValueError:
+        # Leave values the service may still understand untouched; they are cached as given.
+        return day
+
+
+def _seconds_until(day:date) -> float:
+    midnight = datetime.combine(day, datetime.min.time())
+    now = datetime.now(ZoneInfo(HOROSCOPE_TIMEZONE)).replace(tzinfo=None) if HOROSCOPE_TIMEZONE else datetime.now()
+    return max((midnight - now).total_seconds(), 0.0)
+
+
+def seconds_until_tomorrow() -> float:
+    '''
+    Seconds until midnight, when "TODAY", "TOMORROW" and "YESTERDAY" resolve to new dates.
+    '''
+    return _seconds_until(today() + timedelta(days=1))
+
+
+class HoroscopeCache:
+    '''
+    Caches horoscopes on (sign, calendar date).
+
+    Relative days are resolved to real dates before lookup, so "TODAY" maps to a new key
+    at day rollover. An entry is kept until the day after its date has passed, since by then
+    no relative day can resolve to it. Only successful fetches are cached. Concurrent misses
+    for a key, sync or async, share one fetch.
+    '''
+
+    def __init__(self, fetch:Callable[[str, str], str],
+                 afetch:Optional[Callable[[str, str], Awaitable[str]]] = None,
+                 cache_name:str = "horoscopes"):
+        self.fetch = fetch
+        self.afetch = afetch
+        self.cache = get_cache(cache_name, maxsize=len(SIGNS) * 8, ttl=2 * 86400)
+        self._prewarm_thread = None
+        self._stop = threading.Event()
+        # Key: the Future of the fetch in flight for it
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def _key(self, sign:str, day:str) -> tuple[str, str]:
+        return sign.strip().capitalize(), resolve_date(day)
+
+    def _ttl(self, resolved:str) -> float:
+        try:
+            return _seconds_until(date.fromisoformat(resolved) + timedelta(days=2))
+        except ValueError:
+            return 3600
+
+    def _join_flight(self, key:tuple[str, str]) -> tuple[Future, bool]:
+        '''
+        Returns the Future of the fetch in flight for key, and whether the caller has to run it.
+        '''
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Future()
+            return flight, True
+
+    def _land(self, key:tuple[str, str], flight:Future, horoscope:Optional[str] = None,
+              error:Optional[BaseException] = None):
+        if error is None:
+            self.cache.set(key, horoscope, ttl=self._ttl(key[1]))
+        with self._flights_lock:
+            del self._flights[key]
+        if error is None:
+            flight.set_result(horoscope)
+        else:
+            flight.set_exception(error)
+
+    def _fetch_once(self, key:tuple[str, str]) -> str:
+        flight, leader = self._join_flight(key)
+        if not leader:
+            return flight.result()
+        # A fetch for the key may have landed between the miss and joining
+        horoscope = self.cache.peek(key)
+        try:
+            if horoscope is None:
+                horoscope = self.fetch(*key)
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, horoscope)
+        return horoscope
+
+    async def _afetch_once(self, key:tuple[str, str]) -> str:
+        flight, leader = self._join_flight(key)
+        if not leader:
+            return await asyncio.wrap_future(flight)
+        horoscope = self.cache.peek(key)
+        try:
+            if horoscope is None:
+                if self.afetch is not None:
+                    horoscope = await self.afetch(*key)
+                else:
+                    horoscope = await asyncio.to_thread(self.fetch, *key)
+        except asyncio.CancelledError:
+            # Callers waiting on this fetch see it fail rather than being cancelled themselves
+            self._land(key, flight, error=RuntimeError(f'Horoscope fetch for {key} was cancelled'))
+            raise
+        except BaseException as e:
+            self._land(key, flight, error=e)
+            raise
+        self._land(key, flight, horoscope)
+        return horoscope
+
+    def get(self, sign:str, day:str = "TODAY") -> str:
+        key = self._key(sign, day)
+        horoscope = self.cache.get(key)
+        if horoscope is None:
+            horoscope = self._fetch_once(key)
+        return horoscope
+
+    async def aget(self, sign:str, day:str = "TODAY") -> str:
+        key = self._key(sign, day)
+        horoscope = self.cache.get(key)
+        if horoscope is None:
+            horoscope = await self._afetch_once(key)
+        return horoscope
+
+    def prewarm(self, days:tuple[str, ...] = ("TODAY",)) -> int:
+        '''
+        Fetches every sign for the given days. Returns the number of horoscopes fetched.
+        '''
+        fetched = 0
+        for day in days:
+            for sign in SIGNS:
+                key = self._key(sign, day)
+                # Looked up without counting, so pre-warming does not skew the hit rate
+                if self.cache.peek(key) is not None:
+                    continue
+                try:
+                    self._fetch_once(key)
+                    fetched += 1
+                except Exception as e:
+                    _logs.warning(f'Pre-warm failed for {key}: {e!r}')
+        _logs.info(f'Pre-warmed {fetched} horoscopes for {days}')
+        return fetched
+
+    def start_prewarm(self, days:tuple[str, ...] = ("TODAY", "TOMORROW"), offset_seconds:float = 60):
+        '''
+        Starts a daemon thread that pre-warms all signs now and again shortly after every midnight.
+        '''
+        if self._prewarm_thread is not None and self._prewarm_thread.is_alive():
+            return
+
+        def run():
+            while not self._stop.is_set():
+                self.prewarm(days)
+                wait = seconds_until_tomorrow() + offset_seconds
+                self._stop.wait(wait)
+
+        self._stop.clear()
+        self._prewarm_thread = threading.Thread(target=run, name="horoscope-prewarm", daemon=True)
+        self._prewarm_thread.start()
+
+    def stop_prewarm(self):
+        self._stop.set()
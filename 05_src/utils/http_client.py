@@ -0,0 +1,134 @@
+import asyncio
+import random
+import threading
+from typing import Optional
+import weakref
+
+from dotenv import load_dotenv
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import os
+
+from utils.logger import get_logger
+from utils.tracing import span
+
+_logs = get_logger(__name__)
+
+load_dotenv()
+
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.5))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class _TimeoutSession(requests.Session):
+    '''
+    A requests session that applies a default timeout to every request.
+    '''
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def get_session() -> requests.Session:
+    '''
+    Returns the process-wide requests session, with keep-alive connection pooling,
+    a default (connect, read) timeout, and retries with exponential backoff on
+    connection errors and 429/5xx responses.
+    '''
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = _TimeoutSession(timeout=(HTTP_CONNECT_TIMEOUT, HTTP_TIMEOUT))
+                retry = Retry(
+                    total=HTTP_RETRIES,
+                    backoff_factor=HTTP_BACKOFF,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=frozenset(['GET', 'HEAD']),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def http_get(url:str, params:Optional[dict] = None, timeout:Optional[float] = None) -> requests.Response:
+    '''
+    GET through the shared session. timeout overrides the default read timeout.
+    '''
+    kwargs = {'params': params}
+    if timeout is not None:
+        kwargs['timeout'] = (HTTP_CONNECT_TIMEOUT, timeout)
+    with span("http.get", "client", url=url) as current:
+        response = get_session().get(url, **kwargs)
+        if current is not None:
+            retries = getattr(response.raw, 'retries', None)
+            current.set(status=response.status_code, retries=len(retries.history) if retries else 0)
+    return response
+
+
+def get_async_client() -> httpx.AsyncClient:
+    '''
+    Returns the pooled httpx client for the running event loop.
+    httpx clients cannot be shared across event loops, so one is kept per loop.
+    '''
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+            follow_redirects=True,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def async_http_get(url:str, params:Optional[dict] = None, timeout:Optional[float] = None) -> httpx.Response:
+    '''
+    Async GET through the pooled client, retrying 429/5xx responses and transport errors with exponential backoff.
+    '''
+    client = get_async_client()
+    kwargs = {'params': params}
+    if timeout is not None:
+        kwargs['timeout'] = httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT)
+    with span("http.get", "client", url=url) as current:
+        for attempt in range(HTTP_RETRIES + 1):
+            if current is not None:
+                current.set(retries=attempt)
+            try:
+                response = await client.get(url, **kwargs)
+                if response.status_code not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                    if current is not None:
+                        current.set(status=response.status_code)
+                    return response
+                _logs.warning(f'GET {url} returned {response.status_code}, retrying')
+            except httpx.TransportError as e:
+                if attempt == HTTP_RETRIES:
+                    raise
+                _logs.warning(f'GET {url} failed with {e!r}, retrying')
+            await asyncio.sleep(HTTP_BACKOFF * (2 ** attempt) * (1 + random.random() / 2))
+
+
+async def close_async_clients():
+    for client in list(_async_clients.values()):
+        await client.aclose()
+    _async_clients.clear()
@@ -1,4 +1,10 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import threading
 from datetime import datetime
 
 from dotenv import load_dotenv
@@ -8,27 +14,121 @@ load_dotenv()
 
 LOG_DIR = os.getenv('LOG_DIR', './logs/')
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# text or json (one JSON object per line in the log file)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# size, time or none
+LOG_ROTATION = os.getenv('LOG_ROTATION', 'size')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', 'midnight')
+
+_queue_handler = None
+_listener = None
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats records as JSON lines.
+    '''
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "function": record.funcName,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    '''
+    Hands records to the listener thread with only the message interpolated, so the
+    listener's formatters (text or JSON) still see the record's fields.
+    '''
+
+    def prepare(self, record):
+        # Arguments may be mutable objects, so the message is fixed before the caller moves on
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _get_file_handler(log_dir:str) -> logging.Handler:
+    path = os.path.join(log_dir, f'{ datetime.now().strftime("%Y%m%d_%H%M%S") }.log')
+    if LOG_ROTATION == 'size':
+        return logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+    if LOG_ROTATION == 'time':
+        return logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT)
+    return logging.FileHandler(path)
+
+
+def _configure(log_dir:str) -> logging.Handler:
+    '''
+    Sets up the process-wide handlers once: records go through a queue to a listener thread
+    that writes the log file and the console, so logging never blocks on I/O.
+    '''
+    global _queue_handler, _listener
+    with _configure_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+        os.makedirs(log_dir, exist_ok=True)
+
+        f_handler = _get_file_handler(log_dir)
+        if LOG_FORMAT == 'json':
+            f_format = JsonFormatter()
+        else:
+            f_format = logging.Formatter('%(asctime)s, %(name)s, %(filename)s, %(lineno)d, %(funcName)s, %(levelname)s, %(message)s')
+        f_handler.setFormatter(f_format)
+
+        s_handler = logging.StreamHandler()
+        s_format = logging.Formatter('%(asctime)s, %(filename)s, %(lineno)d, %(levelname)s, %(message)s')
+        s_handler.setFormatter(s_format)
+
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, f_handler, s_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+        _queue_handler = _QueueHandler(log_queue)
+    return _queue_handler
+
+
+def shutdown():
+    '''
+    Writes out queued records and stops the listener thread.
+    '''
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+        _listener = None
+
 
 def get_logger(name, log_dir = LOG_DIR, log_level = LOG_LEVEL):
 
     '''
     Set up a logger with the given name and log level.
+    All loggers share one set of handlers, created on the first call in the process.
     '''
     _logs = logging.getLogger(name)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
-    f_handler = logging.FileHandler(os.path.join(log_dir, f'{ datetime.now().strftime("%Y%m%d_%H%M%S") }.log'))
-    f_format = logging.Formatter('%(asctime)s, %(name)s, %(filename)s, %(lineno)d, %(funcName)s, %(levelname)s, %(message)s')
-    f_handler.setFormatter(f_format)
-    
-    s_handler = logging.StreamHandler()
-    s_format = logging.Formatter('%(asctime)s, %(filename)s, %(lineno)d, %(levelname)s, %(message)s')
-    s_handler.setFormatter(s_format)
-    
-    if not len(_logs.handlers):
-        _logs.addHandler(f_handler)
-        _logs.addHandler(s_handler)
-    
+    handler = _configure(log_dir)
+    if handler not in _logs.handlers:
+        _logs.addHandler(handler)
     _logs.setLevel(log_level)
     return _logs
@@ -0,0 +1,196 @@
+"""
+Pitchfork review lookups shared by the course_chat music tool and the music MCP server:
+the vector collection, the pooled SQL engine, the review caches and get_context().
+"""
+from pydantic import BaseModel, Field
+from dotenv import load_dotenv
+from functools import lru_cache
+from utils.logger import get_logger
+from utils.cache import get_cache
+import os
+import threading
+from typing import TYPE_CHECKING
+_logs = get_logger(__name__)
+load_dotenv()
+load_dotenv(".secrets")
+
+# chromadb, SQLAlchemy and the embedding client are imported and connected on first use
+# (or in warm_up()), so importing this module does not slow down start-up.
+if TYPE_CHECKING:
+    import chromadb
+    import sqlalchemy as sa
+
+
+vector_db_client_url="http://localhost:8000"
+
+# Created on first use by get_collection() and shared by every lookup in this process.
+_collection = None
+_collection_lock = threading.Lock()
+
+
+def get_collection():
+    """Returns the review collection: the Chroma collection, or the local vector index with VECTOR_BACKEND=local."""
+    global _collection
+    if _collection is None:
+        with _collection_lock:
+            if _collection is None:
+                from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+                embedding_function = OpenAIEmbeddingFunction(
+                    api_key = os.getenv("OPENAI_API_KEY"),
+                    model_name="text-embedding-3-small")
+
+                # VECTOR_BACKEND=local queries an in-process index built with utils.vector_index
+                # instead of the Chroma server; both return the same query() result shape.
+                if os.getenv("VECTOR_BACKEND", "chroma") == "local":
+                    from utils.vector_index import LocalVectorIndex
+                    _collection = LocalVectorIndex(os.getenv("VECTOR_INDEX_PATH", "./documents/pitchfork_index"),
+                                                   embedding_function=embedding_function,
+                                                   mode=os.getenv("VECTOR_INDEX_MODE", "exact"),
+                                                   nprobe=int(os.getenv("VECTOR_INDEX_NPROBE", 8)))
+                else:
+                    import chromadb
+                    chroma = chromadb.HttpClient(host=vector_db_client_url)
+                    _collection = chroma.get_collection(name="pitchfork_reviews",
+                                                        embedding_function=embedding_function)
+    return _collection
+
+
+# Created on first use by get_engine() and shared by every lookup in this process.
+_engine = None
+_engine_lock = threading.Lock()
+
+# Shared with every other music tool in the process: query results keyed on the
+# normalized query and n_results, and review details keyed on review ID.
+context_cache = get_cache("music_context",
+                          maxsize=int(os.getenv("MUSIC_CACHE_SIZE", 512)),
+                          ttl=float(os.getenv("MUSIC_CACHE_TTL", 3600)))
+details_cache = get_cache("music_review_details",
+                          maxsize=int(os.getenv("MUSIC_DETAILS_CACHE_SIZE", 4096)),
+                          ttl=float(os.getenv("MUSIC_DETAILS_CACHE_TTL", 86400)))
+
+
+class MusicReviewData(BaseModel):
+    """Structured music review data response."""
+    title: str = Field(..., description="The title of the album.")
+    artist: str = Field(..., description="The artist of the album.")
+    review: str = Field(..., description="A portion of the album review that is relevant to the user query.")
+    year: int = Field(None, description="The release year of the album.")
+    score: float = Field(None, description="The Pitchfork score of the album. The score is numeric and its scale is from 0 to 10, with 10 being the highest rating. Any album with a score greater than 8.0 is considered a must-listen; album with a score greater than 6.5 is good.")
+
+
+def get_engine() -> "sa.Engine":
+    """Returns the process-wide SQL engine, creating its connection pool on first use."""
+    global _engine
+    if _engine is None:
+        # The warm-up thread and the first request may get here at once; only one creates the pool
+        with _engine_lock:
+            if _engine is None:
+                import sqlalchemy as sa
+                _engine = sa.create_engine(
+                    os.getenv("SQL_URL"),
+                    pool_size=int(os.getenv("SQL_POOL_SIZE", 5)),
+                    max_overflow=int(os.getenv("SQL_MAX_OVERFLOW", 10)),
+                    pool_pre_ping=True,
+                )
+    return _engine
+
+
+@lru_cache(maxsize=1)
+def _details_query():
+    import sqlalchemy as sa
+    return sa.text("""
+    SELECT r.reviewid,
+		MIN(r.title) AS title,
+		MIN(r.artist) AS artist,
+		MIN(r.score) AS score,
+		MIN(g.genre) AS genre
+    FROM reviews AS r
+    LEFT JOIN genres as g
+	    ON r.reviewid = g.reviewid
+    WHERE r.reviewid IN :review_ids
+    GROUP BY r.reviewid
+    """).bindparams(sa.bindparam("review_ids", expanding=True))
+
+
+def warm_up():
+    """Connects the vector store and the SQL pool ahead of the first request."""
+    get_collection()
+    get_engine()
+    _details_query()
+
+
+def additional_details_bulk(review_ids:list[str]) -> dict[str, dict]:
+    """Fetches details for all review IDs in one round trip. Returns a dict keyed by review ID."""
+    unique_ids = list(dict.fromkeys(str(review_id) for review_id in review_ids))
+    details_by_id = details_cache.get_many(unique_ids)
+    to_fetch = [review_id for review_id in unique_ids if review_id not in details_by_id]
+    if not to_fetch:
+        return details_by_id
+    _logs.debug('Fetching additional details for review IDs: %s', to_fetch)
+    with get_engine().connect() as conn:
+        result = conn.execute(_details_query(), {"review_ids": to_fetch}).fetchall()
+    fetched = {}
+    for row in result:
+        fetched[str(row.reviewid)] = {
+            "reviewid": row.reviewid,
+            "album": row.title,
+            "score": row.score,
+            "artist": row.artist
+        }
+    details_cache.set_many(fetched)
+    details_by_id.update(fetched)
+    missing = [review_id for review_id in to_fetch if review_id not in fetched]
+    if missing:
+        _logs.warning(f'No details found for review IDs: {missing}')
+    return details_by_id
+
+
+def additional_details(review_id:str):
+    return additional_details_bulk([review_id]).get(str(review_id), {})
+    
+def get_reviewid_from_custom_id(custom_id:str):
+    return custom_id.split('_')[0]
+
+def normalize_query(query:str) -> str:
+    return " ".join(query.lower().split())
+
+def clear_music_caches():
+    context_cache.clear()
+    details_cache.clear()
+
+def get_context_data(query:str, collection:"chromadb.api.models.Collection", top_n:int):
+    cache_key = (collection.name, normalize_query(query), top_n)
+    cached = context_cache.get(cache_key)
+    if cached is not None:
+        _logs.debug('Context cache hit for query: %s', query)
+        return [dict(item) for item in cached]
+    results = collection.query(
+        query_texts=[query],
+        n_results=top_n
+    )
+    custom_ids = results['ids'][0]
+    review_ids = [get_reviewid_from_custom_id(custom_id) for custom_id in custom_ids]
+    details_by_id = additional_details_bulk(review_ids)
+    context_data = []
+    for idx, review_id in enumerate(review_ids):
+        details = dict(details_by_id.get(review_id, {}))
+        details['text'] = results['documents'][0][idx]
+        context_data.append(details)
+    context_cache.set(cache_key, [dict(item) for item in context_data])
+    return context_data
+
+def get_context(query:str, collection:"chromadb.api.models.Collection", top_n:int):
+    context_data = get_context_data(query, collection, top_n)
+    recommendations = []
+    if not context_data:
+        return recommendations
+    for item in context_data:
+
+        rec = MusicReviewData(
+            title=item.get('album', 'N/A'),
+            artist=item.get('artist', 'N/A'),
+            review=item.get('text', 'N/A'),
+            score=item.get('score', 0.0)
+        )
+        recommendations.append(rec)
+    return recommendations
@@ -0,0 +1,353 @@
+'''
+A response cache in front of the chat apps, persisted in SQLite so it survives restarts
+and is shared by the worker processes of a server.
+
+Replies are looked up on an exact key: a hash of the app, the model and instructions,
+the sanitized history and the normalized user message. With RESPONSE_CACHE_SEMANTIC=true,
+a miss is retried on embedding similarity: a reply cached for the same context (app,
+instructions and history) whose message is at least RESPONSE_CACHE_SIMILARITY similar.
+
+Caching is off unless the app is listed in RESPONSE_CACHE (e.g. RESPONSE_CACHE=course_chat,
+horoscope_chat, or "all"). Every app sets how long its replies stay fresh; replies that used
+tools are only cached if every tool is listed in tool_ttls, which caps that further (e.g. a
+horoscope for "today" until midnight). Entries expire after their TTL and the least recently
+used are evicted past maxsize.
+
+Report hit rates and latency saved per app with:
+    python -m utils.response_cache ./documents/response_cache.db
+'''
+import asyncio
+from dataclasses import dataclass
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Callable, Optional, Union
+
+from dotenv import load_dotenv
+import numpy as np
+import os
+
+from utils.logger import get_logger
+from utils.tracing import annotate, count
+
+_logs = get_logger(__name__)
+
+load_dotenv()
+
+# Apps whose replies are cached, comma-separated, or "all"
+RESPONSE_CACHE = {app.strip() for app in os.getenv("RESPONSE_CACHE", "").split(",") if app.strip()}
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "./documents/response_cache.db")
+# Entries kept per app
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 10000))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+# Cosine similarity a cached message needs to be served for a new one
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.95))
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+# Seconds before the in-memory embeddings of a context are reloaded, to see other workers' entries
+RESPONSE_CACHE_SEMANTIC_REFRESH = float(os.getenv("RESPONSE_CACHE_SEMANTIC_REFRESH", 60))
+
+# Tool name: None (cached for the app's TTL), a TTL in seconds, or a function of the call's
+# args returning one. Replies using tools not listed are not cached.
+ToolTTL = Optional[Union[float, Callable[[dict], float]]]
+
+_caches = []
+_caches_lock = threading.Lock()
+
+
+def response_cache_enabled(app:str) -> bool:
+    return bool(RESPONSE_CACHE & {app, "all"})
+
+
+def normalize_message(message:str) -> str:
+    return re.sub(r"\s+", " ", message).strip().casefold()
+
+
+def sanitize_history(history:list[dict]) -> list[dict]:
+    '''
+    Role and content of each message. Tool progress messages (with a metadata title) are display-only and skipped.
+    '''
+    return [{"role": msg.get("role"), "content": msg.get("content")} for msg in history
+            if not (msg.get("metadata") or {}).get("title")]
+
+
+def _hash(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@dataclass
+class CacheKey:
+    # Hash of the context and the normalized message
+    exact: str
+    # Hash of app, model, instructions and history: the entries a semantic match may come from
+    context: str
+    message: str
+    embedding: Optional[np.ndarray] = None
+
+
+@dataclass
+class CachedResponse:
+    reply: str
+    # "exact" or "semantic"
+    match: str
+    similarity: float
+    # Time it took to produce the reply originally
+    latency_ms: float
+
+
+def get_embedder(model:str = RESPONSE_CACHE_EMBEDDING_MODEL) -> Callable[[list[str]], list[list[float]]]:
+    '''
+    Returns a function embedding texts with the OpenAI embeddings API.
+    '''
+    from openai import OpenAI
+    client = OpenAI()
+
+    def embed(texts:list[str]) -> list[list[float]]:
+        response = client.embeddings.create(model=model, input=texts)
+        return [item.embedding for item in response.data]
+    return embed
+
+
+class ResponseCache:
+    '''
+    Caches the replies of one app for up to ttl seconds. Enabled if the app is listed in
+    RESPONSE_CACHE. Thread-safe; the async methods run lookups and stores (SQLite and the
+    embedding call) in worker threads.
+    '''
+
+    def __init__(self, app:str, ttl:float, path:str = RESPONSE_CACHE_DB,
+                 maxsize:int = RESPONSE_CACHE_SIZE, tool_ttls:Optional[dict[str, ToolTTL]] = None,
+                 enabled:Optional[bool] = None, semantic:bool = RESPONSE_CACHE_SEMANTIC,
+                 threshold:float = RESPONSE_CACHE_SIMILARITY,
+                 embed:Optional[Callable[[list[str]], list[list[float]]]] = None):
+        if not ttl or ttl <= 0:
+            raise ValueError(f'{app}: a response cache needs a TTL in seconds, got {ttl!r}')
+        if enabled is None:
+            enabled = response_cache_enabled(app)
+        self.app = app
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.tool_ttls = tool_ttls or {}
+        self.enabled = enabled
+        self.semantic = semantic
+        self.threshold = threshold
+        self._embed = embed
+        self._lock = threading.Lock()
+        # context hash: (loaded at, entry keys, normalized embedding matrix)
+        self._vectors = {}
+        self._stats = {"lookups": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0,
+                       "skipped_tool_calls": 0, "latency_saved_ms": 0.0}
+        self._conn = None
+        if enabled:
+            self._connect()
+        with _caches_lock:
+            _caches.append(self)
+
+    def _connect(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            # Several worker processes read and write the same file
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    app TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    context TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    reply TEXT NOT NULL,
+                    embedding BLOB,
+                    latency_ms REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (app, key)
+                )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_context ON responses (app, context)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (app, last_used)')
+
+    def key(self, message:str, history:list[dict], instructions:str = "", model:str = "") -> CacheKey:
+        context = _hash(self.app, model, _hash(instructions), sanitize_history(history))
+        normalized = normalize_message(message)
+        return CacheKey(exact=_hash(context, normalized), context=context, message=normalized)
+
+    def _get_embedding(self, key:CacheKey) -> np.ndarray:
+        if key.embedding is None:
+            if self._embed is None:
+                self._embed = get_embedder()
+            vector = np.asarray(self._embed([key.message])[0], dtype=np.float32)
+            key.embedding = vector / (np.linalg.norm(vector) or 1.0)
+        return key.embedding
+
+    def _context_vectors(self, context:str) -> tuple[list[str], Optional[np.ndarray]]:
+        loaded = self._vectors.get(context)
+        if loaded is not None and time.time() - loaded[0] < RESPONSE_CACHE_SEMANTIC_REFRESH:
+            return loaded[1], loaded[2]
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, embedding FROM responses WHERE app = ? AND context = ? AND embedding IS NOT NULL '
+                'AND expires_at > ?', (self.app, context, time.time())).fetchall()
+        keys = [row[0] for row in rows]
+        matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else None
+        self._vectors[context] = (time.time(), keys, matrix)
+        return keys, matrix
+
+    def _hit(self, key:str, match:str, similarity:float) -> Optional[CachedResponse]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT reply, latency_ms FROM responses WHERE app = ? AND key = ? AND expires_at > ?',
+                (self.app, key, now)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE responses SET hits = hits + 1, last_used = ? WHERE app = ? AND key = ?',
+                               (now, self.app, key))
+        return CachedResponse(reply=row[0], match=match, similarity=similarity, latency_ms=row[1])
+
+    def lookup(self, key:CacheKey) -> Optional[CachedResponse]:
+        '''
+        The cached reply for the key: an exact match, else (if enabled) the most similar message in the same context.
+        '''
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        cached = self._hit(key.exact, "exact", 1.0)
+        if cached is None and self.semantic:
+            try:
+                keys, matrix = self._context_vectors(key.context)
+                if matrix is not None:
+                    similarities = matrix @ self._get_embedding(key)
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.threshold:
+                        cached = self._hit(keys[best], "semantic", float(similarities[best]))
+            except Exception as e:
+                # A failing embedding call only costs the semantic tier
+                _logs.warning(f'{self.app}: semantic cache lookup failed: {e!r}')
+        self._record_lookup(cached, (time.perf_counter() - start) * 1000)
+        return cached
+
+    def _record_lookup(self, cached:Optional[CachedResponse], lookup_ms:float):
+        with self._lock:
+            self._stats["lookups"] += 1
+            if cached is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats[f"{cached.match}_hits"] += 1
+                self._stats["latency_saved_ms"] += max(cached.latency_ms - lookup_ms, 0.0)
+        if cached is None:
+            count("cache_misses")
+            annotate(response_cache="miss")
+        else:
+            count("cache_hits")
+            annotate(response_cache=cached.match, similarity=cached.similarity)
+            _logs.info(f'{self.app}: {cached.match} cache hit, saved {cached.latency_ms - lookup_ms:.0f} ms')
+
+    def _entry_ttl(self, tool_calls:list[dict]) -> Optional[float]:
+        ttl = self.ttl
+        for call in tool_calls:
+            if call["name"] not in self.tool_ttls:
+                return None
+            tool_ttl = self.tool_ttls[call["name"]]
+            if callable(tool_ttl):
+                tool_ttl = tool_ttl(call.get("args") or {})
+            if tool_ttl is not None:
+                ttl = min(ttl, tool_ttl)
+        return ttl
+
+    def store(self, key:CacheKey, reply:str, latency_ms:float, tool_calls:list[dict] = ()) -> bool:
+        '''
+        Caches a reply produced in latency_ms. tool_calls are the {"name", "args"} of the tools
+        the reply used. Returns False if the reply is not cacheable.
+        '''
+        if not self.enabled or not reply:
+            return False
+        ttl = self._entry_ttl(list(tool_calls))
+        if ttl is None or ttl <= 0:
+            with self._lock:
+                self._stats["skipped_tool_calls"] += 1
+            return False
+        embedding = None
+        if self.semantic:
+            try:
+                embedding = self._get_embedding(key).tobytes()
+            except Exception as e:
+                _logs.warning(f'{self.app}: could not embed the message, cached for exact matches only: {e!r}')
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (app, key, context, message, reply, embedding, latency_ms, hits, '
+                'created_at, last_used, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?)',
+                (self.app, key.exact, key.context, key.message, reply, embedding, latency_ms, now, now, now + ttl))
+            self._evict(now)
+            self._stats["stores"] += 1
+        self._vectors.pop(key.context, None)
+        return True
+
+    def _evict(self, now:float):
+        self._conn.execute('DELETE FROM responses WHERE app = ? AND expires_at <= ?', (self.app, now))
+        excess = self._conn.execute('SELECT COUNT(*) FROM responses WHERE app = ?', (self.app,)).fetchone()[0] - self.maxsize
+        if excess > 0:
+            self._conn.execute(
+                'DELETE FROM responses WHERE app = ? AND key IN '
+                '(SELECT key FROM responses WHERE app = ? ORDER BY last_used LIMIT ?)',
+                (self.app, self.app, excess))
+
+    async def alookup(self, key:CacheKey) -> Optional[CachedResponse]:
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self.lookup, key)
+
+    async def astore(self, key:CacheKey, reply:str, latency_ms:float, tool_calls:list[dict] = ()) -> bool:
+        if not self.enabled:
+            return False
+        return await asyncio.to_thread(self.store, key, reply, latency_ms, tool_calls)
+
+    def clear(self):
+        if self._conn is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM responses WHERE app = ?', (self.app,))
+        self._vectors.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats["exact_hits"] + stats["semantic_hits"]
+        return {"app": self.app, "enabled": self.enabled, "semantic": self.semantic,
+                **stats, "hit_rate": hits / stats["lookups"] if stats["lookups"] else 0.0}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+
+def get_response_cache_stats() -> list[dict]:
+    '''
+    Hit rates and latency saved by the response caches of this process.
+    '''
+    with _caches_lock:
+        return [cache.stats() for cache in _caches]
+
+
+def summarize_db(path:str = RESPONSE_CACHE_DB) -> list[dict]:
+    '''
+    Entries, hits and latency saved per app, over all processes that used the cache file.
+    '''
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute(
+            'SELECT app, COUNT(*), SUM(expires_at > ?), SUM(hits), SUM(hits * latency_ms) '
+            'FROM responses GROUP BY app ORDER BY app', (time.time(),)).fetchall()
+    return [{"app": app, "entries": entries, "fresh": fresh, "hits": hits, "latency_saved_s": (saved or 0) / 1000}
+            for app, entries, fresh, hits, saved in rows]
+
+
+if __name__ == "__main__":
+    for row in summarize_db(sys.argv[1] if len(sys.argv) > 1 else RESPONSE_CACHE_DB):
+        print(f'{row["app"]}: {row["entries"]} entries ({row["fresh"]} fresh), {row["hits"]} hits, '
+              f'{row["latency_saved_s"]:.1f} s saved')
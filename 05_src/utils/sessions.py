@@ -0,0 +1,281 @@
+import asyncio
+from dataclasses import dataclass
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+import uuid
+import weakref
+
+from dotenv import load_dotenv
+
+from utils.logger import get_logger
+
+_logs = get_logger(__name__)
+
+load_dotenv()
+
+SESSION_DB = os.getenv("SESSION_DB", "./documents/sessions.db")
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "./documents/checkpoints.db")
+# Seconds a session may be idle before it is forgotten with its checkpoint thread; 0 keeps sessions forever
+SESSION_TTL = float(os.getenv("SESSION_TTL", 7 * 24 * 3600))
+# Seconds between prunes of idle sessions
+SESSION_PRUNE_INTERVAL = float(os.getenv("SESSION_PRUNE_INTERVAL", 3600))
+
+# Columns added after the first release, created on existing databases at startup
+_MIGRATIONS = {
+    "input_tokens": "INTEGER",
+    "summary": "TEXT NOT NULL DEFAULT ''",
+    "summarized_turns": "INTEGER NOT NULL DEFAULT 0",
+}
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+_bound_graphs = weakref.WeakKeyDictionary()
+
+
+@dataclass
+class Session:
+    session_id: Optional[str]
+    thread_id: str
+    previous_response_id: Optional[str]
+    # False when the server-side state had to be (re)started; the caller then seeds it from the full history
+    resumed: bool
+    # Context size of the last model call, for apps that compact history themselves
+    input_tokens: Optional[int] = None
+    # Running summary of the first summarized_turns user turns, which are no longer sent
+    summary: str = ""
+    summarized_turns: int = 0
+    # Thread of the session's previous state when it had to be restarted, deleted once the turn is recorded
+    replaced_thread_id: Optional[str] = None
+
+
+def count_user_turns(history:list[dict]) -> int:
+    return sum(1 for msg in history if msg.get('role') == 'user')
+
+
+class SessionStore:
+    '''
+    Maps chat sessions to their server-side conversation state, a checkpointer thread
+    or a Responses API response id, persisted in SQLite.
+
+    A session resumes only if the client history has exactly the user turns the server
+    has seen. After a clear, undo, retry or edit it does not, and a new thread is started.
+    With checkpoints=True the threads live in the shared checkpointer and are deleted when
+    they are replaced or their session is pruned.
+    '''
+
+    def __init__(self, app:str, path:str = SESSION_DB, checkpoints:bool = False):
+        self.app = app
+        self.path = path
+        self.checkpoints = checkpoints
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._prune_thread = None
+        # Opened and migrated on first use, so creating a store at import does no I/O
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    if os.path.dirname(self.path):
+                        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    conn = sqlite3.connect(self.path, check_same_thread=False)
+                    with conn:
+                        conn.execute('''
+                            CREATE TABLE IF NOT EXISTS sessions (
+                                app TEXT NOT NULL,
+                                session_id TEXT NOT NULL,
+                                thread_id TEXT NOT NULL,
+                                previous_response_id TEXT,
+                                user_turns INTEGER NOT NULL,
+                                updated_at REAL NOT NULL,
+                                PRIMARY KEY (app, session_id)
+                            )''')
+                        columns = {row[1] for row in conn.execute('PRAGMA table_info(sessions)')}
+                        for column, definition in _MIGRATIONS.items():
+                            if column not in columns:
+                                conn.execute(f'ALTER TABLE sessions ADD COLUMN {column} {definition}')
+                    self._conn = conn
+        return self._conn
+
+    def begin_turn(self, session_id:Optional[str], history:list[dict]) -> Session:
+        self.start_pruning()
+        if session_id is None:
+            # Not called from a browser session; nothing to resume
+            return Session(None, str(uuid.uuid4()), None, False)
+        conn = self._connect()
+        with self._lock:
+            row = conn.execute(
+                'SELECT thread_id, previous_response_id, user_turns, input_tokens, summary, summarized_turns '
+                'FROM sessions WHERE app = ? AND session_id = ?',
+                (self.app, session_id)).fetchone()
+        if row is not None and row[2] == count_user_turns(history):
+            return Session(session_id, row[0], row[1], True, row[3], row[4], row[5])
+        if row is not None:
+            _logs.info(f'History of session {session_id} diverged from the server state, starting a new thread')
+            return Session(session_id, str(uuid.uuid4()), None, False, replaced_thread_id=row[0])
+        return Session(session_id, str(uuid.uuid4()), None, False)
+
+    def end_turn(self, session:Session, history:list[dict], previous_response_id:Optional[str] = None,
+                 input_tokens:Optional[int] = None, completed:bool = True):
+        '''
+        Records a completed turn: the history the turn was answered from, plus the new user message.
+        The session's summary and summarized_turns are stored as they are.
+        A turn that did not complete (the client went away mid-stream) may have left partial state
+        in its thread; the session is forgotten and its threads deleted, so the next turn starts over.
+        '''
+        if session.session_id is None:
+            return
+        conn = self._connect()
+        if not completed:
+            with self._lock, conn:
+                conn.execute('DELETE FROM sessions WHERE app = ? AND session_id = ?', (self.app, session.session_id))
+            thread_ids = [session.thread_id]
+            if session.replaced_thread_id is not None:
+                thread_ids.append(session.replaced_thread_id)
+            self._delete_threads(thread_ids)
+            session.replaced_thread_id = None
+            return
+        with self._lock, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (app, session_id, thread_id, previous_response_id, user_turns, '
+                'updated_at, input_tokens, summary, summarized_turns) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.app, session.session_id, session.thread_id, previous_response_id,
+                 count_user_turns(history) + 1, time.time(), input_tokens, session.summary,
+                 session.summarized_turns))
+        if session.replaced_thread_id is not None:
+            self._delete_threads([session.replaced_thread_id])
+            session.replaced_thread_id = None
+
+    async def abegin_turn(self, session_id:Optional[str], history:list[dict]) -> Session:
+        return await asyncio.to_thread(self.begin_turn, session_id, history)
+
+    async def aend_turn(self, session:Session, history:list[dict], previous_response_id:Optional[str] = None,
+                        input_tokens:Optional[int] = None, completed:bool = True):
+        await asyncio.to_thread(self.end_turn, session, history, previous_response_id, input_tokens, completed)
+
+    def _delete_threads(self, thread_ids:list[str]):
+        if not self.checkpoints or not thread_ids:
+            return
+        checkpointer = get_checkpointer()
+        for thread_id in thread_ids:
+            try:
+                checkpointer.delete_thread(thread_id)
+            except Exception as e:
+                _logs.warning(f'Could not delete checkpoint thread {thread_id}: {e!r}')
+
+    def prune(self, max_age_seconds:float = SESSION_TTL) -> int:
+        '''
+        Forgets the sessions idle for over max_age_seconds and deletes their checkpoint threads.
+        '''
+        conn = self._connect()
+        with self._lock, conn:
+            cutoff = time.time() - max_age_seconds
+            thread_ids = [row[0] for row in conn.execute(
+                'SELECT thread_id FROM sessions WHERE app = ? AND updated_at < ?', (self.app, cutoff))]
+            pruned = conn.execute('DELETE FROM sessions WHERE app = ? AND updated_at < ?',
+                                        (self.app, cutoff)).rowcount
+        self._delete_threads(thread_ids)
+        if pruned:
+            _logs.info(f'Pruned {pruned} {self.app} sessions idle for over {max_age_seconds:.0f} s')
+        return pruned
+
+    def start_pruning(self, interval:float = SESSION_PRUNE_INTERVAL, max_age_seconds:float = SESSION_TTL):
+        '''
+        Starts a daemon thread that prunes idle sessions now and every interval seconds.
+        Called by the first turn; does nothing with a TTL of 0.
+        '''
+        if max_age_seconds <= 0 or self._prune_thread is not None:
+            return
+        with self._lock:
+            if self._prune_thread is not None:
+                return
+
+            def run():
+                while not self._stop.is_set():
+                    try:
+                        self.prune(max_age_seconds)
+                    except Exception as e:
+                        _logs.warning(f'Pruning {self.app} sessions failed: {e!r}')
+                    self._stop.wait(interval)
+
+            self._prune_thread = threading.Thread(target=run, name=f"{self.app}-session-prune", daemon=True)
+            self._prune_thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._conn is not None:
+            self._conn.close()
+
+
+def thread_config(session:Session) -> dict:
+    return {"configurable": {"thread_id": session.thread_id}}
+
+
+def session_graph(graph, session:Session):
+    '''
+    Returns the graph to run a turn of session on: checkpointed for sessions with an id, the
+    bare graph otherwise. Turns without a session cannot be resumed, so they write no checkpoints.
+    '''
+    return graph if session.session_id is None else with_checkpointer(graph)
+
+
+def _make_checkpointer(conn:sqlite3.Connection):
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class ThreadedSqliteSaver(SqliteSaver):
+        '''
+        SqliteSaver with its async methods run in worker threads, so one saver (and one
+        connection, guarded by the saver's lock) serves both sync and async graph runs.
+        '''
+
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            items = await asyncio.to_thread(
+                lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    return ThreadedSqliteSaver(conn)
+
+
+def get_checkpointer():
+    '''
+    Returns the process-wide SQLite checkpointer, a local stand-in for a database-backed one.
+    '''
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                if os.path.dirname(CHECKPOINT_DB):
+                    os.makedirs(os.path.dirname(CHECKPOINT_DB), exist_ok=True)
+                _checkpointer = _make_checkpointer(sqlite3.connect(CHECKPOINT_DB, check_same_thread=False))
+    return _checkpointer
+
+
+def with_checkpointer(graph):
+    '''
+    Returns a copy of a compiled graph that checkpoints to the shared SQLite saver.
+    Runs of the copy need a thread_id in their config (see thread_config).
+    '''
+    with _checkpointer_lock:
+        bound = _bound_graphs.get(graph)
+    if bound is None:
+        bound = graph.copy(update={"checkpointer": get_checkpointer()})
+        with _checkpointer_lock:
+            bound = _bound_graphs.setdefault(graph, bound)
+    return bound
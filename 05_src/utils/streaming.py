@@ -0,0 +1,114 @@
+import json
+from typing import AsyncIterator, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+
+from utils.logger import get_logger
+
+_logs = get_logger(__name__)
+
+PREVIEW_CHARS = 200
+
+
+def history_to_messages(history:list[dict]) -> tuple[list, int]:
+    '''
+    Converts Gradio chat history to LangChain messages and counts the assistant turns.
+    Tool progress messages (assistant messages with a metadata title) are display-only and skipped.
+    '''
+    messages = []
+    n = 0
+    for msg in history:
+        if (msg.get('metadata') or {}).get('title'):
+            continue
+        if msg['role'] == 'user':
+            messages.append(HumanMessage(content=msg['content']))
+        elif msg['role'] == 'assistant':
+            messages.append(AIMessage(content=msg['content']))
+            n += 1
+    return messages, n
+
+
+class ChatStream:
+    '''
+    Accumulates a streamed reply as Gradio chat messages: text, interleaved with one
+    collapsible progress message per tool call. Yield .messages after every update.
+    '''
+
+    def __init__(self):
+        self._messages = []
+        self._tools = {}
+        self._text = None
+
+    def add_text(self, delta:str):
+        if not delta:
+            return
+        if self._text is None:
+            self._text = {"role": "assistant", "content": ""}
+            self._messages.append(self._text)
+        self._text["content"] += delta
+
+    def start_tool(self, call_id:str, name:str, args:Optional[dict] = None):
+        if call_id in self._tools:
+            return
+        message = {
+            "role": "assistant",
+            "content": json.dumps(args) if args else "",
+            "metadata": {"title": f"🛠️ Using {name}", "id": call_id, "status": "pending"}
+        }
+        self._tools[call_id] = message
+        self._messages.append(message)
+        # Text after a tool call belongs to the next model turn
+        self._text = None
+
+    def finish_tool(self, call_id:str, output:str):
+        message = self._tools.get(call_id)
+        if message is None:
+            return
+        preview = output if len(output) <= PREVIEW_CHARS else output[:PREVIEW_CHARS] + "…"
+        message["content"] = (message["content"] + "\n\n" if message["content"] else "") + preview
+        message["metadata"]["status"] = "done"
+
+    @property
+    def messages(self) -> list[dict]:
+        return [{**m, "metadata": dict(m["metadata"])} if "metadata" in m else dict(m) for m in self._messages]
+
+
+async def astream_graph(graph, state:dict, config:Optional[dict] = None,
+                        model_nodes:Optional[set[str]] = None,
+                        final:Optional[dict] = None) -> AsyncIterator[list[dict]]:
+    '''
+    Streams a LangGraph agent run as Gradio chat messages: model tokens as they are
+    generated, with tool calls shown as they start and finish.
+    model_nodes restricts token streaming to the given nodes.
+    If final is given, it is updated with the state values at the end of the run.
+    '''
+    stream = ChatStream()
+    stream_mode = "messages" if final is None else ["messages", "values"]
+    async for item in graph.astream(state, config, stream_mode=stream_mode):
+        if final is not None:
+            mode, item = item
+            if mode == "values":
+                final.update(item)
+                continue
+        chunk, metadata = item
+        if model_nodes is not None and metadata.get("langgraph_node") not in model_nodes \
+                and not isinstance(chunk, ToolMessage):
+            continue
+        if isinstance(chunk, AIMessageChunk):
+            if isinstance(chunk.content, str):
+                stream.add_text(chunk.content)
+            for call in chunk.tool_call_chunks:
+                if call.get("name") and call.get("id"):
+                    stream.start_tool(call["id"], call["name"])
+        elif isinstance(chunk, AIMessage):
+            # Replies that were not streamed token by token arrive whole
+            if isinstance(chunk.content, str):
+                stream.add_text(chunk.content)
+            for call in chunk.tool_calls:
+                stream.start_tool(call["id"], call["name"], call["args"])
+        elif isinstance(chunk, ToolMessage):
+            stream.finish_tool(chunk.tool_call_id, str(chunk.content))
+        else:
+            continue
+        yield stream.messages
+    yield stream.messages
@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+import threading
+import time
+
+from utils.logger import get_logger
+from utils.tracing import span
+
+_logs = get_logger(__name__)
+
+
+class StepTimer:
+    '''
+    Records how long an agent took to build and how long each of its steps takes.
+    Thread-safe, so one timer can be shared by every invocation of a compiled agent.
+    Each step is also traced as a "<name>.<step>" span.
+    '''
+
+    def __init__(self, name:str):
+        self.name = name
+        self.startup_ms = None
+        self._steps = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def startup(self):
+        start = time.perf_counter()
+        yield
+        self.startup_ms = (time.perf_counter() - start) * 1000
+        _logs.info(f'{self.name} built in {self.startup_ms:.1f} ms')
+
+    @contextmanager
+    def step(self, step:str):
+        start = time.perf_counter()
+        try:
+            with span(f"{self.name}.{step}", "node") as current:
+                yield current
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                stats = self._steps.setdefault(step, {"count": 0, "total_ms": 0.0, "last_ms": 0.0})
+                stats["count"] += 1
+                stats["total_ms"] += elapsed
+                stats["last_ms"] = elapsed
+            _logs.debug('%s.%s took %.1f ms', self.name, step, elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            steps = {
+                step: {**s, "mean_ms": s["total_ms"] / s["count"]}
+                for step, s in self._steps.items()
+            }
+        return {"name": self.name, "startup_ms": self.startup_ms, "steps": steps}
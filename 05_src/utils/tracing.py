@@ -0,0 +1,422 @@
+'''
+Lightweight tracing: spans around graph nodes, tools, model calls and HTTP requests.
+
+Spans nest through a context variable, so a tool span started inside a node span (in the
+same thread or task) records the node as its parent. Traced generators make their span
+current again on every step, since servers like Gradio run each step in a fresh copy of the
+context; spans held open across a yield are started with an explicit parent and
+activate=False. Finished spans are aggregated in memory
+for p50/p95/p99 summaries. With TRACE_FILE set they are also written there as OTLP-style
+JSON lines by a background thread.
+
+Export and summarize spans with:
+    TRACE_FILE=./logs/spans.jsonl python -m course_chat.app
+    python -m utils.tracing ./logs/spans.jsonl
+'''
+import atexit
+from collections import defaultdict, deque
+from contextlib import aclosing, contextmanager
+import contextvars
+from dataclasses import dataclass, field
+import functools
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from utils.logger import LOG_BACKUP_COUNT, LOG_MAX_BYTES, get_logger
+
+_logs = get_logger(__name__)
+
+load_dotenv()
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+# File that spans are exported to; by default they are kept in memory only
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+# Most recent spans per component kept for percentiles
+TRACE_WINDOW = int(os.getenv('TRACE_WINDOW', 10000))
+
+# Span attributes that are summed per component in summaries
+COUNTERS = ("input_tokens", "output_tokens", "retries", "cache_hits", "cache_misses")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: Optional[int] = None
+    attributes: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, attribute:str, n:int = 1):
+        self.attributes[attribute] = self.attributes.get(attribute, 0) + n
+
+    def to_json(self) -> dict:
+        '''
+        The span in the OTLP JSON span layout.
+        '''
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": value}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _from_otlp_value(value:dict):
+    return next(iter(value.values()))
+
+
+def _percentile(values:list[float], q:float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class Tracer:
+    '''
+    Collects finished spans: aggregates them per span name and hands them to the exporter.
+    '''
+
+    def __init__(self, path:Optional[str] = TRACE_FILE, window:int = TRACE_WINDOW):
+        self.path = path
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        self._totals = defaultdict(lambda: defaultdict(int))
+        self._listener = None
+        self._exporter = None
+
+    def _get_exporter(self) -> Optional[logging.Logger]:
+        if not self.path or self._exporter is not None:
+            return self._exporter
+        with self._lock:
+            if self._exporter is None:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    self.path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                span_queue = queue.SimpleQueue()
+                self._listener = logging.handlers.QueueListener(span_queue, handler)
+                self._listener.start()
+                atexit.register(self.close)
+                exporter = logging.Logger(f'{__name__}.export')
+                exporter.addHandler(logging.handlers.QueueHandler(span_queue))
+                self._exporter = exporter
+        return self._exporter
+
+    def record(self, span:Span):
+        with self._lock:
+            self._durations[span.name].append(span.duration_ms)
+            totals = self._totals[span.name]
+            totals["count"] += 1
+            totals["errors"] += span.error is not None
+            for counter in COUNTERS:
+                value = span.attributes.get(counter)
+                if isinstance(value, (int, float)):
+                    totals[counter] += value
+        exporter = self._get_exporter()
+        if exporter is not None:
+            exporter.info(json.dumps(span.to_json(), default=str))
+
+    def summary(self) -> dict:
+        '''
+        Per span name: count, errors, latency percentiles over the recent window and counter totals.
+        '''
+        with self._lock:
+            return {
+                name: _summarize(list(self._durations[name]), totals)
+                for name, totals in sorted(self._totals.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._totals.clear()
+
+    def close(self):
+        with self._lock:
+            if self._listener is not None:
+                self._listener.stop()
+                for handler in self._listener.handlers:
+                    handler.close()
+            self._listener = None
+            self._exporter = None
+
+
+def _summarize(durations:list[float], totals:dict) -> dict:
+    summary = {"count": totals["count"], "errors": totals["errors"]}
+    if durations:
+        summary.update({
+            "p50_ms": _percentile(durations, 50),
+            "p95_ms": _percentile(durations, 95),
+            "p99_ms": _percentile(durations, 99),
+            "mean_ms": sum(durations) / len(durations),
+        })
+    summary.update({counter: totals[counter] for counter in COUNTERS if totals.get(counter)})
+    return summary
+
+
+tracer = Tracer()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def annotate(**attributes):
+    '''
+    Sets attributes on the current span, if any.
+    '''
+    span = _current_span.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def count(attribute:str, n:int = 1):
+    '''
+    Increments a counter attribute (e.g. cache_hits) on the current span, if any.
+    '''
+    span = _current_span.get()
+    if span is not None:
+        span.add(attribute, n)
+
+
+def record_usage(span:Optional[Span], usage):
+    '''
+    Adds token usage to a span. Accepts OpenAI usage objects (Responses or Chat Completions)
+    and LangChain usage_metadata dicts.
+    '''
+    if span is None or usage is None:
+        return
+    if isinstance(usage, dict):
+        input_tokens, output_tokens = usage.get("input_tokens"), usage.get("output_tokens")
+    else:
+        input_tokens = getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", None)
+        output_tokens = getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", None)
+    if input_tokens is not None:
+        span.add("input_tokens", input_tokens)
+    if output_tokens is not None:
+        span.add("output_tokens", output_tokens)
+
+
+@contextmanager
+def span(name:str, kind:str = "internal", parent:Optional[Span] = None, activate:bool = True, **attributes):
+    '''
+    Times the enclosed block as a span, nested under parent (by default the current span).
+    Yields the Span, or None when tracing is disabled. With activate=False the span is not
+    made current; use that for blocks that yield, whose steps may run in different contexts.
+    '''
+    if not TRACING_ENABLED:
+        yield None
+        return
+    parent = parent or _current_span.get()
+    current = Span(
+        name=name,
+        kind=kind,
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else None,
+        start_ns=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _current_span.set(current) if activate else None
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        if token is not None:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                _logs.warning(f'Span {name} ended in another context than it started in; '
+                              f'spans held across a yield need activate=False')
+        current.end_ns = time.time_ns()
+        tracer.record(current)
+
+
+@contextmanager
+def _activated(current:Optional[Span]):
+    # Makes current the current span for one step of a traced generator
+    if current is None:
+        yield
+        return
+    token = _current_span.set(current)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def _trace_steps(gen, current:Optional[Span]):
+    '''
+    Runs generator gen with current as the current span during each of its steps,
+    passing sent values and thrown exceptions through.
+    '''
+    method, value = gen.send, None
+    while True:
+        try:
+            with _activated(current):
+                item = method(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            method, value = gen.send, (yield item)
+        except GeneratorExit:
+            with _activated(current):
+                gen.close()
+            raise
+        except BaseException as e:
+            method, value = gen.throw, e
+
+
+async def _atrace_steps(agen, current:Optional[Span]):
+    method, value = agen.asend, None
+    while True:
+        try:
+            with _activated(current):
+                item = await method(value)
+        except StopAsyncIteration:
+            return
+        try:
+            method, value = agen.asend, (yield item)
+        except GeneratorExit:
+            with _activated(current):
+                await agen.aclose()
+            raise
+        except BaseException as e:
+            method, value = agen.athrow, e
+
+
+def traced(name:Optional[str] = None, kind:str = "internal"):
+    '''
+    Decorator that records each call of a function as a span. Coroutines are timed until
+    they return and (async) generators until they are exhausted.
+    '''
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def async_gen_wrapper(*args, **kwargs):
+                with span(span_name, kind, activate=False) as current:
+                    async with aclosing(_atrace_steps(fn(*args, **kwargs), current)) as steps:
+                        async for item in steps:
+                            yield item
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                with span(span_name, kind, activate=False) as current:
+                    return (yield from _trace_steps(fn(*args, **kwargs), current))
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, kind):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_tool(tool):
+    '''
+    Records every run of a LangChain tool, sync or async, as a "tool.<name>" span.
+    '''
+    if tool.func is not None:
+        tool.func = traced(f"tool.{tool.name}", "tool")(tool.func)
+    if getattr(tool, "coroutine", None) is not None:
+        tool.coroutine = traced(f"tool.{tool.name}", "tool")(tool.coroutine)
+    return tool
+
+
+def summarize_file(path:str) -> dict:
+    '''
+    Summarizes exported spans per span name, like Tracer.summary.
+    '''
+    durations = defaultdict(list)
+    totals = defaultdict(lambda: defaultdict(int))
+    with open(path, "r") as f:
+        for line in f:
+            item = json.loads(line)
+            name = item["name"]
+            durations[name].append((item["endTimeUnixNano"] - item["startTimeUnixNano"]) / 1e6)
+            totals[name]["count"] += 1
+            totals[name]["errors"] += item["status"]["code"] == 2
+            for attribute in item["attributes"]:
+                value = _from_otlp_value(attribute["value"])
+                if attribute["key"] in COUNTERS and isinstance(value, (int, float)):
+                    totals[name][attribute["key"]] += value
+    return {name: _summarize(durations[name], totals[name]) for name in sorted(totals)}
+
+
+def format_summary(summary:dict) -> str:
+    columns = ["count", "errors", "p50_ms", "p95_ms", "p99_ms", "mean_ms", *COUNTERS]
+    rows = [["span", *columns]]
+    for name, stats in summary.items():
+        rows.append([name] + [_format_value(stats.get(col)) for col in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 and not TRACE_FILE:
+        sys.exit("Usage: python -m utils.tracing <spans.jsonl> (or set TRACE_FILE)")
+    print(format_summary(summarize_file(sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE)))
@@ -0,0 +1,295 @@
+import json
+import os
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from utils.logger import get_logger
+
+_logs = get_logger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.f32"
+NORMS_FILE = "norms.npy"
+IDS_FILE = "ids.json"
+DOCUMENTS_FILE = "documents.bin"
+DOC_OFFSETS_FILE = "doc_offsets.npy"
+META_FILE = "meta.json"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_ORDER_FILE = "ivf_order.npy"
+IVF_OFFSETS_FILE = "ivf_offsets.npy"
+
+METRICS = ("l2", "cosine", "ip")
+
+
+def _topk(distances:np.ndarray, k:int) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns the positions and values of the k smallest distances in each row, sorted ascending.
+    '''
+    k = min(k, distances.shape[1])
+    if k == 0:
+        empty = np.empty((distances.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(distances.dtype)
+    if k < distances.shape[1]:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(distances.shape[1]), (distances.shape[0], 1))
+    part_dist = np.take_along_axis(distances, part, axis=1)
+    order = np.argsort(part_dist, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_dist, order, axis=1)
+
+
+class LocalVectorIndex:
+    '''
+    An in-process vector index over a memory-mapped float32 embedding matrix.
+
+    query() accepts the same arguments as a Chroma collection and returns the same
+    ids/documents/distances shape, so it can stand in for a chromadb Collection.
+    Distances follow Chroma's conventions: squared L2, 1 - cosine similarity, or 1 - inner product.
+    In "exact" mode every row is scanned; in "ivf" mode only the nprobe closest inverted lists are.
+    '''
+
+    def __init__(self, path:str,
+                 embedding_function:Optional[Callable] = None,
+                 mode:str = "exact",
+                 nprobe:int = 8,
+                 block_size:int = 65536):
+        if mode not in ("exact", "ivf"):
+            raise ValueError(f'Unknown index mode "{mode}". Use "exact" or "ivf".')
+        self.path = path
+        self.embedding_function = embedding_function
+        self.mode = mode
+        self.nprobe = nprobe
+        self.block_size = block_size
+
+        with open(os.path.join(path, META_FILE), "r") as f:
+            self.meta = json.load(f)
+        self.name = self.meta["name"]
+        self.metric = self.meta["metric"]
+        self.count = self.meta["count"]
+        self.dim = self.meta["dim"]
+
+        self.embeddings = np.memmap(os.path.join(path, EMBEDDINGS_FILE), dtype=np.float32,
+                                    mode="r", shape=(self.count, self.dim))
+        self.norms = np.load(os.path.join(path, NORMS_FILE), mmap_mode="r")
+        self.doc_offsets = np.load(os.path.join(path, DOC_OFFSETS_FILE), mmap_mode="r")
+        self.documents = np.memmap(os.path.join(path, DOCUMENTS_FILE), dtype=np.uint8, mode="r") \
+            if self.doc_offsets[-1] > 0 else np.empty(0, dtype=np.uint8)
+        with open(os.path.join(path, IDS_FILE), "r") as f:
+            self.ids = json.load(f)
+
+        if mode == "ivf":
+            if not os.path.exists(os.path.join(path, IVF_CENTROIDS_FILE)):
+                raise ValueError(f'Index at {path} has no IVF lists. Build it with train_ivf().')
+            self.centroids = np.load(os.path.join(path, IVF_CENTROIDS_FILE))
+            self.ivf_order = np.load(os.path.join(path, IVF_ORDER_FILE), mmap_mode="r")
+            self.ivf_offsets = np.load(os.path.join(path, IVF_OFFSETS_FILE))
+        _logs.info(f'Loaded local vector index {self.name} with {self.count} vectors ({mode} mode)')
+
+    def __len__(self):
+        return self.count
+
+    def get_document(self, row:int) -> str:
+        start, end = int(self.doc_offsets[row]), int(self.doc_offsets[row + 1])
+        return bytes(self.documents[start:end]).decode("utf-8")
+
+    def _search_exact(self, queries:np.ndarray, k:int) -> tuple[np.ndarray, np.ndarray]:
+        best_rows = np.empty((queries.shape[0], 0), dtype=np.int64)
+        best_dist = np.empty((queries.shape[0], 0), dtype=np.float32)
+        for start in range(0, self.count, self.block_size):
+            block = np.asarray(self.embeddings[start:start + self.block_size])
+            dist = self._block_distances(queries, block, start)
+            pos, vals = _topk(dist, k)
+            best_rows = np.concatenate([best_rows, pos + start], axis=1)
+            best_dist = np.concatenate([best_dist, vals], axis=1)
+            if best_rows.shape[1] > k:
+                pos, best_dist = _topk(best_dist, k)
+                best_rows = np.take_along_axis(best_rows, pos, axis=1)
+        return best_rows, best_dist
+
+    def _block_distances(self, queries:np.ndarray, block:np.ndarray, start:int) -> np.ndarray:
+        dots = queries @ block.T
+        if self.metric == "ip":
+            return 1.0 - dots
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        r_norms = np.asarray(self.norms[start:start + block.shape[0]])
+        if self.metric == "cosine":
+            denom = np.sqrt(np.outer(q_norms, r_norms))
+            return 1.0 - dots / np.maximum(denom, 1e-12)
+        return np.maximum(q_norms[:, None] + r_norms[None, :] - 2.0 * dots, 0.0)
+
+    def _search_ivf(self, queries:np.ndarray, k:int) -> tuple[np.ndarray, np.ndarray]:
+        nprobe = min(self.nprobe, self.centroids.shape[0])
+        centroid_dist = np.einsum("ij,ij->i", self.centroids, self.centroids)[None, :] \
+            - 2.0 * queries @ self.centroids.T
+        probes, _ = _topk(centroid_dist, nprobe)
+        rows_out = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        dist_out = np.full((queries.shape[0], k), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([
+                self.ivf_order[self.ivf_offsets[p]:self.ivf_offsets[p + 1]] for p in probes[i]
+            ])
+            if candidates.size == 0:
+                continue
+            candidates.sort()
+            block = self.embeddings[candidates]
+            dots = block @ query
+            if self.metric == "ip":
+                dist = 1.0 - dots
+            else:
+                q_norm = float(query @ query)
+                r_norms = np.asarray(self.norms[candidates])
+                if self.metric == "cosine":
+                    dist = 1.0 - dots / np.maximum(np.sqrt(q_norm * r_norms), 1e-12)
+                else:
+                    dist = np.maximum(q_norm + r_norms - 2.0 * dots, 0.0)
+            pos, vals = _topk(dist[None, :], k)
+            rows_out[i, :pos.shape[1]] = candidates[pos[0]]
+            dist_out[i, :vals.shape[1]] = vals[0]
+        return rows_out, dist_out
+
+    def search(self, query_embeddings, k:int) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns the row numbers and distances of the k nearest vectors for each query embedding.
+        Rows are -1 when fewer than k candidates were found.
+        '''
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if self.mode == "ivf":
+            return self._search_ivf(queries, k)
+        return self._search_exact(queries, k)
+
+    def query(self, query_texts:Optional[list[str]] = None,
+              query_embeddings:Optional[list] = None,
+              n_results:int = 10,
+              include:Iterable[str] = ("documents", "distances")) -> dict:
+        if query_embeddings is None:
+            if query_texts is None:
+                raise ValueError("Either query_texts or query_embeddings must be provided.")
+            if self.embedding_function is None:
+                raise ValueError("query_texts requires an embedding_function.")
+            query_embeddings = self.embedding_function(query_texts)
+        rows, distances = self.search(query_embeddings, n_results)
+        results = {"ids": [], "documents": [] if "documents" in include else None,
+                   "distances": [] if "distances" in include else None}
+        for q_rows, q_dist in zip(rows, distances):
+            valid = q_rows >= 0
+            q_rows, q_dist = q_rows[valid], q_dist[valid]
+            results["ids"].append([self.ids[row] for row in q_rows])
+            if results["documents"] is not None:
+                results["documents"].append([self.get_document(row) for row in q_rows])
+            if results["distances"] is not None:
+                results["distances"].append([float(d) for d in q_dist])
+        return results
+
+
+def build_index(path:str, records:Iterable[dict], name:str, metric:str = "l2") -> int:
+    '''
+    Writes a local vector index from an iterable of {"id", "embedding", "text"} records.
+    Records are streamed to disk, so memory use does not grow with the number of records.
+    Returns the number of vectors written.
+    '''
+    if metric not in METRICS:
+        raise ValueError(f'Unknown metric "{metric}". Use one of {METRICS}.')
+    os.makedirs(path, exist_ok=True)
+    ids = []
+    norms = []
+    doc_offsets = [0]
+    dim = None
+    with open(os.path.join(path, EMBEDDINGS_FILE), "wb") as emb_file, \
+         open(os.path.join(path, DOCUMENTS_FILE), "wb") as doc_file:
+        for record in records:
+            vector = np.asarray(record["embedding"], dtype=np.float32)
+            if dim is None:
+                dim = vector.shape[0]
+            elif vector.shape[0] != dim:
+                raise ValueError(f'Embedding for {record["id"]} has dimension {vector.shape[0]}, expected {dim}.')
+            emb_file.write(vector.tobytes())
+            text = (record.get("text") or "").encode("utf-8")
+            doc_file.write(text)
+            doc_offsets.append(doc_offsets[-1] + len(text))
+            norms.append(float(vector @ vector))
+            ids.append(record["id"])
+    np.save(os.path.join(path, NORMS_FILE), np.asarray(norms, dtype=np.float32))
+    np.save(os.path.join(path, DOC_OFFSETS_FILE), np.asarray(doc_offsets, dtype=np.int64))
+    with open(os.path.join(path, IDS_FILE), "w") as f:
+        json.dump(ids, f)
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump({"name": name, "metric": metric, "count": len(ids), "dim": dim or 0}, f)
+    _logs.info(f'Wrote local vector index {name} with {len(ids)} vectors to {path}')
+    return len(ids)
+
+
+def train_ivf(path:str, nlist:Optional[int] = None, n_iter:int = 10,
+              sample_size:int = 50000, block_size:int = 65536, seed:int = 42) -> int:
+    '''
+    Clusters the index with k-means and stores inverted lists for approximate search.
+    Returns the number of lists.
+    '''
+    with open(os.path.join(path, META_FILE), "r") as f:
+        meta = json.load(f)
+    count, dim = meta["count"], meta["dim"]
+    embeddings = np.memmap(os.path.join(path, EMBEDDINGS_FILE), dtype=np.float32,
+                           mode="r", shape=(count, dim))
+    nlist = nlist or max(1, int(4 * np.sqrt(count)))
+    nlist = min(nlist, count)
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+    sample = np.asarray(embeddings[sample_rows])
+    centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+
+    def assign(vectors):
+        dist = np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2.0 * vectors @ centroids.T
+        return np.argmin(dist, axis=1)
+
+    for _ in range(n_iter):
+        labels = assign(sample)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=nlist)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+
+    labels = np.concatenate([
+        assign(np.asarray(embeddings[start:start + block_size]))
+        for start in range(0, count, block_size)
+    ]) if count else np.empty(0, dtype=np.int64)
+    order = np.argsort(labels, kind="stable").astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+    np.save(os.path.join(path, IVF_CENTROIDS_FILE), centroids.astype(np.float32))
+    np.save(os.path.join(path, IVF_ORDER_FILE), order)
+    np.save(os.path.join(path, IVF_OFFSETS_FILE), offsets)
+    _logs.info(f'Trained {nlist} IVF lists for index at {path}')
+    return nlist
+
+
+def iter_chroma_records(collection, batch_size:int = 1000) -> Iterable[dict]:
+    '''
+    Pages through a Chroma collection and yields its records for build_index().
+    '''
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents"], limit=batch_size, offset=offset)
+        if not len(page["ids"]):
+            break
+        for record_id, embedding, text in zip(page["ids"], page["embeddings"], page["documents"]):
+            yield {"id": record_id, "embedding": embedding, "text": text}
+        offset += len(page["ids"])
+
+
+if __name__ == "__main__":
+    import argparse
+    import chromadb
+
+    parser = argparse.ArgumentParser(description="Export a Chroma collection to a local vector index.")
+    parser.add_argument("--chroma-url", default="http://localhost:8000")
+    parser.add_argument("--collection", default="pitchfork_reviews")
+    parser.add_argument("--index-path", default="./documents/pitchfork_index")
+    parser.add_argument("--metric", default="l2", choices=METRICS)
+    parser.add_argument("--ivf", action="store_true", help="Also train inverted lists for approximate search.")
+    parser.add_argument("--nlist", type=int, default=None)
+    args = parser.parse_args()
+
+    chroma = chromadb.HttpClient(host=args.chroma_url)
+    source = chroma.get_collection(name=args.collection)
+    build_index(args.index_path, iter_chroma_records(source), name=args.collection, metric=args.metric)
+    if args.ivf:
+        train_ivf(args.index_path, nlist=args.nlist)